@@ -0,0 +1,58 @@
+"""
+Measure how long the Flask app takes to serve its first DB-only request.
+
+Each sample runs in a fresh interpreter: import src.cloud.app, then GET
+/api/inventory and /api/recipe through the test client. Usage:
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from src.cloud.app import app
+imported = time.perf_counter()
+client = app.test_client()
+client.get("/api/inventory")
+client.get("/api/recipe")
+ready = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - start,
+    "ready_s": ready - start,
+    "tensorflow_loaded": "tensorflow" in sys.modules,
+}))
+"""
+
+def run_probe():
+    """Run one cold-start probe and return its timings."""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=project_root, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for the Flask app")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh-interpreter samples")
+    args = parser.parse_args()
+
+    samples = [run_probe() for _ in range(args.runs)]
+    report = {
+        "runs": args.runs,
+        "import_s_median": statistics.median(s["import_s"] for s in samples),
+        "ready_s_median": statistics.median(s["ready_s"] for s in samples),
+        "ready_s_max": max(s["ready_s"] for s in samples),
+        "tensorflow_loaded": any(s["tensorflow_loaded"] for s in samples),
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Offline benchmark suite for the database and detection hot paths.
+
+Builds a synthetic catalog in a temporary database, times the inventory and recipe
+functions, then times detect_items_from_images on generated JPEGs with a stub model
+and (with --real-model) an untrained MobileNetV2, and compares full-resolution
+load_img decoding against draft-mode decoding on multi-megapixel JPEGs. Results are printed as JSON;
+--compare flags any benchmark whose median got slower than a saved baseline.
+
+    python benchmarks/bench_suite.py --recipes 10000 --items 2000 --output baseline.json
+    python benchmarks/bench_suite.py --recipes 10000 --items 2000 --compare baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+import src.cloud.database as database
+import src.camera.simulation as simulation
+
+def summarize(samples):
+    """Median, p95 and mean of a list of durations in seconds, reported in milliseconds."""
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+    }
+
+def time_calls(function, runs, setup=None):
+    """Time `runs` calls of function(); setup() runs untimed before each call."""
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(runs):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            function()
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def build_catalog(recipes, items, ingredients_per_recipe, seed):
+    """Fill the current database with a synthetic vocabulary, recipes and inventory."""
+    rng = random.Random(seed)
+    vocabulary = [f"item{i:06d}" for i in range(max(items * 2, ingredients_per_recipe * 2))]
+    with database.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("INSERT OR IGNORE INTO food_items (item_name) VALUES (?)", [(n,) for n in vocabulary])
+        for i in range(recipes):
+            size = rng.randint(2, ingredients_per_recipe)
+            database.insert_recipe(cursor, f"Recipe {i:06d}", rng.sample(vocabulary, size))
+    database.apply_inventory_batch({name: rng.randint(1, 5) for name in rng.sample(vocabulary, items)})
+    return vocabulary
+
+def bench_database(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database.db_path = os.path.join(tmp, "bench.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            database.initialize_database()
+        start = time.perf_counter()
+        vocabulary = build_catalog(args.recipes, args.items, args.ingredients, args.seed)
+        results["db.build_catalog"] = summarize([time.perf_counter() - start])
+
+        rng = random.Random(args.seed)
+        results["db.add_to_inventory"] = time_calls(
+            lambda: database.add_to_inventory(rng.choice(vocabulary), 1), args.runs
+        )
+        results["db.remove_from_inventory"] = time_calls(
+            lambda: database.remove_from_inventory(rng.choice(vocabulary), 1), args.runs
+        )
+        results["db.get_matching_recipe"] = time_calls(database.get_matching_recipe, args.runs)
+        results["db.fetch_inventory"] = time_calls(database.fetch_inventory, args.runs)
+        results["db.fetch_inventory_uncached"] = time_calls(
+            database.fetch_inventory, args.runs, setup=database._read_cache.clear
+        )
+        results["db.get_recipes"] = time_calls(database.get_recipes, max(1, args.runs // 10))
+        results["db.get_recipes_uncached"] = time_calls(
+            database.get_recipes, max(1, args.runs // 10), setup=database._read_cache.clear
+        )
+        database.close_connections()
+    return results
+
+class StubModel:
+    """Returns fixed pseudo-random class probabilities, so only the pipeline is measured."""
+
+    cache_identity = "bench-stub"
+
+    def __init__(self, seed):
+        self.rng = np.random.default_rng(seed)
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        logits = self.rng.normal(0, 3, (len(batch), 1000))
+        probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+def write_images(folder, count, seed):
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        pixels = rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(folder, f"image{i:04d}.jpg"), quality=85)
+
+def use_offline_labels():
+    """Fall back to placeholder class names when the ImageNet class index cannot be downloaded."""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            simulation.imagenet_labels()
+    except Exception:
+        food = simulation.VALID_FOOD_KEYWORDS
+        simulation._imagenet_labels = [food[i % len(food)] if i % 10 == 0 else f"class_{i}" for i in range(1000)]
+
+def bench_detection(args):
+    results = {}
+    use_offline_labels()
+    models = {"stub": StubModel(args.seed), "stub_tta4": simulation.TTAModel(StubModel(args.seed), 4)}
+    if args.real_model:
+        from tensorflow.keras.applications import MobileNetV2  # type: ignore
+        # Untrained weights: the timing is the same and no download is needed
+        models["mobilenetv2"] = MobileNetV2(weights=None)
+        models["mobilenetv2_tta4"] = simulation.TTAModel(models["mobilenetv2"], 4)
+
+    with tempfile.TemporaryDirectory() as folder:
+        write_images(folder, args.images, args.seed)
+        from tensorflow.keras.preprocessing.image import ImageDataGenerator  # type: ignore
+        datagens = {
+            "datagen": ImageDataGenerator(horizontal_flip=True, brightness_range=[0.8, 1.2]),
+            "no_datagen": None,
+        }
+        for model_name, model in models.items():
+            # Trace both batch shapes before timing
+            for batch_size in (1, simulation.BATCH_SIZE):
+                model.predict(np.zeros((batch_size, 224, 224, 3), dtype=np.float32), verbose=0)
+            for datagen_name, datagen in datagens.items():
+                for batch_size in (1, simulation.BATCH_SIZE):
+                    name = f"detect.{model_name}.{datagen_name}.batch{batch_size}"
+                    results[name] = time_calls(
+                        lambda: simulation.detect_items_from_images(
+                            folder, model, datagen, simulation.CONFIDENCE_THRESHOLD,
+                            simulation.VALID_FOOD_KEYWORDS, simulation.MANUAL_MAPPINGS, batch_size=batch_size
+                        ),
+                        args.detection_runs
+                    )
+                    results[name]["images_per_s"] = args.images / (results[name]["median_ms"] / 1000)
+    return results
+
+def keras_decode(image_path):
+    """The previous decoding path: full-resolution load_img, then preprocess_input."""
+    from tensorflow.keras.applications.mobilenet_v2 import preprocess_input  # type: ignore
+    from tensorflow.keras.preprocessing.image import load_img, img_to_array  # type: ignore
+    return preprocess_input(img_to_array(load_img(image_path, target_size=(224, 224))))[np.newaxis]
+
+def bench_decode(args):
+    """Time load_img against draft-mode decode_image on multi-megapixel camera-sized JPEGs."""
+    from PIL import Image
+    results = {}
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        for width, height in ((1500, 2250), (4000, 3000), (6000, 4000)):
+            # Smooth gradients plus mild noise compress like a photo
+            y, x = np.mgrid[0:height, 0:width]
+            base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+            pixels = np.clip(base + rng.integers(-8, 9, base.shape), 0, 255).astype(np.uint8)
+            path = os.path.join(folder, f"photo_{width}x{height}.jpg")
+            Image.fromarray(pixels).save(path, quality=90)
+            megapixels = f"{width * height / 1e6:.1f}mp"
+
+            out = np.empty((224, 224, 3), dtype=np.float32)
+            results[f"decode.load_img.{megapixels}"] = time_calls(lambda: keras_decode(path), args.decode_runs)
+            results[f"decode.draft.{megapixels}"] = time_calls(
+                lambda: simulation.preprocess_image(path, None, out=out), args.decode_runs
+            )
+            results[f"decode.draft.{megapixels}"]["speedup"] = (
+                results[f"decode.load_img.{megapixels}"]["median_ms"] / results[f"decode.draft.{megapixels}"]["median_ms"]
+            )
+    return results
+
+def compare(results, baseline, threshold, min_delta_ms=0.0):
+    """
+    Return {name: {"baseline_ms", "current_ms", "change"}} for benchmarks whose median is more
+    than `threshold` (relative) and `min_delta_ms` (absolute) slower than the baseline.
+    """
+    regressions = {}
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None or not previous["median_ms"]:
+            continue
+        change = current["median_ms"] / previous["median_ms"] - 1
+        if change > threshold and current["median_ms"] - previous["median_ms"] > min_delta_ms:
+            regressions[name] = {
+                "baseline_ms": previous["median_ms"], "current_ms": current["median_ms"], "change": round(change, 3)
+            }
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the database and detection hot paths")
+    parser.add_argument("--suite", choices=["all", "db", "detection", "decode"], default="all")
+    parser.add_argument("--recipes", type=int, default=10000, help="Synthetic recipes in the catalog")
+    parser.add_argument("--items", type=int, default=2000, help="Distinct items in the inventory")
+    parser.add_argument("--ingredients", type=int, default=8, help="Maximum ingredients per recipe")
+    parser.add_argument("--runs", type=int, default=200, help="Timed calls per database function")
+    parser.add_argument("--images", type=int, default=64, help="Generated images for detection")
+    parser.add_argument("--detection-runs", type=int, default=3, help="Timed passes over the images")
+    parser.add_argument("--decode-runs", type=int, default=10, help="Timed decodes per image size")
+    parser.add_argument("--real-model", action="store_true", help="Also time an untrained MobileNetV2")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the report to this file")
+    parser.add_argument("--compare", help="Baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown before flagging (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this, which are timer noise")
+    args = parser.parse_args()
+
+    results = {}
+    if args.suite in ("all", "db"):
+        results.update(bench_database(args))
+    if args.suite in ("all", "detection"):
+        results.update(bench_detection(args))
+    if args.suite in ("all", "decode"):
+        results.update(bench_decode(args))
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "environment": {"python": platform.python_version(), "machine": platform.machine(), "numpy": np.__version__},
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        report["regressions"] = compare(results, baseline["results"], args.threshold, args.min_delta_ms)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    if report.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
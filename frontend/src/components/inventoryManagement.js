@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import API_BASE_URL from '../config';
 
 const InventoryManagement = () => {
@@ -24,8 +24,41 @@ const InventoryManagement = () => {
     }
   };
 
+  // Apply {item_name, quantity} deltas from the change stream; quantity 0 means removed
+  const applyChanges = (items) => {
+    setInventory((current) => {
+      const quantities = new Map(current.map((item) => [item.item_name, item.quantity]));
+      items.forEach(({ item_name, quantity }) => {
+        if (quantity > 0) {
+          quantities.set(item_name, quantity);
+        } else {
+          quantities.delete(item_name);
+        }
+      });
+      return Array.from(quantities, ([item_name, quantity]) => ({ item_name, quantity }));
+    });
+  };
+
+  // While the change stream is connected it keeps the inventory current, so no refetch is needed
+  const streamOpen = useRef(false);
+  const refreshInventory = () => {
+    if (!streamOpen.current) {
+      fetchInventory();
+    }
+  };
+
   useEffect(() => {
-    fetchInventory();
+    if (typeof EventSource === 'undefined') {
+      fetchInventory();
+      return undefined;
+    }
+    // EventSource reconnects by itself and resumes from the last event id it received
+    const source = new EventSource(`${API_BASE_URL}/inventory/stream`);
+    source.onopen = () => { streamOpen.current = true; };
+    source.onerror = () => { streamOpen.current = false; };
+    source.addEventListener('snapshot', (event) => setInventory(JSON.parse(event.data).items));
+    source.addEventListener('inventory', (event) => applyChanges(JSON.parse(event.data).items));
+    return () => source.close();
   }, []);
 
   // Fetch a recipe from the backend
@@ -47,6 +80,34 @@ const InventoryManagement = () => {
     }
   };
 
+  // Poll a simulation job until it finishes, showing progress as it goes
+  const pollSimulation = async (jobId) => {
+    let missing = 0;
+    while (true) {
+      const response = await fetch(`${API_BASE_URL}/simulate/${jobId}`);
+      // A 404 can be a job that was pruned or a database that was recreated; retry a few times first
+      if (response.status === 404 && missing < 3) {
+        missing += 1;
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        continue;
+      }
+      if (response.status === 404) {
+        return { status: 'failed', error: 'the simulation job is no longer available' };
+      }
+      if (!response.ok) {
+        throw new Error(response.statusText);
+      }
+      missing = 0;
+      const job = await response.json();
+      if (job.status === 'done' || job.status === 'failed') {
+        return job;
+      }
+      const { done, total } = job.progress;
+      setSimulationStatus(`Running simulation... ${done}/${total ?? '?'} images, ${job.detected_items.length} items found`);
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  };
+
   // Run simulation
   const runSimulation = async () => {
     try {
@@ -62,10 +123,17 @@ const InventoryManagement = () => {
       });
 
       if (response.ok) {
-        const data = await response.json();
-        console.log('Simulation result:', data);
-        setSimulationStatus('Simulation completed successfully!');
-        fetchInventory(); // Refresh inventory after simulation
+        const { job_id } = await response.json();
+        const job = await pollSimulation(job_id);
+        console.log('Simulation result:', job);
+        if (job.status === 'done') {
+          setSimulationStatus('Simulation completed successfully!');
+        } else {
+          setSimulationStatus(`Error running simulation: ${job.error}`);
+        }
+        refreshInventory(); // Refresh inventory after simulation
+      } else if (response.status === 503) {
+        setSimulationStatus('The simulator is busy, try again shortly.');
       } else {
         console.error("Error running simulation:", response.statusText);
         setSimulationStatus('Error running simulation.');
@@ -91,8 +159,7 @@ const InventoryManagement = () => {
       });
 
       if (response.ok) {
-        const addedItem = await response.json();
-        setInventory([...inventory, addedItem]);
+        refreshInventory();
         setNewItemName('');
         setNewItemQuantity(1);
       } else {
@@ -112,7 +179,7 @@ const InventoryManagement = () => {
   
       if (response.ok) {
         // Fetch the updated inventory from the backend
-        fetchInventory();
+        refreshInventory();
       } else {
         console.error("Error removing item from inventory:", response.statusText);
       }
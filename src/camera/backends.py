@@ -0,0 +1,175 @@
+#INFERENCE BACKENDS FOR THE CAMERA SIMULATION (KERAS OR QUANTIZED TFLITE)
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import numpy as np
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+sys.path.append(project_root)
+
+# Backend selection, overridable from the environment
+INFERENCE_BACKEND = os.environ.get("SEPP_INFERENCE_BACKEND", "keras")  # "keras", "tflite" or "server"
+TFLITE_QUANTIZATION = os.environ.get("SEPP_TFLITE_QUANTIZATION", "float16")  # "float16" or "int8"
+TFLITE_THREADS = int(os.environ.get("SEPP_TFLITE_THREADS", os.cpu_count() or 1))
+BACKENDS = ("keras", "tflite", "server")
+QUANTIZATIONS = ("float16", "int8")
+
+# Converted models are cached here so conversion only happens once
+model_dir = os.path.join(os.path.dirname(__file__), "models")
+image_dir = os.path.join(os.path.dirname(__file__), "images")
+
+def build_keras_model():
+    """Build the MobileNetV2 ImageNet classifier."""
+    from tensorflow.keras.applications.mobilenet_v2 import MobileNetV2  # type: ignore
+    return MobileNetV2(weights="imagenet")
+
+def tflite_model_path(quantization=TFLITE_QUANTIZATION):
+    return os.path.join(model_dir, f"mobilenet_v2_{quantization}.tflite")
+
+def calibration_images(image_folder=image_dir):
+    """Yield deterministic preprocessed (1, 224, 224, 3) arrays for every image in the folder."""
+    from src.camera.simulation import preprocess_image
+
+    for image_file in sorted(os.listdir(image_folder)):
+        try:
+            yield image_file, np.asarray(preprocess_image(os.path.join(image_folder, image_file), None), dtype=np.float32)
+        except Exception as e:
+            print(f"Skipping calibration image {image_file}: {e}")
+
+def export_tflite(quantization=TFLITE_QUANTIZATION, output_path=None, keras_model=None, image_folder=image_dir):
+    """
+    Convert the Keras model to TFLite with float16 or int8 quantization and write it to disk.
+    int8 calibrates activation ranges on the images in image_folder.
+    """
+    import tensorflow as tf  # type: ignore
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+    output_path = output_path or tflite_model_path(quantization)
+    keras_model = keras_model or build_keras_model()
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        converter.representative_dataset = lambda: ([image] for _, image in calibration_images(image_folder))
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "wb") as file:
+        file.write(converter.convert())
+    print(f"Exported {quantization} TFLite model to {output_path}")
+    return output_path
+
+def make_interpreter(model_path, num_threads=TFLITE_THREADS):
+    """Prefer the standalone LiteRT interpreter when installed, else the one bundled with TensorFlow."""
+    try:
+        from ai_edge_litert.interpreter import Interpreter  # type: ignore
+    except ImportError:
+        import tensorflow as tf  # type: ignore
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
+class TFLiteModel:
+    """
+    A TFLite interpreter exposed through the same `predict` interface as the Keras model.
+    """
+
+    def __init__(self, model_path, num_threads=TFLITE_THREADS):
+        self.model_path = model_path
+        self.name = os.path.basename(model_path)
+        with open(model_path, "rb") as file:
+            self.cache_identity = f"tflite:{hashlib.sha256(file.read()).hexdigest()}"
+        self.interpreter = make_interpreter(model_path, num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch = None
+        self._lock = threading.Lock()  # Interpreters are not thread-safe
+
+    def _resize(self, batch_size):
+        if self._batch != batch_size:
+            self.interpreter.resize_tensor_input(self.input_detail["index"], (batch_size, 224, 224, 3))
+            self.interpreter.allocate_tensors()
+            self.input_detail = self.interpreter.get_input_details()[0]
+            self.output_detail = self.interpreter.get_output_details()[0]
+            self._batch = batch_size
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        """Return the (N, 1000) probability matrix for a batch of preprocessed images."""
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            self._resize(len(batch))
+            scale, zero_point = self.input_detail["quantization"]
+            if scale:
+                batch = np.clip(np.round(batch / scale + zero_point), -128, 127)
+            self.interpreter.set_tensor(self.input_detail["index"], batch.astype(self.input_detail["dtype"]))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_detail["index"])
+            scale, zero_point = self.output_detail["quantization"]
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return np.array(output, dtype=np.float32)
+
+def load_backend(backend=None, quantization=None):
+    """
+    Return a model with a Keras-style `predict` for the configured backend.
+    The TFLite backend converts and caches the model on first use. The server backend
+    connects to a running model server (src/camera/model_server.py) instead of loading a model.
+    """
+    backend = backend or INFERENCE_BACKEND
+    quantization = quantization or TFLITE_QUANTIZATION
+    if backend == "keras":
+        return build_keras_model()
+    if backend == "tflite":
+        model_path = tflite_model_path(quantization)
+        if not os.path.exists(model_path):
+            export_tflite(quantization, model_path)
+        return TFLiteModel(model_path)
+    if backend == "server":
+        from src.camera.model_server import RemoteModel
+        return RemoteModel()
+    raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+
+def check_agreement(quantization=TFLITE_QUANTIZATION, image_folder=image_dir, keras_model=None, tflite_model=None):
+    """
+    Compare TFLite and Keras top-1 ImageNet classes on the images in image_folder.
+    """
+    keras_model = keras_model or build_keras_model()
+    tflite_model = tflite_model or load_backend("tflite", quantization)
+    images = list(calibration_images(image_folder))
+    if not images:
+        return {"images": 0, "top1_agreement": None, "disagreements": []}
+
+    batch = np.concatenate([image for _, image in images], axis=0)
+    keras_top1 = np.argmax(keras_model.predict(batch, verbose=0), axis=1)
+    tflite_top1 = np.argmax(tflite_model.predict(batch), axis=1)
+    agree = keras_top1 == tflite_top1
+    return {
+        "images": len(images),
+        "quantization": quantization,
+        "top1_agreement": float(agree.mean()),
+        "disagreements": [
+            {"image": name, "keras": int(k), "tflite": int(t)}
+            for (name, _), k, t, same in zip(images, keras_top1, tflite_top1, agree) if not same
+        ],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inference backend tools")
+    parser.add_argument("--export", action="store_true", help="Convert MobileNetV2 to TFLite and cache it on disk")
+    parser.add_argument("--check", action="store_true", help="Report top-1 agreement between TFLite and Keras")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default=TFLITE_QUANTIZATION)
+    parser.add_argument("--image-folder", default=image_dir)
+    args = parser.parse_args()
+
+    if args.export:
+        export_tflite(args.quantization, image_folder=args.image_folder)
+    if args.check:
+        print(json.dumps(check_agreement(args.quantization, args.image_folder), indent=2))
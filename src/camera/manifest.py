@@ -0,0 +1,125 @@
+#REMEMBERS WHICH IMAGES HAVE ALREADY BEEN INGESTED SO ONLY NEW OR CHANGED FILES ARE PROCESSED
+
+import os
+import threading
+import time
+
+from src.camera.prediction_cache import cache_path, connect_state_db
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp"}
+
+def is_image_file(file_name):
+    return os.path.splitext(file_name)[1].lower() in IMAGE_EXTENSIONS
+
+def scan_images(image_folder, settle=0.0):
+    """
+    Return {file_name: (size, mtime_ns, inode)} for the image files in the folder. With
+    settle > 0, files modified in the last `settle` seconds are left out, as they may still
+    be being written.
+    """
+    cutoff = time.time_ns() - int(settle * 1e9)
+    images = {}
+    with os.scandir(image_folder) as entries:
+        for entry in entries:
+            if not is_image_file(entry.name):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue  # removed while scanning
+            if settle and stat.st_mtime_ns > cutoff:
+                continue
+            images[entry.name] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    return images
+
+class IngestManifest:
+    """
+    Persistent record of the (size, mtime, inode) signature and detected item of every image
+    ingested from a folder. Stored next to the prediction cache.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cache_path
+        self._lock = threading.Lock()
+        self._conn = connect_state_db(self.path)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingest_manifest (
+                    folder TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    item_name TEXT,
+                    PRIMARY KEY (folder, file_name)
+                )
+            """)
+
+    def _entries(self, folder):
+        rows = self._conn.execute(
+            "SELECT file_name, size, mtime_ns, inode, item_name FROM ingest_manifest WHERE folder = ?", (folder,)
+        ).fetchall()
+        return {row[0]: ((row[1], row[2], row[3]), row[4]) for row in rows}
+
+    def changes(self, image_folder, settle=0.0):
+        """
+        Return {file_name: signature} for images that are new or whose signature differs from
+        the recorded one, and forget files that are no longer in the folder. A new name with the
+        exact signature of a vanished file is a rename: its record moves to the new name.
+        """
+        folder = os.path.realpath(image_folder)
+        images = scan_images(folder, settle)
+        with self._lock:
+            recorded = self._entries(folder)
+            gone = {recorded[name][0]: name for name in recorded if name not in images}
+            renamed = [
+                (name, gone.pop(signature)) for name, signature in images.items()
+                if name not in recorded and signature in gone
+            ]
+            if gone or renamed:
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE ingest_manifest SET file_name = ? WHERE folder = ? AND file_name = ?",
+                        [(new_name, folder, old_name) for new_name, old_name in renamed]
+                    )
+                    self._conn.executemany(
+                        "DELETE FROM ingest_manifest WHERE folder = ? AND file_name = ?",
+                        [(folder, name) for name in gone.values()]
+                    )
+                for new_name, old_name in renamed:
+                    recorded[new_name] = recorded.pop(old_name)
+        return {
+            name: signature for name, signature in sorted(images.items())
+            if name not in recorded or recorded[name][0] != signature
+        }
+
+    def new_detections(self, image_folder, results):
+        """
+        Return the items in (file_name, signature, item_name) results that are new detections:
+        those whose file has no recorded item, or a different one.
+        """
+        with self._lock:
+            recorded = self._entries(os.path.realpath(image_folder))
+        return [
+            item_name for file_name, _, item_name in results
+            if item_name is not None and recorded.get(file_name, (None, None))[1] != item_name
+        ]
+
+    def record(self, image_folder, results):
+        """Store (file_name, signature, item_name) results in one transaction."""
+        folder = os.path.realpath(image_folder)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ingest_manifest (folder, file_name, size, mtime_ns, inode, item_name) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(folder, file_name, *signature, item_name) for file_name, signature, item_name in results]
+            )
+
+    def clear(self, image_folder=None):
+        with self._lock, self._conn:
+            if image_folder is None:
+                self._conn.execute("DELETE FROM ingest_manifest")
+            else:
+                self._conn.execute("DELETE FROM ingest_manifest WHERE folder = ?", (os.path.realpath(image_folder),))
@@ -0,0 +1,257 @@
+#SHARED INFERENCE SERVER: ONE MODEL PER HOST, MICRO-BATCHED OVER A UNIX DOMAIN SOCKET
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+# Add project root to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+sys.path.append(project_root)
+
+from src.camera.prediction_cache import model_identity
+
+MODEL_SERVER_SOCKET = os.environ.get("SEPP_MODEL_SERVER_SOCKET", os.path.join(tempfile.gettempdir(), "sepp-model.sock"))
+MAX_BATCH = int(os.environ.get("SEPP_MODEL_SERVER_MAX_BATCH", "64"))  # Images per merged model call
+BATCH_WINDOW = float(os.environ.get("SEPP_MODEL_SERVER_WINDOW", "0.01"))  # Seconds to wait for more requests
+CLIENT_TIMEOUT = 120.0
+
+# Each message is a 4-byte big-endian header length, a JSON header, then header["nbytes"] raw bytes
+HEADER_LENGTH = struct.Struct("!I")
+
+def send_message(sock, header, payload=None):
+    payload = memoryview(b"") if payload is None else memoryview(np.ascontiguousarray(payload)).cast("B")
+    data = json.dumps(dict(header, nbytes=payload.nbytes)).encode("utf-8")
+    sock.sendall(HEADER_LENGTH.pack(len(data)) + data)
+    if payload.nbytes:
+        sock.sendall(payload)
+
+def recv_exact(sock, nbytes):
+    buffer = bytearray(nbytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < nbytes:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("connection closed mid-message")
+        received += count
+    return buffer
+
+def recv_message(sock):
+    """Return (header, payload bytes), or (None, None) if the peer closed the connection."""
+    first = sock.recv(HEADER_LENGTH.size, socket.MSG_WAITALL)
+    if not first:
+        return None, None
+    if len(first) < HEADER_LENGTH.size:
+        first += recv_exact(sock, HEADER_LENGTH.size - len(first))
+    header = json.loads(recv_exact(sock, HEADER_LENGTH.unpack(first)[0]))
+    return header, recv_exact(sock, header["nbytes"])
+
+def to_array(header, payload):
+    return np.frombuffer(payload, dtype=header["dtype"]).reshape(header["shape"])
+
+class MicroBatcher:
+    """
+    Merges predict requests from many threads into one model call. A batch closes when it
+    holds max_batch images or `window` seconds after its first request arrived. Requests are
+    never split, so a single request larger than max_batch runs as its own batch.
+    """
+
+    def __init__(self, model, max_batch=MAX_BATCH, window=BATCH_WINDOW):
+        self.model = model
+        self.max_batch = max_batch
+        self.window = window
+        self.batches = 0
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="model-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, images) -> Future:
+        future = Future()
+        self._requests.put((images, future))
+        return future
+
+    def stop(self):
+        self._requests.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._requests.get()
+        if first is None:
+            return None
+        batch, count = [first], len(first[0])
+        deadline = time.monotonic() + self.window
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._requests.put(None)  # stop after this batch
+                break
+            batch.append(request)
+            count += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                images = np.concatenate([images for images, _ in batch], axis=0)
+                predictions = np.asarray(self.model.predict(images, batch_size=len(images), verbose=0))
+                self.batches += 1
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for images, future in batch:
+                future.set_result(predictions[offset:offset + len(images)])
+                offset += len(images)
+
+class ModelRequestHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection: any number of identity or predict requests in turn."""
+
+    def handle(self):
+        while True:
+            try:
+                header, payload = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            if header is None:
+                return
+            try:
+                if header.get("op") == "identity":
+                    send_message(self.request, {"identity": self.server.identity})
+                elif header.get("op") == "predict":
+                    predictions = self.server.batcher.submit(to_array(header, payload)).result()
+                    predictions = np.asarray(predictions, dtype=np.float32)
+                    send_message(self.request, {"shape": predictions.shape, "dtype": "float32"}, predictions)
+                else:
+                    send_message(self.request, {"error": f"Unknown op: {header.get('op')}"})
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                send_message(self.request, {"error": str(e)})
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves `model` to every worker process on the host. Start with serve_forever();
+    close with shutdown() and server_close().
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, model, max_batch=MAX_BATCH, window=BATCH_WINDOW):
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+                raise RuntimeError(f"A model server is already listening on {socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(socket_path)  # left over from a server that exited
+            finally:
+                probe.close()
+        self.socket_path = socket_path
+        self.identity = model_identity(model)
+        self.batcher = MicroBatcher(model, max_batch, window)
+        super().__init__(socket_path, ModelRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.stop()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+class RemoteModel:
+    """
+    Client for a ModelServer with the same `predict` interface as the Keras model.
+    Each thread keeps its own connection.
+    """
+
+    def __init__(self, socket_path=MODEL_SERVER_SOCKET, timeout=CLIENT_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.name = f"remote:{socket_path}"
+        self._local = threading.local()
+        self.cache_identity = self._request({"op": "identity"})[0]["identity"]
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _request(self, header, payload=None):
+        # Retry once on a fresh connection, in case the server restarted since the last call
+        for attempt in range(2):
+            sock = self._connection()
+            try:
+                send_message(sock, header, payload)
+                response, data = recv_message(sock)
+                if response is None:
+                    raise ConnectionError("model server closed the connection")
+                break
+            except OSError as e:
+                # Never reuse a socket after a failed or partial exchange: a late reply to
+                # this request would be read as the answer to the next one
+                self._local.sock = None
+                sock.close()
+                if attempt or not isinstance(e, ConnectionError):
+                    raise
+        if "error" in response:
+            raise RuntimeError(f"Model server error: {response['error']}")
+        return response, data
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        """Return the (N, 1000) probability matrix for a batch of preprocessed images."""
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        response, data = self._request({"op": "predict", "shape": batch.shape, "dtype": "float32"}, batch)
+        return to_array(response, data)
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+def main():
+    from src.camera.backends import load_backend, BACKENDS, QUANTIZATIONS
+
+    parser = argparse.ArgumentParser(description="Serve the inference model to local worker processes")
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET, help="Unix domain socket path")
+    parser.add_argument("--backend", choices=[b for b in BACKENDS if b != "server"], default=None)
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default=None)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="Images per merged model call")
+    parser.add_argument("--window", type=float, default=BATCH_WINDOW, help="Seconds to wait for more requests")
+    args = parser.parse_args()
+
+    model = load_backend(args.backend, args.quantization)
+    server = ModelServer(args.socket, model, args.max_batch, args.window)
+    print(f"Model server listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#CACHES CAMERA PREDICTIONS SO UNCHANGED IMAGES ARE NOT RE-INFERRED
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.cloud import metrics
+from src.cloud.database import WAL_PRAGMAS
+
+# Sidecar database kept next to the camera simulation
+cache_path = os.path.join(os.path.dirname(__file__), "camera_state.db")
+MAX_CACHE_ENTRIES = 10000
+
+def connect_state_db(path):
+    """Open the camera sidecar database with the WAL settings of the pooled connections in database.py."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for pragma in WAL_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def hash_file(image_path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of the file's bytes."""
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def model_identity(model):
+    """
+    Describe the model for cache keys: its class, name and a hash of its output layer weights.
+    Models may set a `cache_identity` attribute to override this.
+    """
+    identity = getattr(model, "cache_identity", None)
+    if identity is not None:
+        return str(identity)
+    parts = [type(model).__name__, str(getattr(model, "name", ""))]
+    get_weights = getattr(model, "get_weights", None)
+    if callable(get_weights):
+        weights = get_weights()
+        if weights:
+            # Last two arrays are the classifier kernel and bias
+            classifier = weights[-2] if len(weights) > 1 else weights[-1]
+            parts.append(hashlib.sha256(classifier.tobytes()).hexdigest())
+    return ":".join(parts)
+
+def cache_namespace(model, confidence_threshold, valid_food_keywords, manual_mappings):
+    """Fingerprint the model and the keyword/mapping/threshold configuration."""
+    config = {
+        "model": model_identity(model),
+        "confidence_threshold": sorted((int(k), float(v)) for k, v in confidence_threshold.items()),
+        "valid_food_keywords": sorted(valid_food_keywords),
+        "manual_mappings": sorted(manual_mappings.items()),
+    }
+    return hashlib.sha256(json.dumps(config).encode("utf-8")).hexdigest()[:16]
+
+class PredictionCache:
+    """
+    Persistent prediction cache keyed by image content hash and cache namespace.
+    Least recently used entries are evicted once max_entries is exceeded. Hits are
+    remembered in memory and their last_used times written by the next put_many or flush.
+    """
+
+    def __init__(self, path=None, max_entries=MAX_CACHE_ENTRIES):
+        self.path = path or cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched = {}  # key -> last_used time not yet written
+        self._conn = connect_state_db(self.path)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS prediction_cache (
+                    key TEXT PRIMARY KEY,
+                    item_name TEXT,
+                    confidence REAL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_prediction_cache_last_used ON prediction_cache(last_used)"
+            )
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM prediction_cache").fetchone()[0]
+
+    @staticmethod
+    def make_key(content_hash, namespace):
+        return f"{namespace}:{content_hash}"
+
+    def get(self, key):
+        """Return (hit, prediction); prediction is None for images with no food item."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT item_name, confidence FROM prediction_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.CACHE_REQUESTS.inc("prediction", "miss")
+                return False, None
+            self.hits += 1
+            metrics.CACHE_REQUESTS.inc("prediction", "hit")
+            self._touched[key] = time.time()
+        return True, ((row[0], row[1]) if row[0] is not None else None)
+
+    def put_many(self, entries):
+        """
+        Store (key, prediction) pairs and the pending last_used updates of cache hits in one
+        transaction, and evict the oldest entries if needed.
+        """
+        now = time.time()
+        rows = [
+            (key, prediction[0] if prediction else None, float(prediction[1]) if prediction else None, now)
+            for key, prediction in entries
+        ]
+        with self._lock:
+            if not rows and not self._touched:
+                return
+            touched = [(last_used, key) for key, last_used in self._touched.items()]
+            self._touched.clear()
+            with self._conn:
+                self._conn.executemany("UPDATE prediction_cache SET last_used = ? WHERE key = ?", touched)
+                if not rows:
+                    return
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO prediction_cache (key, item_name, confidence, last_used) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._entries += self._conn.total_changes - before
+                if self._entries > self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM prediction_cache WHERE key IN "
+                        "(SELECT key FROM prediction_cache ORDER BY last_used LIMIT ?)",
+                        (self._entries - self.max_entries,)
+                    )
+                    self._entries = self.max_entries
+
+    def put(self, key, prediction):
+        self.put_many([(key, prediction)])
+
+    def flush(self):
+        """Write the pending last_used updates of cache hits."""
+        self.put_many([])
+
+    def stats(self):
+        """Return hit/miss counters and the current number of cached entries."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": self._entries}
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM prediction_cache")
+            self._touched.clear()
+            self._entries = 0
+            self.hits = self.misses = 0
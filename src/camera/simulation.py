@@ -1,15 +1,24 @@
+import argparse
+import json
 import os
 import sys
-import tensorflow as tf  # type: ignore
-from tensorflow.keras.applications.mobilenet_v2 import MobileNetV2, preprocess_input, decode_predictions  # type: ignore
-from tensorflow.keras.preprocessing.image import load_img, img_to_array  # type: ignore
-from tensorflow.keras.preprocessing.image import ImageDataGenerator  # type: ignore
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# TensorFlow is imported inside the functions that need it so that importing this
+# module (e.g. from the Flask app) stays fast and does not load the TF runtime.
 
 # Add project root to sys.path
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
 sys.path.append(project_root)
 
-from src.cloud.database import fetch_inventory, add_to_inventory
+from src.cloud.database import fetch_inventory, add_many_to_inventory, apply_inventory_batch
+from src.camera.prediction_cache import PredictionCache, cache_namespace, hash_file, model_identity
+from src.camera.backends import load_backend
+from src.camera.manifest import IngestManifest, is_image_file
+from src.cloud import metrics
 
 # Configuration constants
 VALID_FOOD_KEYWORDS = [
@@ -26,6 +35,108 @@ MANUAL_MAPPINGS = {
     "dough": "chicken breast"
 }
 CONFIDENCE_THRESHOLD = {0: 0.5, 1: 0.4, 2: 0.3}  # Dynamic confidence thresholds
+BATCH_SIZE = 32  # Images per model.predict call in batched mode
+DECODE_WORKERS = 4  # Threads decoding images while the model runs
+PREFETCH_BATCHES = 2  # Decoded batches allowed to queue up ahead of inference
+TOP_K = 5  # Top-ranked classes considered per image
+IMAGE_SIZE = (224, 224)  # MobileNetV2 input size (square, so PIL's (width, height) order doesn't matter)
+# Test-time augmentation: average the model's output over this many deterministic variants
+# of each image (flips and brightness changes); 0 or 1 predicts each image once
+TTA_VARIANTS = int(os.environ.get("SEPP_TTA_VARIANTS", "0"))
+# Apply the legacy random flip/brightness ImageDataGenerator to every image (nondeterministic)
+RANDOM_AUGMENTATION = os.environ.get("SEPP_RANDOM_AUGMENTATION") == "1"
+WATCH_INTERVAL = 2.0  # Seconds between folder scans in watch mode
+WATCH_SETTLE = 1.0  # Seconds a new file must go unmodified before watch mode ingests it
+
+# Same class index file Keras' decode_predictions uses
+CLASS_INDEX_URL = "https://storage.googleapis.com/download.tensorflow.org/data/imagenet_class_index.json"
+CLASS_INDEX_HASH = "c2c37ea517e94d9795004a39431a14cb"
+_imagenet_labels = None
+_food_lookups = {}
+
+STAGE_SECONDS = metrics.histogram(
+    "sepp_simulation_stage_seconds", "Time per simulation stage (decode, augment, preprocess, predict, resolve, hash)",
+    ["stage"]
+)
+IMAGES_PROCESSED = metrics.counter(
+    "sepp_images_processed_total", "Images processed by outcome (detected, no_food, error)", ["outcome"]
+)
+
+def load_model(backend=None, quantization=None, tta_variants=None):
+    """
+    Load the configured inference backend (Keras MobileNetV2 or a quantized TFLite model),
+    wrapped for test-time augmentation when tta_variants (default TTA_VARIANTS) is above 1.
+    TensorFlow is imported on first use.
+    """
+    model = load_backend(backend, quantization)
+    tta_variants = TTA_VARIANTS if tta_variants is None else tta_variants
+    if tta_variants > 1:
+        model = TTAModel(model, tta_variants)
+    return model
+
+def make_datagen():
+    """
+    Build the random augmentation generator, or None (the deterministic default) unless
+    RANDOM_AUGMENTATION is set.
+    """
+    if not RANDOM_AUGMENTATION:
+        return None
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator  # type: ignore
+    return ImageDataGenerator(horizontal_flip=True, brightness_range=[0.8, 1.2])
+
+# (horizontal flip, brightness factor) per test-time augmentation variant, in order of use
+TTA_TRANSFORMS = [(False, 1.0), (True, 1.0), (False, 0.8), (False, 1.2), (True, 0.8), (True, 1.2)]
+
+def augment_batch(batch, variants):
+    """
+    Expand a preprocessed batch (values in [-1, 1]) into `variants` deterministic variants per
+    image, laid out image-major: rows i * variants ... (i + 1) * variants - 1 belong to image i.
+    Brightness is scaled in pixel space, i.e. (x + 1) * factor - 1, clipped to [-1, 1].
+    """
+    if not 1 <= variants <= len(TTA_TRANSFORMS):
+        raise ValueError(f"variants must be between 1 and {len(TTA_TRANSFORMS)}")
+    batch = np.asarray(batch, dtype=np.float32)
+    flipped = batch[:, :, ::-1, :]
+    augmented = np.empty((len(batch), variants) + batch.shape[1:], dtype=np.float32)
+    for v, (flip, factor) in enumerate(TTA_TRANSFORMS[:variants]):
+        source = flipped if flip else batch
+        if factor == 1.0:
+            augmented[:, v] = source
+        else:
+            np.clip((source + 1.0) * factor - 1.0, -1.0, 1.0, out=augmented[:, v])
+    return augmented.reshape((-1,) + batch.shape[1:])
+
+class TTAModel:
+    """
+    Wraps a model so predict() runs every image's augmented variants in one batched call and
+    returns the class probabilities averaged over the variants.
+    """
+
+    def __init__(self, model, variants=TTA_VARIANTS):
+        self.model = model
+        self.variants = variants
+        self.cache_identity = f"{model_identity(model)}+tta{variants}"
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        augmented = augment_batch(batch, self.variants)
+        predictions = np.asarray(self.model.predict(augmented, batch_size=len(augmented), verbose=verbose))
+        return predictions.reshape(len(batch), self.variants, -1).mean(axis=1)
+
+def imagenet_labels():
+    """
+    Return the ImageNet class labels in model output order.
+    The class index file is downloaded once and cached by Keras.
+    """
+    global _imagenet_labels
+    if _imagenet_labels is None:
+        from tensorflow.keras.utils import get_file  # type: ignore
+        index_path = get_file(
+            "imagenet_class_index.json", CLASS_INDEX_URL, cache_subdir="models", file_hash=CLASS_INDEX_HASH
+        )
+        with open(index_path) as file:
+            class_index = json.load(file)
+        _imagenet_labels = [class_index[str(i)][1] for i in range(len(class_index))]
+    return _imagenet_labels
 
 def normalize_string(input_string):
     """
@@ -33,71 +144,358 @@ def normalize_string(input_string):
     """
     return input_string.lower().replace("_", " ")
 
-def preprocess_image(image_path, datagen):
+def decode_image(image_path, out=None):
+    """
+    Decode an image to 224x224 RGB scaled to MobileNetV2's [-1, 1] input range, writing into
+    `out` (a float32 array of shape (224, 224, 3)) when given. JPEGs use PIL's draft mode,
+    which downscales by 1/2, 1/4 or 1/8 during decoding, to the smallest size still at least
+    224x224; other formats are decoded at full size. Resizing is nearest-neighbour, as with
+    Keras' load_img.
+    """
+    from PIL import Image
+
+    if out is None:
+        out = np.empty(IMAGE_SIZE + (3,), dtype=np.float32)
+    with STAGE_SECONDS.time("decode"):
+        with Image.open(image_path) as img:
+            if img.format == "JPEG":
+                img.draft("RGB", IMAGE_SIZE)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            out[...] = np.asarray(img.resize(IMAGE_SIZE, Image.NEAREST))
+    with STAGE_SECONDS.time("preprocess"):
+        # Same scaling as mobilenet_v2.preprocess_input, in place
+        out /= 127.5
+        out -= 1.0
+    return out
+
+def preprocess_image(image_path, datagen, out=None):
+    """
+    Preprocess and, when a datagen is given, randomly augment the image. datagen=None is the
+    deterministic path. Returns a (1, 224, 224, 3) array, a view of `out` when it is given.
+    """
+    img_array = decode_image(image_path, out)
+    if datagen is not None:
+        with STAGE_SECONDS.time("augment"):
+            img_array[...] = datagen.random_transform(img_array)
+    return img_array[np.newaxis]
+
+def build_food_lookup(labels, valid_food_keywords, manual_mappings):
+    """
+    Compile the keyword list and manual mappings into a class-index -> food-item lookup.
+    Returns (food_items, item_index) where item_index[class_id] indexes food_items, or is -1.
+    """
+    food_items = []
+    positions = {}
+    item_index = np.full(len(labels), -1, dtype=np.int32)
+    keywords = set(valid_food_keywords)
+    for class_id, label in enumerate(labels):
+        normalized_label = normalize_string(label)
+        if normalized_label in manual_mappings:
+            food_item = manual_mappings[normalized_label]
+        elif normalized_label in keywords:
+            food_item = normalized_label
+        else:
+            continue
+        if food_item not in positions:
+            positions[food_item] = len(food_items)
+            food_items.append(food_item)
+        item_index[class_id] = positions[food_item]
+    return food_items, item_index
+
+def get_food_lookup(valid_food_keywords, manual_mappings):
     """
-    Preprocess and augment the image.
+    Return the compiled food lookup for this configuration, building it once.
     """
-    img = load_img(image_path, target_size=(224, 224))
-    img_array = img_to_array(img)
-    img_array = preprocess_input(img_array)
-    augmented = datagen.random_transform(img_array)
-    return tf.expand_dims(augmented, axis=0)
+    labels = imagenet_labels()
+    key = (tuple(labels), tuple(valid_food_keywords), tuple(sorted(manual_mappings.items())))
+    lookup = _food_lookups.get(key)
+    if lookup is None:
+        lookup = _food_lookups[key] = build_food_lookup(labels, valid_food_keywords, manual_mappings)
+    return lookup
+
+def resolve_predictions(predictions, confidence_threshold, valid_food_keywords, manual_mappings, top=TOP_K):
+    """
+    Map a (N, classes) probability matrix to one best (food_item, confidence) or None per row.
+    Takes the top `top` classes of each row, keeps those above their rank's threshold that map
+    to a food item, and picks the most confident one - all as whole-batch array operations.
+    """
+    probabilities = np.asarray(predictions)
+    food_items, item_index = get_food_lookup(valid_food_keywords, manual_mappings)
+    top = min(top, probabilities.shape[1])
+
+    top_classes = np.argpartition(-probabilities, top - 1, axis=1)[:, :top]
+    top_confidences = np.take_along_axis(probabilities, top_classes, axis=1)
+    order = np.argsort(-top_confidences, axis=1, kind="stable")
+    top_classes = np.take_along_axis(top_classes, order, axis=1)
+    top_confidences = np.take_along_axis(top_confidences, order, axis=1)
+
+    thresholds = np.array([confidence_threshold.get(i, 0.2) for i in range(top)])
+    top_items = item_index[top_classes]
+    valid = (top_items >= 0) & (top_confidences > thresholds)
+    # Confidences are sorted, so the first valid rank is the most confident match
+    best_rank = valid.argmax(axis=1)
+    rows = np.arange(len(probabilities))
+    best_items = top_items[rows, best_rank]
+    best_confidences = top_confidences[rows, best_rank]
+    return [
+        (food_items[item], confidence) if found else None
+        for found, item, confidence in zip(valid.any(axis=1), best_items, best_confidences)
+    ]
 
 def predict_image(model, image_array, confidence_threshold, valid_food_keywords, manual_mappings):
     """
     Predict the content of the image using the model and map predictions to valid food items.
     """
-    predictions = model.predict(image_array)
-    decoded = decode_predictions(predictions, top=5)
+    with STAGE_SECONDS.time("predict"):
+        predictions = model.predict(image_array)
+    with STAGE_SECONDS.time("resolve"):
+        return resolve_predictions(predictions, confidence_threshold, valid_food_keywords, manual_mappings)[0]
 
-    top_predictions = []
-    for i, (_, label, confidence) in enumerate(decoded[0]):
-        normalized_label = normalize_string(label)
-        if confidence > confidence_threshold.get(i, 0.2):
-            if normalized_label in manual_mappings:
-                top_predictions.append((manual_mappings[normalized_label], confidence))
-            elif normalized_label in valid_food_keywords:
-                top_predictions.append((normalized_label, confidence))
+def predict_batch(model, batch_array, confidence_threshold, valid_food_keywords, manual_mappings):
+    """
+    Predict a stacked batch of images with a single model call.
+    Returns one best prediction (or None) per image, in batch order.
+    """
+    with STAGE_SECONDS.time("predict"):
+        predictions = model.predict(batch_array, batch_size=len(batch_array))
+    with STAGE_SECONDS.time("resolve"):
+        return resolve_predictions(predictions, confidence_threshold, valid_food_keywords, manual_mappings)
+
+def log_prediction(image_file, best_prediction):
+    """
+    Log the outcome for a single image.
+    """
+    if best_prediction:
+        print(f"Image: {image_file}, Detected: {best_prediction[0]} ({best_prediction[1]:.2f})")
+    else:
+        print(f"Image: {image_file}, Could not identify any food item.")
+
+LoadedImage = namedtuple("LoadedImage", ["image_file", "cache_key", "hit", "prediction", "image_array"])
+
+def load_image(image_folder, image_file, datagen, cache=None, namespace=None, out=None):
+    """
+    Hash, look up and (on a cache miss) preprocess one image, into `out` when given.
+    A cache hit skips decoding entirely and carries no image array.
+    """
+    image_path = os.path.join(image_folder, image_file)
+    key = None
+    if cache is not None:
+        with STAGE_SECONDS.time("hash"):
+            key = cache.make_key(hash_file(image_path), namespace)
+        hit, prediction = cache.get(key)
+        if hit:
+            return LoadedImage(image_file, key, True, prediction, None)
+    return LoadedImage(image_file, key, False, None, preprocess_image(image_path, datagen, out=out))
+
+def iter_detections(image_folder, model, datagen, confidence_threshold, valid_food_keywords, manual_mappings,
+                    batch_size=BATCH_SIZE, workers=DECODE_WORKERS, prefetch=PREFETCH_BATCHES, cache=None,
+                    image_files=None):
+    """
+    Yield (image_file, best_prediction) for each image file in the folder (or for the given
+    image_files within it) as its batch finishes. Images that fail to decode are skipped.
+    Images are decoded in a thread pool while the current batch is being inferred; at most
+    `prefetch` batches beyond the current one are queued for decoding at any time.
+    Each batch decodes straight into one of prefetch + 2 preallocated batch buffers, which
+    are reused round-robin (at most that many batches are in flight at once).
+    With a PredictionCache, unchanged images are answered from the cache without inference.
+    The cache is not used with a random augmentation datagen, whose predictions vary per run.
+    """
+    namespace = None
+    if datagen is not None:
+        cache = None
+    if cache is not None:
+        namespace = cache_namespace(model, confidence_threshold, valid_food_keywords, manual_mappings)
+    if image_files is None:
+        image_files = [image_file for image_file in os.listdir(image_folder) if is_image_file(image_file)]
+    batch_size = max(1, min(batch_size, len(image_files)))
+    batches = (image_files[i:i + batch_size] for i in range(0, len(image_files), batch_size))
+    buffers = [np.empty((batch_size,) + IMAGE_SIZE + (3,), dtype=np.float32) for _ in range(prefetch + 2)]
+    queued = 0
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
 
-    return max(top_predictions, key=lambda x: x[1]) if top_predictions else None
+    def enqueue():
+        nonlocal queued
+        while len(pending) <= prefetch:
+            batch = next(batches, None)
+            if batch is None:
+                return
+            buffer = buffers[queued % len(buffers)]
+            queued += 1
+            pending.append((buffer, [
+                (image_file, row, pool.submit(
+                    load_image, image_folder, image_file, datagen, cache, namespace, buffer[row]
+                ))
+                for row, image_file in enumerate(batch)
+            ]))
 
-def detect_items_from_images(image_folder, model, datagen, confidence_threshold, valid_food_keywords, manual_mappings):
+    try:
+        enqueue()
+        while pending:
+            buffer, futures = pending.popleft()
+            loaded = []
+            for image_file, row, future in futures:
+                try:
+                    loaded.append((row, future.result()))
+                except Exception as e:
+                    IMAGES_PROCESSED.inc("error")
+                    print(f"Error processing image {image_file}: {e}")
+            # Start decoding the next batch before blocking on inference
+            enqueue()
+
+            misses = [(row, image) for row, image in loaded if not image.hit]
+            new_entries = []
+            if misses:
+                rows = [row for row, _ in misses]
+                if rows == list(range(rows[0], rows[0] + len(rows))):
+                    batch_array = buffer[rows[0]:rows[-1] + 1]
+                else:
+                    batch_array = buffer[rows]  # hits or failed images in between: gather the rows
+                try:
+                    if len(misses) == 1:
+                        predictions = [predict_image(
+                            model, batch_array, confidence_threshold, valid_food_keywords, manual_mappings
+                        )]
+                    else:
+                        predictions = predict_batch(
+                            model, batch_array, confidence_threshold, valid_food_keywords, manual_mappings
+                        )
+                except Exception as e:
+                    for _, image in misses:
+                        IMAGES_PROCESSED.inc("error")
+                        print(f"Error processing image {image.image_file}: {e}")
+                    loaded = [(row, image) for row, image in loaded if image.hit]
+                else:
+                    predicted = {
+                        image.image_file: image._replace(prediction=prediction, image_array=None)
+                        for (_, image), prediction in zip(misses, predictions)
+                    }
+                    loaded = [(row, predicted.get(image.image_file, image)) for row, image in loaded]
+                    new_entries = [(image.cache_key, image.prediction) for image in predicted.values()]
+            if cache is not None:
+                # One transaction per batch for the new predictions and the hits' last_used times
+                cache.put_many(new_entries)
+
+            for _, image in loaded:
+                IMAGES_PROCESSED.inc("detected" if image.prediction else "no_food")
+                log_prediction(image.image_file, image.prediction)
+                yield image.image_file, image.prediction
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def detect_items_from_images(image_folder, model, datagen, confidence_threshold, valid_food_keywords, manual_mappings,
+                             batch_size=1, cache=None):
     """
     Detect food items from images in the specified folder.
+    With batch_size > 1 the images are stacked and predicted batch_size at a time.
+    Thin wrapper collecting the item names yielded by iter_detections.
     """
     detected_items = []
-    for image_file in os.listdir(image_folder):
-        image_path = os.path.join(image_folder, image_file)
+    for _, best_prediction in iter_detections(
+        image_folder, model, datagen, confidence_threshold, valid_food_keywords, manual_mappings,
+        batch_size=batch_size, cache=cache
+    ):
+        if best_prediction:
+            detected_items.append(best_prediction[0])
+    return detected_items
+
+def ingest_folder(image_folder, model, datagen, confidence_threshold, valid_food_keywords, manual_mappings,
+                  manifest, batch_size=BATCH_SIZE, cache=None, settle=0.0, on_start=None, on_image=None):
+    """
+    Detect items only in images that are new or changed since the manifest last recorded them,
+    add the new detections to the inventory and return them. Images that could not be
+    processed are not recorded, so they are retried on the next run.
+    on_start(count) and on_image(image_file, best_prediction) report progress.
+    """
+    changes = manifest.changes(image_folder, settle)
+    if on_start:
+        on_start(len(changes))
+    if not changes:
+        return []
+
+    results = []
+    for image_file, best_prediction in iter_detections(
+        image_folder, model, datagen, confidence_threshold, valid_food_keywords, manual_mappings,
+        batch_size=batch_size, cache=cache, image_files=list(changes)
+    ):
+        results.append((image_file, changes[image_file], best_prediction[0] if best_prediction else None))
+        if on_image:
+            on_image(image_file, best_prediction)
+
+    # Update the inventory before recording, so an interrupted or failed run is retried rather
+    # than lost; apply_inventory_batch raises on failure, which skips the record
+    new_items = manifest.new_detections(image_folder, results)
+    if new_items:
+        apply_inventory_batch(additions=new_items)
+    manifest.record(image_folder, results)
+    return new_items
+
+def watch_folder(image_folder, model, datagen, confidence_threshold, valid_food_keywords, manual_mappings,
+                 manifest, interval=WATCH_INTERVAL, settle=WATCH_SETTLE, batch_size=BATCH_SIZE, cache=None,
+                 stop_event=None):
+    """
+    Ingest the folder, then poll it every `interval` seconds and ingest files as they appear
+    until stop_event is set. Files are picked up once unmodified for `settle` seconds.
+    """
+    stop_event = stop_event or threading.Event()
+    while True:
         try:
-            image_array = preprocess_image(image_path, datagen)
-            best_prediction = predict_image(
-                model, image_array, confidence_threshold, valid_food_keywords, manual_mappings
+            new_items = ingest_folder(
+                image_folder, model, datagen, confidence_threshold, valid_food_keywords, manual_mappings,
+                manifest, batch_size=batch_size, cache=cache, settle=settle
             )
-            if best_prediction:
-                detected_items.append(best_prediction[0])
-                print(f"Image: {image_file}, Detected: {best_prediction[0]} ({best_prediction[1]:.2f})")
-            else:
-                print(f"Image: {image_file}, Could not identify any food item.")
         except Exception as e:
-            print(f"Error processing image {image_file}: {e}")
-    return detected_items
+            print(f"Error ingesting images, retrying on the next scan: {e}")
+            new_items = []
+        if new_items:
+            print("New items detected:", new_items)
+        if stop_event.wait(interval):
+            return
 
 def main():
+    parser = argparse.ArgumentParser(description="Detect food items in the camera images")
+    parser.add_argument("--image-folder", default=os.path.join(os.path.dirname(__file__), "images"))
+    parser.add_argument("--incremental", action="store_true",
+                        help="only process images that are new or changed since the last run")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and ingest new images as they appear (implies --incremental)")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL, help="seconds between folder scans")
+    parser.add_argument("--tta", type=int, default=TTA_VARIANTS,
+                        help="average predictions over this many flipped/brightened variants of each image")
+    args = parser.parse_args()
+
     # Fetch current inventory
     items = fetch_inventory()
     print("Current Inventory:", items)
 
     # Detect items from images
-    image_folder = os.path.join(os.path.dirname(__file__), "images")
+    image_folder = args.image_folder
     if not os.path.exists(image_folder):
         print(f"Image folder not found: {image_folder}")
         return
 
-    datagen = ImageDataGenerator(
-        horizontal_flip=True,
-        brightness_range=[0.8, 1.2]
-    )
-    model = MobileNetV2(weights="imagenet")
+    datagen = make_datagen()
+    model = load_model(tta_variants=args.tta)
+    cache = PredictionCache()
+
+    if args.watch:
+        print(f"Watching {image_folder} for new images (Ctrl+C to stop)")
+        try:
+            watch_folder(image_folder, model, datagen, CONFIDENCE_THRESHOLD, VALID_FOOD_KEYWORDS, MANUAL_MAPPINGS,
+                         IngestManifest(), interval=args.interval, cache=cache)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.incremental:
+        try:
+            new_items = ingest_folder(image_folder, model, datagen, CONFIDENCE_THRESHOLD, VALID_FOOD_KEYWORDS,
+                                      MANUAL_MAPPINGS, IngestManifest(), cache=cache)
+            print("New items detected:", new_items)
+        except Exception as e:
+            print(f"Error ingesting images: {e}")
+        return
 
     detected_items = detect_items_from_images(
         image_folder,
@@ -105,15 +503,16 @@ def main():
         datagen,
         CONFIDENCE_THRESHOLD,
         VALID_FOOD_KEYWORDS,
-        MANUAL_MAPPINGS
+        MANUAL_MAPPINGS,
+        batch_size=BATCH_SIZE,
+        cache=cache
     )
 
     if detected_items:
         print("Detected Items from Images:", detected_items)
 
-        # Add detected items to the inventory
-        for item in detected_items:
-            add_to_inventory(item, quantity=1)
+        # Add detected items to the inventory in one transaction
+        add_many_to_inventory(detected_items)
 
 if __name__ == "__main__":
     main()
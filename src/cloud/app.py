@@ -1,39 +1,335 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
+import io
+import json
 import os
 import sys
+import threading
+import time
+from itertools import islice
 
 # Add the root directory to sys.path
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
 sys.path.append(project_root)
 
-from src.cloud.database import fetch_inventory, add_to_inventory, get_matching_recipe, remove_from_inventory  # Import database functions
-from src.camera.simulation import detect_items_from_images  # Import simulation functions
-from tensorflow.keras.applications.mobilenet_v2 import MobileNetV2 # type: ignore
-from tensorflow.keras.preprocessing.image import ImageDataGenerator # type: ignore
+from src.cloud.database import (  # Import database functions
+    fetch_inventory_changes, fetch_inventory_page, stream_inventory, get_recipes_page, stream_recipes,
+    add_to_inventory, get_matching_recipe, remove_from_inventory, apply_inventory_batch,
+    coalesce_items, import_recipes, iter_recipe_rows, recipe_file_format, ensure_database, PAGE_SIZE
+)
+from src.camera.simulation import (  # Import simulation functions
+    iter_detections, ingest_folder, load_model, make_datagen,
+    BATCH_SIZE, CONFIDENCE_THRESHOLD, VALID_FOOD_KEYWORDS, MANUAL_MAPPINGS
+)
+from src.camera.prediction_cache import PredictionCache
+from src.camera.manifest import IngestManifest, is_image_file
+from src.cloud.recipe_engine import suggest_recipes
+from src.cloud.jobs import JobQueue, QueueFullError
+from src.cloud import metrics
+import numpy as np
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["ETag", "Location"])
 
-# Initialize model and data generator once (to reuse across requests)
-model = MobileNetV2(weights="imagenet")
-datagen = ImageDataGenerator(horizontal_flip=True, brightness_range=[0.8, 1.2])
+# The model and data generator are built once, on the first /api/simulate call (or by
+# warm_up_model), so the inventory and recipe endpoints start without loading TensorFlow.
+model = None
+datagen = None
+model_lock = threading.Lock()
+# The prediction cache and ingest manifest open src/camera/camera_state.db, so they are also
+# created on first use (get_camera_state): importing the app, or forking preloaded workers,
+# doesn't touch the file or share its connections
+prediction_cache = None
+ingest_manifest = None
+camera_state_lock = threading.Lock()
+
+def get_model():
+    """
+    Return the shared (model, datagen) pair, building it on first use. datagen is None
+    (no random augmentation) unless SEPP_RANDOM_AUGMENTATION=1.
+    """
+    global model, datagen
+    if model is None:
+        with model_lock:
+            if model is None:
+                datagen = make_datagen()
+                model = load_model()
+    return model, datagen
+
+def get_camera_state():
+    """Return the shared (prediction_cache, ingest_manifest) pair, opening it on first use."""
+    global prediction_cache, ingest_manifest
+    if prediction_cache is None or ingest_manifest is None:
+        with camera_state_lock:
+            if prediction_cache is None:
+                prediction_cache = PredictionCache()
+            if ingest_manifest is None:
+                ingest_manifest = IngestManifest()
+    return prediction_cache, ingest_manifest
+
+def warm_up_model(background=True):
+    """
+    Build the model and run a dummy predict so graph tracing happens before the first request.
+    """
+    def warm_up():
+        try:
+            warm_model, _ = get_model()
+            warm_model.predict(np.zeros((1, 224, 224, 3), dtype=np.float32), verbose=0)
+            print("Model warm-up complete")
+        except Exception as e:
+            print(f"Error warming up model: {e}")
+
+    if not background:
+        warm_up()
+        return None
+    thread = threading.Thread(target=warm_up, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+if os.environ.get("SEPP_WARM_UP_MODEL") == "1":
+    warm_up_model(background=True)
+
+REQUEST_SECONDS = metrics.histogram(
+    "sepp_http_request_seconds", "Request latency by endpoint", ["method", "endpoint", "status"]
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def migrate_database_on_first_request():
+    # Databases created by an older schema.sql lack the tables and indexes the endpoints rely on
+    if not ensure_database():
+        return jsonify({"error": "Database could not be initialized"}), 500
+
+@app.after_request
+def record_request_latency(response):
+    start = g.pop("request_start", None)
+    if metrics.enabled and start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        labels = (request.method, endpoint, response.status_code)
+        if response.is_streamed:
+            # A streamed body is produced after this hook returns: time until it has been sent
+            response.call_on_close(lambda: REQUEST_SECONDS.observe(time.perf_counter() - start, *labels))
+        else:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, *labels)
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """
+    API endpoint exposing counters and latency histograms in Prometheus text format.
+    """
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled (SEPP_METRICS=0)"}), 404
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def json_array_chunks(rows, chunk_size=PAGE_SIZE):
+    """Encode an iterable as one JSON array, chunk_size elements at a time."""
+    rows = iter(rows)
+    yield "["
+    separator = ""
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield separator + ",".join(json.dumps(row) for row in chunk)
+        separator = ","
+    yield "]"
+
+def versioned_response(name, tag, payload, stream=False):
+    """
+    Answer with 304 when the client already holds the `tag` version of `name`, otherwise send
+    payload with an ETag. Cache-Control: no-cache makes browsers revalidate on every fetch.
+    With stream=True, payload is a generator of rows sent as a JSON array while it is read.
+    """
+    etag = f"{name}-{tag}"
+    if request.if_none_match.contains(etag):
+        if stream:
+            payload.close()
+        response = app.response_class(status=304)
+    elif stream:
+        response = app.response_class(json_array_chunks(payload), mimetype="application/json")
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def listing_response(name, key, stream_listing, fetch_page):
+    """
+    Answer a list endpoint: with ?limit= and/or ?after= one keyset page as
+    {key: [...], "next": cursor or null}, otherwise the whole table as a JSON array, from the
+    read cache for small tables and streamed for large ones.
+    """
+    if "limit" not in request.args and "after" not in request.args:
+        tag, rows = stream_listing()
+        return versioned_response(name, tag, rows, stream=not isinstance(rows, list))
+    try:
+        after = int(request.args.get('after', 0))
+        limit = int(request.args.get('limit', PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "after and limit must be integers"}), 400
+    if after < 0 or not 1 <= limit <= PAGE_SIZE:
+        return jsonify({"error": f"after must be at least 0 and limit between 1 and {PAGE_SIZE}"}), 400
+    tag, rows, next_after = fetch_page(after, limit)
+    return versioned_response(name, f"{tag}-{after}-{limit}", {key: rows, "next": next_after})
 
 @app.route('/api/inventory', methods=['GET'])
 def get_inventory():
-    inventory = fetch_inventory()
-    return jsonify(inventory)
+    """
+    API endpoint to list the inventory. Query parameters (optional): limit and after for keyset paging.
+    """
+    try:
+        return listing_response("inventory", "items", stream_inventory, fetch_inventory_page)
+    except Exception as e:
+        print(f"Error fetching inventory: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+# Inventory change stream settings
+STREAM_POLL_INTERVAL = float(os.environ.get("SEPP_STREAM_POLL_INTERVAL", "0.5"))  # Seconds between change checks
+STREAM_HEARTBEAT = 15.0  # Seconds of silence before a keep-alive comment
+STREAM_RETRY_MS = 2000  # Reconnect delay advertised to EventSource clients
+STREAM_MAX_AGE = float(os.environ.get("SEPP_STREAM_MAX_AGE", "60"))  # Seconds before a stream ends and the client reconnects
+
+def sse_message(event, data, event_id=None):
+    """Format one Server-Sent Events message."""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+def inventory_events(since=None, poll_interval=None, heartbeat=STREAM_HEARTBEAT, max_age=None):
+    """
+    Yield the inventory change stream: a "snapshot" event with the whole inventory unless the
+    client can resume from `since`, then one "inventory" event per committed change. Event ids
+    are "epoch-version" tags, so a reconnecting EventSource resumes through Last-Event-ID.
+    The stream ends after `max_age` seconds, so it never holds a server worker for good.
+    """
+    poll_interval = STREAM_POLL_INTERVAL if poll_interval is None else poll_interval
+    max_age = STREAM_MAX_AGE if max_age is None else max_age
+    yield f"retry: {STREAM_RETRY_MS}\n\n"
+    last_sent = started = time.monotonic()
+    while True:
+        result = fetch_inventory_changes(since)
+        if "snapshot" in result:
+            yield sse_message("snapshot", {"items": result["snapshot"]}, result["tag"])
+        epoch = result["tag"].split("-")[0] if result["tag"] else None
+        for change in result.get("changes", []):
+            yield sse_message("inventory", change, f"{epoch}-{change['version']}")
+        if "snapshot" in result or result.get("changes"):
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= heartbeat:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        since = result["tag"]
+        if time.monotonic() - started >= max_age:
+            return  # EventSource reconnects and resumes from the last event id
+        if not result.get("changes"):
+            time.sleep(poll_interval)  # caught up; otherwise fetch the next batch straight away
+
+@app.route('/api/inventory/stream', methods=['GET'])
+def stream_inventory_changes():
+    """
+    API endpoint streaming inventory changes as Server-Sent Events. Resumes after the
+    Last-Event-ID header, or the ?since= tag (the /api/inventory ETag is accepted as is).
+    """
+    since = request.headers.get("Last-Event-ID") or request.args.get("since", "").strip('"')
+    if since.startswith("inventory-"):
+        since = since[len("inventory-"):]
+    return app.response_class(
+        inventory_events(since),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.route('/api/inventory', methods=['POST'])
 def add_item():
     data = request.json
     item_name = data.get('item_name')
     quantity = data.get('quantity', 1)
-    add_to_inventory(item_name, quantity)
+    if add_to_inventory(item_name, quantity) is None:
+        return jsonify({"error": f"Could not add {item_name} to the inventory"}), 500
     return jsonify({"item_name": item_name, "quantity": quantity})
 
+@app.route('/api/inventory/batch', methods=['POST'])
+def batch_update_inventory():
+    """
+    API endpoint to add and remove many items in one transaction.
+    Payload: {"add": [{"item_name": ..., "quantity": ...}], "remove": [...]}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "No JSON payload provided"}), 400
+    try:
+        additions = coalesce_items(data.get('add', []))
+        removals = coalesce_items(data.get('remove', []))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        quantities = apply_inventory_batch(additions, removals)
+        return jsonify({"inventory": quantities})
+    except Exception as e:
+        print(f"Error applying inventory batch: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def run_simulation(job, image_folder, incremental=False):
+    """
+    Job worker: detect items in image_folder, reporting each image as it finishes, then
+    add everything detected to the inventory in one transaction. In incremental mode only
+    new or changed images are processed and only new detections are added.
+    """
+    simulation_model, simulation_datagen = get_model()
+    prediction_cache, ingest_manifest = get_camera_state()
+    if incremental:
+        added_items = ingest_folder(
+            image_folder,
+            simulation_model,
+            simulation_datagen,
+            CONFIDENCE_THRESHOLD,
+            VALID_FOOD_KEYWORDS,
+            MANUAL_MAPPINGS,
+            ingest_manifest,
+            batch_size=BATCH_SIZE,
+            cache=prediction_cache,
+            on_start=job.set_total,
+            on_image=lambda _, best_prediction: job.advance(best_prediction[0] if best_prediction else None)
+        )
+        return {
+            "detected_items": job.to_dict()["detected_items"],
+            "added_items": added_items,
+            "cache": prediction_cache.stats()
+        }
+
+    image_files = [image_file for image_file in os.listdir(image_folder) if is_image_file(image_file)]
+    job.set_total(len(image_files))
+    for _, best_prediction in iter_detections(
+        image_folder,
+        simulation_model,
+        simulation_datagen,
+        CONFIDENCE_THRESHOLD,
+        VALID_FOOD_KEYWORDS,
+        MANUAL_MAPPINGS,
+        batch_size=BATCH_SIZE,
+        cache=prediction_cache,
+        image_files=image_files
+    ):
+        job.advance(best_prediction[0] if best_prediction else None)
+
+    # apply_inventory_batch raises on failure, so the job is marked failed instead of done
+    detected_items = job.to_dict()["detected_items"]
+    apply_inventory_batch(additions=detected_items)
+    return {"detected_items": detected_items, "added_items": detected_items, "cache": prediction_cache.stats()}
+
+simulation_jobs = JobQueue(run_simulation)
+
 @app.route('/api/simulate', methods=['POST'])
 def simulate_detection():
+    """
+    API endpoint to start a simulation job; poll GET /api/simulate/<job_id> for its progress.
+    A folder that already has a queued or running job gets that job back.
+    """
     try:
         # Ensure the request contains a JSON payload
         if not request.json:
@@ -47,40 +343,33 @@ def simulate_detection():
         if not os.path.exists(image_folder):
             return jsonify({"error": f"Image folder not found: {image_folder}"}), 400
 
-        # Proceed with simulation
-        detected_items = detect_items_from_images(
-            image_folder,
-            model,
-            datagen,
-            confidence_threshold={
-                0: 0.5,
-                1: 0.4,
-                2: 0.3
-            },
-            valid_food_keywords=[
-                "apple", "orange", "banana", "carrot", "chicken", "beef", "milk",
-                "bread", "cheese", "tomato", "potato", "lettuce", "grape", "onion",
-                "pomegranate", "loaf", "bottle", "packaging", "meat"
-            ],
-            manual_mappings={
-                "french loaf": "chicken breast",
-                "roast": "chicken breast",
-                "turkey breast": "chicken breast",
-                "lotion": "milk",
-                "pomegranate": "apple",
-                "dough": "chicken breast"
-            }
-        )
+        # Only new or changed images are processed when "incremental" is true
+        incremental = bool(request.json.get('incremental', False))
+        image_folder = os.path.realpath(image_folder)
+        mode = "incremental" if incremental else "full"
+        try:
+            job, created = simulation_jobs.submit(f"{mode}:{image_folder}", image_folder, incremental)
+        except QueueFullError as e:
+            response = jsonify({"error": f"Simulation queue is full: {e}"})
+            response.headers["Retry-After"] = "5"
+            return response, 503
 
-        # Add detected items to inventory
-        for item in detected_items:
-            add_to_inventory(item, quantity=1)
-
-        return jsonify({"detected_items": detected_items})
+        response = jsonify({"job_id": job.id, "status": job.status, "coalesced": not created})
+        response.headers["Location"] = f"/api/simulate/{job.id}"
+        return response, 202
     except Exception as e:
         print(f"Error: {str(e)}")  # Debugging log
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/simulate/<job_id>', methods=['GET'])
+def get_simulation(job_id):
+    """
+    API endpoint to report a simulation job's status, progress and the items detected so far.
+    """
+    job = simulation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify(job.to_dict())
 
 @app.route('/api/recipe', methods=['GET'])
 def get_random_recipe():
@@ -96,6 +385,61 @@ def get_random_recipe():
         print(f"Error fetching recipe: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/recipes', methods=['GET'])
+def list_recipes():
+    """
+    API endpoint to list every recipe with its ingredients.
+    Query parameters (optional): limit and after for keyset paging.
+    """
+    try:
+        return listing_response("recipes", "recipes", stream_recipes, get_recipes_page)
+    except Exception as e:
+        print(f"Error fetching recipes: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+# Raw upload content types accepted by /api/recipes/import
+UPLOAD_FORMATS = {"text/csv": "csv", "application/x-ndjson": "jsonl", "application/jsonl": "jsonl"}
+
+@app.route('/api/recipes/import', methods=['POST'])
+def import_recipes_endpoint():
+    """
+    API endpoint to bulk-import a recipe catalog, parsed as it is read. Send a multipart "file"
+    field (.csv or .jsonl), or the raw file as the body with Content-Type text/csv or
+    application/x-ndjson; ?format=csv|jsonl overrides either.
+    """
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({"error": "No file provided"}), 400
+        stream, file_format = upload.stream, recipe_file_format(upload.filename)
+    else:
+        stream, file_format = request.stream, UPLOAD_FORMATS.get(request.mimetype)
+    file_format = request.args.get('format', file_format)
+    if file_format not in ("csv", "jsonl"):
+        return jsonify({"error": "Send a .csv or .jsonl file, or set ?format=csv|jsonl"}), 400
+
+    stats = import_recipes(iter_recipe_rows(io.TextIOWrapper(stream, encoding="utf-8", newline=""), file_format))
+    return jsonify(stats), (400 if "error" in stats else 200)
+
+@app.route('/api/recipes/suggest', methods=['GET'])
+def suggest_recipes_endpoint():
+    """
+    API endpoint to rank recipes by how much of them the inventory covers.
+    Query parameters: k (default 5) and max_missing (default 2).
+    """
+    try:
+        k = int(request.args.get('k', 5))
+        max_missing = int(request.args.get('max_missing', 2))
+    except ValueError:
+        return jsonify({"error": "k and max_missing must be integers"}), 400
+    if k < 1 or max_missing < 0:
+        return jsonify({"error": "k must be at least 1 and max_missing at least 0"}), 400
+    try:
+        return jsonify({"recipes": suggest_recipes(k, max_missing)})
+    except Exception as e:
+        print(f"Error suggesting recipes: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/inventory/<item_name>', methods=['DELETE'])
 def remove_item(item_name):
     """
@@ -104,7 +448,8 @@ def remove_item(item_name):
     try:
         # Extract optional quantity from query parameters
         quantity = int(request.args.get('quantity', 1))  # Default to 1 if not provided
-        remove_from_inventory(item_name, quantity)
+        if not remove_from_inventory(item_name, quantity):
+            return jsonify({"error": f"Could not remove {item_name} from the inventory"}), 500
         return jsonify({"message": f"{item_name} removed successfully."}), 200
     except Exception as e:
         print(f"Error removing item from inventory: {str(e)}")
@@ -1,149 +1,840 @@
 #CREATED SPRINT 1, LAST EDITED SPRINT 2 
 #CONTROLS THE DATABSE OF RECIPES AND INGREDIENTS
 
+import csv
+import json
 import os
+import queue
 import sqlite3
-from typing import List, Dict
+import threading
+from contextlib import contextmanager
+from itertools import groupby, islice
+from typing import Iterable, Iterator, List, Dict, Optional
 import random
+import sys
+
+# Add the root directory to sys.path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
+sys.path.append(project_root)
+
+from src.cloud import metrics
 
 # Get the path to the database file
 db_path = os.path.join(os.path.dirname(__file__), "inventory.db")
 schema_path = os.path.join(os.path.dirname(__file__), "schema.sql")
 
-def initialize_database():
-    """Initialize database by executing the schema.sql script."""
+# Connection pool settings
+POOL_SIZE = 8  # Idle connections kept open for reuse
+STATEMENT_CACHE_SIZE = 256  # Prepared statements cached per connection
+INVENTORY_CHANGES_KEPT = 1000  # Inventory versions kept in the change log for resuming clients
+CHANGE_BATCH_VERSIONS = 100  # Inventory versions returned per fetch_inventory_changes call
+PAGE_SIZE = 1000  # Rows read per keyset page by the paginated and streamed listings
+IMPORT_CHUNK_SIZE = 1000  # Recipes inserted per transaction by import_recipes
+CACHED_LISTING_ROWS = 5000  # Listings up to this size are kept in the read cache; larger ones are streamed
+RANDOM_RECIPE_DRAWS = 8  # Random id lookups get_matching_recipe tries before counting the makeable recipes
+# Concurrency settings shared with the camera's sidecar database (prediction_cache.connect_state_db)
+WAL_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Readers don't block the writer
+    "PRAGMA synchronous=NORMAL",  # fsync at checkpoints rather than every commit (safe with WAL)
+    "PRAGMA busy_timeout=5000",  # Wait for other writers instead of failing immediately
+)
+CONNECTION_PRAGMAS = WAL_PRAGMAS + (
+    "PRAGMA cache_size=-16000",  # ~16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",  # Memory-map up to 256 MB of the database file
+    "PRAGMA foreign_keys=ON",
+)
+
+class PooledConnection(sqlite3.Connection):
+    """A sqlite3 connection that remembers which database file it was opened on."""
+    db_path = None
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+DB_CALL_SECONDS = metrics.histogram("sepp_db_call_seconds", "Time spent in database.py functions", ["function"])
+DB_TRANSACTIONS = metrics.counter("sepp_db_transactions_total", "Pooled connection transactions by outcome", ["outcome"])
+
+def instrumented(function):
+    """Record the duration of every call to a database function."""
+    return metrics.timed(DB_CALL_SECONDS, function.__name__)(function)
+
+def _open_connection() -> PooledConnection:
+    conn = sqlite3.connect(
+        db_path, factory=PooledConnection, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False
+    )
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    conn.db_path = db_path
+    return conn
+
+def _checkout() -> PooledConnection:
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            return _open_connection()
+        # db_path may have been repointed (e.g. by tests) since the connection was pooled
+        if conn.db_path == db_path:
+            return conn
+        conn.close()
+
+def _checkin(conn: PooledConnection):
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+@contextmanager
+def get_connection():
+    """
+    Borrow a pooled, tuned connection for one transaction.
+    Commits on success, rolls back on error, then returns the connection to the pool.
+    Statements are prepared once per connection and reused from its statement cache.
+    """
+    conn = _checkout()
+    try:
+        with conn:
+            yield conn
+        DB_TRANSACTIONS.inc("commit")
+    except BaseException:
+        DB_TRANSACTIONS.inc("rollback")
+        raise
+    finally:
+        _checkin(conn)
+
+def close_connections():
+    """Close every idle pooled connection."""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            return
+
+def _reset_pool_after_fork():
+    # SQLite connections must not be used across fork(); children start with an empty pool
+    global _pool
+    _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+def table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+def index_exists(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)
+    ).fetchone() is not None
+
+def migrate_database(conn: sqlite3.Connection):
+    """Upgrade a database created by an older schema.sql before the schema script runs."""
+    if table_exists(conn, "inventory") and not index_exists(conn, "idx_inventory_item_name"):
+        # Merge duplicate rows into the oldest one so item_name can become unique
+        conn.execute("""
+            UPDATE inventory
+            SET quantity = (SELECT SUM(dup.quantity) FROM inventory AS dup WHERE dup.item_name = inventory.item_name)
+            WHERE id IN (SELECT MIN(id) FROM inventory GROUP BY item_name HAVING COUNT(*) > 1)
+        """)
+        removed = conn.execute(
+            "DELETE FROM inventory WHERE id NOT IN (SELECT MIN(id) FROM inventory GROUP BY item_name)"
+        ).rowcount
+        conn.execute("CREATE UNIQUE INDEX idx_inventory_item_name ON inventory(item_name)")
+        print(f"Migrated inventory to unique item names ({removed} duplicate rows merged)")
+
+    if table_exists(conn, "recipes") and not index_exists(conn, "idx_recipes_recipe_name"):
+        # Keep the oldest copy of each recipe so recipe_name can become unique
+        removed = conn.execute(
+            "DELETE FROM recipes WHERE id NOT IN (SELECT MIN(id) FROM recipes GROUP BY recipe_name)"
+        ).rowcount
+        conn.execute("CREATE UNIQUE INDEX idx_recipes_recipe_name ON recipes(recipe_name)")
+        print(f"Migrated recipes to unique names ({removed} duplicate recipes removed)")
+
+def split_ingredients(ingredients: str) -> List[str]:
+    """Split a comma-joined ingredients string, dropping blanks and repeats but keeping order."""
+    names = (name.strip() for name in ingredients.split(','))
+    return list(dict.fromkeys(name for name in names if name))
+
+def backfill_recipe_ingredients(conn: sqlite3.Connection):
+    """Populate recipe_ingredients from the CSV ingredients column for recipes that have no rows yet."""
+    missing = conn.execute("""
+        SELECT id, ingredients FROM recipes AS r
+        WHERE NOT EXISTS (SELECT 1 FROM recipe_ingredients AS ri WHERE ri.recipe_id = r.id)
+    """).fetchall()
+    rows = [
+        (recipe_id, item_name)
+        for recipe_id, ingredients in missing
+        for item_name in split_ingredients(ingredients)
+    ]
+    if rows:
+        conn.executemany("INSERT OR IGNORE INTO recipe_ingredients (recipe_id, item_name) VALUES (?, ?)", rows)
+        print(f"Indexed ingredients for {len(missing)} recipes")
+
+# Missing-ingredient counts computed from scratch, for (re)building recipe_status
+EXPECTED_RECIPE_STATUS_SQL = """
+    SELECT ri.recipe_id, COUNT(*) - COUNT(i.item_name)
+    FROM recipe_ingredients AS ri
+    LEFT JOIN inventory AS i ON i.item_name = ri.item_name AND i.quantity > 0
+    GROUP BY ri.recipe_id
+"""
+
+def recipe_status_complete(conn: sqlite3.Connection) -> bool:
+    """Whether every recipe with ingredients has a recipe_status row (false for migrated databases)."""
+    indexed = conn.execute("SELECT COUNT(DISTINCT recipe_id) FROM recipe_ingredients").fetchone()[0]
+    tracked = conn.execute("SELECT COUNT(*) FROM recipe_status").fetchone()[0]
+    return indexed == tracked
+
+def rebuild_recipe_status(conn: sqlite3.Connection):
+    """Recompute every recipe's missing-ingredient count from the inventory."""
+    conn.execute("DELETE FROM recipe_status")
+    conn.execute(f"INSERT INTO recipe_status (recipe_id, missing_count) {EXPECTED_RECIPE_STATUS_SQL}")
+    print("Rebuilt recipe status counters")
+
+@instrumented
+def check_recipe_status(repair: bool = True) -> List[Dict[str, int]]:
+    """
+    Compare the incrementally maintained missing-ingredient counts with a full recount.
+    Returns the mismatching recipes and, when repair is set, rebuilds the counters.
+    """
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")  # Keep writers out between the recount and the rebuild
+        expected = dict(conn.execute(EXPECTED_RECIPE_STATUS_SQL).fetchall())
+        stored = dict(conn.execute("SELECT recipe_id, missing_count FROM recipe_status").fetchall())
+        mismatches = [
+            {"recipe_id": recipe_id, "expected": expected.get(recipe_id), "stored": stored.get(recipe_id)}
+            for recipe_id in sorted(set(expected) | set(stored))
+            if expected.get(recipe_id) != stored.get(recipe_id)
+        ]
+        if mismatches and repair:
+            rebuild_recipe_status(conn)
+    return mismatches
+
+def bump_version(conn: sqlite3.Connection, name: str):
+    """Record a change to `name` in the current transaction."""
+    version = conn.execute(
+        "UPDATE data_versions SET version = version + 1 WHERE name = ? RETURNING version", (name,)
+    ).fetchone()
+    if name == "inventory" and version:
+        stamp_inventory_changes(conn, version[0])
+
+def stamp_inventory_changes(conn: sqlite3.Connection, version: int):
+    """Give the changes logged by the inventory triggers their version, and drop the oldest ones."""
+    conn.execute("UPDATE inventory_changes SET version = ? WHERE version IS NULL", (version,))
+    floor = version - INVENTORY_CHANGES_KEPT
+    if floor > 0:
+        conn.execute("DELETE FROM inventory_changes WHERE version <= ?", (floor,))
+        conn.execute(
+            "UPDATE data_versions SET version = MAX(version, ?) WHERE name = 'inventory_log_start'", (floor,)
+        )
+
+def read_version(conn: sqlite3.Connection, name: str) -> int:
+    row = conn.execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+@instrumented
+def get_data_version(name: str) -> int:
+    """Return the change counter for `name` ("recipes" or "inventory"); it increases with every committed change."""
+    try:
+        with get_connection() as conn:
+            return read_version(conn, name)
+    except Exception as e:
+        print(f"Error fetching data version: {e}")
+        return -1
+
+# Databases already migrated to the current schema by this process
+_initialized_paths = set()
+_initialize_lock = threading.Lock()
+
+@instrumented
+def initialize_database() -> bool:
+    """Initialize database by migrating older databases and executing the schema.sql script."""
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
+            migrate_database(conn)
             with open(schema_path, "r") as file:
                 sql_script = file.read()
                 conn.executescript(sql_script)
-            print("Database initialized successfully")
+            backfill_recipe_ingredients(conn)
+            if not recipe_status_complete(conn):
+                rebuild_recipe_status(conn)
+            # The schema script may have (re)inserted sample rows
+            bump_version(conn, "recipes")
+            bump_version(conn, "inventory")
+        _initialized_paths.add(db_path)
+        print("Database initialized successfully")
+        return True
     except Exception as e:
         print(f"Error initializing database: {e}")
+        return False
 
+def ensure_database() -> bool:
+    """Run initialize_database() once per process for the current db_path, so older databases are migrated before use."""
+    if db_path in _initialized_paths:
+        return True
+    with _initialize_lock:
+        return db_path in _initialized_paths or initialize_database()
+
+def read_tag(cursor: sqlite3.Cursor, name: str) -> Optional[str]:
+    """Return the "epoch-version" tag of `name`, which changes whenever any process commits a change to it."""
+    cursor.execute(
+        "SELECT (SELECT version FROM data_versions WHERE name = 'epoch'), version "
+        "FROM data_versions WHERE name = ?",
+        (name,)
+    )
+    row = cursor.fetchone()
+    return f"{row[0]}-{row[1]}" if row else None
+
+def _listing_pages(name: str, page_loader, page_size: int, unless_tag: Optional[str]):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")  # every page comes from the snapshot the tag was read on
+        tag = read_tag(cursor, name)
+        yield tag
+        if tag is not None and tag == unless_tag:
+            return
+        after = 0
+        while after is not None:
+            rows, after = page_loader(cursor, after, page_size)
+            yield from rows
+
+def stream_listing(name: str, page_loader, page_size: int = PAGE_SIZE, unless_tag: Optional[str] = None) -> tuple:
+    """
+    Return (tag, rows) for a whole table without holding it in memory: rows is a generator reading
+    page_loader(cursor, after, page_size) pages from one read transaction, which keeps a pooled
+    connection until the generator is exhausted or closed. When the tag equals unless_tag, rows
+    is empty and the transaction has already ended.
+    """
+    rows = _listing_pages(name, page_loader, page_size, unless_tag)
+    tag = next(rows)
+    if tag is not None and tag == unless_tag:
+        next(rows, None)  # finish the generator so the transaction ends normally
+    return tag, rows
+
+def fetch_page(name: str, page_loader, after: int = 0, limit: int = PAGE_SIZE) -> tuple:
+    """Return (tag, rows, next_after) for one keyset page; next_after is None on the last page."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        tag = read_tag(cursor, name)
+        rows, next_after = page_loader(cursor, after, limit)
+    return tag, rows, next_after
+
+# Last result of each versioned read, keyed by (db_path, name): (tag, rows)
+_read_cache: Dict[tuple, tuple] = {}
+
+def cached_read(name: str, loader) -> tuple:
+    """
+    Return (tag, rows) for the data counted by the `name` version, calling loader(cursor) only
+    when the version stored in the database has moved on. The tag combines the database's
+    epoch and the version, so it changes whenever any process commits a change.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")  # read the version and the rows from one snapshot
+        tag = read_tag(cursor, name)
+        key = (db_path, name)
+        cached = _read_cache.get(key)
+        if tag is not None and cached is not None and cached[0] == tag:
+            metrics.CACHE_REQUESTS.inc("read", "hit")
+            return cached
+        metrics.CACHE_REQUESTS.inc("read", "miss")
+        result = (tag, loader(cursor))
+    if tag is not None:
+        _read_cache[key] = result
+    return result
+
+def _prepend(head: list, rows):
+    try:
+        yield from head
+        yield from rows
+    finally:
+        rows.close()
+
+def cached_listing(name: str, page_loader, max_rows: Optional[int] = None) -> tuple:
+    """
+    Return (tag, rows) for a whole table. Tables of up to max_rows (default CACHED_LISTING_ROWS) rows come back as a list shared
+    with cached_read, and are only re-read when their version moves on; larger ones as a
+    stream_listing generator, so memory stays bounded by max_rows.
+    """
+    max_rows = CACHED_LISTING_ROWS if max_rows is None else max_rows
+    key = (db_path, name)
+    cached = _read_cache.get(key)
+    tag, rows = stream_listing(name, page_loader, unless_tag=cached[0] if cached is not None else None)
+    if tag is not None and cached is not None and cached[0] == tag:
+        metrics.CACHE_REQUESTS.inc("read", "hit")
+        return cached
+    metrics.CACHE_REQUESTS.inc("read", "miss")
+    head = list(islice(rows, max_rows + 1))
+    if len(head) > max_rows:
+        return tag, _prepend(head, rows)
+    if tag is not None:
+        _read_cache[key] = (tag, head)
+    return tag, head
+
+def load_inventory(cursor: sqlite3.Cursor) -> List[Dict[str, int]]:
+    cursor.execute("SELECT item_name, quantity FROM inventory")
+    return [{"item_name": item[0], "quantity": item[1]} for item in cursor.fetchall()]
+
+def load_inventory_page(cursor: sqlite3.Cursor, after: int, limit: int) -> tuple:
+    """Return (items, next_after) for up to `limit` items with an id above `after`."""
+    cursor.execute("SELECT id, item_name, quantity FROM inventory WHERE id > ? ORDER BY id LIMIT ?", (after, limit))
+    rows = cursor.fetchall()
+    items = [{"item_name": row[1], "quantity": row[2]} for row in rows]
+    return items, (rows[-1][0] if len(rows) == limit else None)
+
+@instrumented
+def fetch_inventory_page(after: int = 0, limit: int = PAGE_SIZE) -> tuple:
+    """Return (tag, items, next_after) for the inventory items with an id above `after`."""
+    return fetch_page("inventory", load_inventory_page, after, limit)
+
+@instrumented
+def stream_inventory() -> tuple:
+    """Return (tag, items): a cached list for small inventories, otherwise read page by page; see cached_listing."""
+    return cached_listing("inventory", load_inventory_page)
+
+@instrumented
+def fetch_inventory_versioned() -> tuple:
+    """Return (tag, items) for the inventory; the items are shared and must not be modified."""
+    return cached_read("inventory", load_inventory)
+
+@instrumented
 def fetch_inventory() -> List[Dict[str, int]]:
     """Fetch items from the inventory table."""
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT item_name, quantity FROM inventory")
-            items = cursor.fetchall()
-        return [{"item_name": item[0], "quantity": item[1]} for item in items]
+        _, items = fetch_inventory_versioned()
+        return [dict(item) for item in items]
     except Exception as e:
         print(f"Error fetching inventory: {e}")
         return []
 
-def add_to_inventory(item_name: str, quantity: int = 1):
-    """Add item to the inventory or update its quantity if it already exists."""
+def parse_tag(tag: Optional[str]):
+    """Split an "epoch-version" tag into two ints, or return None if it is not one."""
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
+        epoch, version = str(tag).split("-")
+        return int(epoch), int(version)
+    except ValueError:
+        return None
 
-            # Combine duplicate entries
-            cursor.execute("SELECT SUM(quantity) FROM inventory WHERE item_name = ?", (item_name,))
-            total_quantity = cursor.fetchone()[0]
+@instrumented
+def fetch_inventory_changes(since: Optional[str] = None, limit: int = CHANGE_BATCH_VERSIONS) -> Dict[str, object]:
+    """
+    Return the inventory changes committed after the `since` tag (as returned by
+    fetch_inventory_versioned or a previous call) as {"tag", "changes"}, oldest first and at
+    most `limit` versions. Each change is {"version", "items": [{"item_name", "quantity"}]},
+    with quantity 0 for removed items. When `since` is missing, from another database file or
+    older than the change log, returns {"tag", "snapshot": items} with the whole inventory instead.
+    """
+    position = parse_tag(since)
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")  # read the versions and the changes from one snapshot
+            cursor.execute(
+                "SELECT name, version FROM data_versions WHERE name IN ('epoch', 'inventory', 'inventory_log_start')"
+            )
+            versions = dict(cursor.fetchall())
+            epoch, latest = versions["epoch"], versions["inventory"]
+            if (position is None or position[0] != epoch
+                    or not versions.get("inventory_log_start", latest) <= position[1] <= latest):
+                return {"tag": f"{epoch}-{latest}", "snapshot": load_inventory(cursor)}
 
-            if total_quantity:
-                # Update the existing entry
+            upper = min(latest, position[1] + limit)
+            changes: Dict[int, Dict[str, int]] = {}
+            if upper > position[1]:
                 cursor.execute(
-                    "UPDATE inventory SET quantity = ? WHERE item_name = ?",
-                    (total_quantity + quantity, item_name)
+                    "SELECT version, item_name, quantity FROM inventory_changes "
+                    "WHERE version > ? AND version <= ? ORDER BY id",
+                    (position[1], upper)
                 )
-                print(f"Updated {item_name} total quantity to {total_quantity + quantity}.")
+                for version, item_name, quantity in cursor:
+                    changes.setdefault(version, {})[item_name] = quantity  # last change per item wins
+            return {
+                "tag": f"{epoch}-{upper}",
+                "changes": [
+                    {"version": version, "items": [{"item_name": name, "quantity": quantity}
+                                                   for name, quantity in items.items()]}
+                    for version, items in changes.items()
+                ],
+            }
+    except Exception as e:
+        print(f"Error fetching inventory changes: {e}")
+        return {"tag": since, "changes": []}
+
+@instrumented
+def add_to_inventory(item_name: str, quantity: int = 1) -> Optional[int]:
+    """Add item to the inventory or update its quantity if it already exists. Returns the new total, or None on failure."""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+
+            # Insert the item, or add to the existing row, in one atomic statement
+            cursor.execute(
+                "INSERT INTO inventory (item_name, quantity) VALUES (?, ?) "
+                "ON CONFLICT(item_name) DO UPDATE SET quantity = IFNULL(quantity, 0) + excluded.quantity "
+                "RETURNING quantity",
+                (item_name, quantity)
+            )
+            total_quantity = cursor.fetchone()[0]
+            bump_version(conn, "inventory")
+
+            if total_quantity != quantity:
+                print(f"Updated {item_name} total quantity to {total_quantity}.")
             else:
-                # Insert new entry
-                cursor.execute(
-                    "INSERT INTO inventory (item_name, quantity) VALUES (?, ?)",
-                    (item_name, quantity)
-                )
                 print(f"Added {item_name} to inventory.")
+            return total_quantity
     except Exception as e:
         print(f"Error adding to inventory: {e}")
+        return None
 
     
-def remove_from_inventory(item_name: str, quantity: int = 1):
-    """" Remove an item from the inventory or reduce quantity """
+@instrumented
+def remove_from_inventory(item_name: str, quantity: int = 1) -> bool:
+    """" Remove an item from the inventory or reduce quantity. Returns False if the write failed. """
 
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT quantity FROM inventory WHERE item_name = ?", (item_name,))
+
+            # Reduce the quantity if enough remains, otherwise delete the row; the UPDATE
+            # takes the write lock, so both statements see the same row state
+            cursor.execute(
+                "UPDATE inventory SET quantity = quantity - ? WHERE item_name = ? AND quantity > ? "
+                "RETURNING quantity",
+                (quantity, item_name, quantity)
+            )
             result = cursor.fetchone()
 
             if result:
-                current_quantity = result[0]
-                if current_quantity > quantity:
-                    new_quantity = current_quantity - quantity
-                    cursor.execute(
-                        "UPDATE inventory SET quantity = ? WHERE item_name = ?",
-                        (new_quantity, item_name)
-                    )
-                    print(f"Reduced {item_name} quantity to {new_quantity}")
-                else:
-                    cursor.execute(
-                        "DELETE FROM inventory WHERE item_name = ?",
-                        (item_name,)
-                    )
-                    print(f"Removed {item_name} from inventory")
+                bump_version(conn, "inventory")
+                print(f"Reduced {item_name} quantity to {result[0]}")
             else:
+                cursor.execute("DELETE FROM inventory WHERE item_name = ?", (item_name,))
+                if cursor.rowcount:
+                    bump_version(conn, "inventory")
                 print(f"Removed {item_name} from inventory")
+        return True
+    except Exception as e:
+        print(f"Error removing from inventory: {e}")
+        return False
+
+
+def coalesce_items(items) -> Dict[str, int]:
+    """
+    Sum quantities per item name. Accepts a name -> quantity dict, or a list of item names,
+    (name, quantity) pairs and {"item_name": ..., "quantity": ...} dicts.
+    """
+    if isinstance(items, dict):
+        items = list(items.items())
+    elif items is not None and not isinstance(items, (list, tuple)):
+        raise ValueError(f"Expected a list or dict of items, got {type(items).__name__}")
+    totals: Dict[str, int] = {}
+    for entry in items or []:
+        if isinstance(entry, str):
+            item_name, quantity = entry, 1
+        elif isinstance(entry, dict):
+            item_name, quantity = entry.get("item_name"), entry.get("quantity", 1)
+        else:
+            item_name, quantity = entry
+        if not isinstance(item_name, str) or not item_name:
+            raise ValueError(f"Invalid item name: {item_name!r}")
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+            raise ValueError(f"Invalid quantity for {item_name}: {quantity!r}")
+        totals[item_name] = totals.get(item_name, 0) + quantity
+    return totals
+
+@instrumented
+def apply_inventory_batch(additions=None, removals=None) -> Dict[str, int]:
+    """
+    Apply many additions and removals in a single transaction (additions first).
+    Duplicate names are coalesced. Returns the resulting quantity of every touched
+    item, with 0 for items that are no longer in the inventory.
+    """
+    additions = coalesce_items(additions)
+    removals = coalesce_items(removals)
+    touched = sorted(set(additions) | set(removals))
+    if not touched:
+        return {}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if additions:
+            cursor.executemany(
+                "INSERT INTO inventory (item_name, quantity) VALUES (?, ?) "
+                "ON CONFLICT(item_name) DO UPDATE SET quantity = IFNULL(quantity, 0) + excluded.quantity",
+                list(additions.items())
+            )
+        if removals:
+            cursor.executemany(
+                "UPDATE inventory SET quantity = quantity - ? WHERE item_name = ?",
+                [(quantity, item_name) for item_name, quantity in removals.items()]
+            )
+            cursor.executemany(
+                "DELETE FROM inventory WHERE item_name = ? AND IFNULL(quantity, 0) <= 0",
+                [(item_name,) for item_name in removals]
+            )
+        bump_version(conn, "inventory")
+        cursor.execute(
+            "SELECT item_name, quantity FROM inventory WHERE item_name IN (SELECT value FROM json_each(?))",
+            (json.dumps(touched),)
+        )
+        quantities = dict(cursor.fetchall())
+    print(f"Applied inventory batch: {len(additions)} added, {len(removals)} removed")
+    return {item_name: quantities.get(item_name, 0) for item_name in touched}
+
+@instrumented
+def add_many_to_inventory(items) -> Dict[str, int]:
+    """Add many items in one transaction and return their resulting quantities."""
+    try:
+        return apply_inventory_batch(additions=items)
+    except Exception as e:
+        print(f"Error adding to inventory: {e}")
+        return {}
+
+@instrumented
+def remove_many_from_inventory(items) -> Dict[str, int]:
+    """Remove many items in one transaction and return their resulting quantities (0 = removed)."""
+    try:
+        return apply_inventory_batch(removals=items)
     except Exception as e:
         print(f"Error removing from inventory: {e}")
+        return {}
 
+def insert_recipe(cursor: sqlite3.Cursor, recipe_name: str, ingredients: List[str]) -> bool:
+    """Insert a recipe and its ingredient rows; returns False if the name already exists."""
+    ingredients = list(dict.fromkeys(name for name in ingredients if name))
+    cursor.execute(
+        "INSERT INTO recipes (recipe_name, ingredients) VALUES (?, ?) ON CONFLICT(recipe_name) DO NOTHING",
+        (recipe_name, ','.join(ingredients))
+    )
+    if cursor.rowcount == 0:
+        return False
+    recipe_id = cursor.lastrowid
+    cursor.executemany(
+        "INSERT INTO recipe_ingredients (recipe_id, item_name) VALUES (?, ?)",
+        [(recipe_id, item_name) for item_name in ingredients]
+    )
+    bump_version(cursor.connection, "recipes")
+    return True
 
+@instrumented
 def add_recipe(recipe_name: str, ingredients: List[str]):
     """Add recipe to the recipe table."""
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
-            # Check if the recipe already exists
-            cursor.execute("SELECT recipe_name FROM recipes WHERE recipe_name = ?", (recipe_name,))
-            result = cursor.fetchone()
-
-            if result:
-                print(f"Recipe '{recipe_name}' already exists.")
-            else:
-                cursor.execute(
-                    "INSERT INTO recipes (recipe_name, ingredients) VALUES (?, ?)",
-                    (recipe_name, ','.join(ingredients))
-                )
+            if insert_recipe(cursor, recipe_name, ingredients):
                 print(f"Added recipe: {recipe_name}")
+            else:
+                print(f"Recipe '{recipe_name}' already exists.")
     except Exception as e:
         print(f"Error adding recipe: {e}")
 
+# Recipe catalog file formats accepted by import_recipe_file, by extension
+RECIPE_FILE_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+def recipe_file_format(filename: str) -> Optional[str]:
+    return RECIPE_FILE_FORMATS.get(os.path.splitext(filename or "")[1].lower())
+
+def normalize_recipe(recipe_name, ingredients) -> Optional[tuple]:
+    """Return (recipe_name, ingredients) for an imported row, or None if it has no name or no ingredients."""
+    if isinstance(ingredients, str):
+        ingredients = split_ingredients(ingredients)
+    if not isinstance(recipe_name, str) or not recipe_name.strip() or not isinstance(ingredients, list):
+        return None
+    names = (name.strip() for name in ingredients if isinstance(name, str))
+    ingredients = list(dict.fromkeys(name for name in names if name))
+    return (recipe_name.strip(), ingredients) if ingredients else None
+
+def iter_recipe_rows(file, file_format: str) -> Iterator[Optional[tuple]]:
+    """
+    Lazily parse a text file of recipes, yielding (recipe_name, ingredients) per row, or None for
+    rows that can't be used. CSV files need recipe_name and ingredients (comma-joined) columns;
+    JSONL files hold one {"recipe_name": ..., "ingredients": [...]} object per line.
+    """
+    if file_format == "csv":
+        for row in csv.DictReader(file):
+            yield normalize_recipe(row.get("recipe_name"), row.get("ingredients"))
+    elif file_format == "jsonl":
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield normalize_recipe(row.get("recipe_name"), row.get("ingredients")) if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unknown recipe file format: {file_format!r}")
+
+def insert_recipe_chunk(cursor: sqlite3.Cursor, recipes: Dict[str, List[str]]) -> int:
+    """Insert recipes whose names are not taken yet, with their ingredient rows; returns how many were added."""
+    if not cursor.connection.in_transaction:
+        # Take the write lock before looking for existing names, so no other writer can add one
+        # between the check and the INSERT
+        cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        "SELECT recipe_name FROM recipes WHERE recipe_name IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(recipes)),)
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+    new = {
+        name: list(dict.fromkeys(item_name for item_name in ingredients if item_name))
+        for name, ingredients in recipes.items() if name not in existing
+    }
+    if not new:
+        return 0
+    cursor.executemany(
+        "INSERT INTO recipes (recipe_name, ingredients) VALUES (?, ?)",
+        [(name, ','.join(ingredients)) for name, ingredients in new.items()]
+    )
+    cursor.execute(
+        "SELECT recipe_name, id FROM recipes WHERE recipe_name IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(new)),)
+    )
+    recipe_ids = dict(cursor.fetchall())
+    cursor.executemany(
+        "INSERT INTO recipe_ingredients (recipe_id, item_name) VALUES (?, ?)",
+        [(recipe_ids[name], item_name) for name, ingredients in new.items() for item_name in ingredients]
+    )
+    bump_version(cursor.connection, "recipes")
+    return len(new)
+
+@instrumented
+def import_recipes(rows: Iterable[Optional[tuple]], chunk_size: int = IMPORT_CHUNK_SIZE, progress=None) -> Dict[str, int]:
+    """
+    Insert (recipe_name, ingredients) rows, chunk_size recipes per transaction, skipping names that
+    already exist or repeat and None (unparseable) rows. Only one chunk is held in memory, and
+    progress(stats) is called after each one. Returns {"read", "added", "duplicates", "invalid"},
+    plus "error" if the import stopped early (chunks committed before that are kept).
+    """
+    stats = {"read": 0, "added": 0, "duplicates": 0, "invalid": 0}
+    chunk: Dict[str, List[str]] = {}
+
+    def flush():
+        with get_connection() as conn:
+            added = insert_recipe_chunk(conn.cursor(), chunk)
+        stats["added"] += added
+        stats["duplicates"] += len(chunk) - added
+        chunk.clear()
+        if progress:
+            progress(dict(stats))
+
+    try:
+        for row in rows:
+            stats["read"] += 1
+            if row is None:
+                stats["invalid"] += 1
+            elif row[0] in chunk:
+                stats["duplicates"] += 1
+            else:
+                chunk[row[0]] = row[1]
+                if len(chunk) >= chunk_size:
+                    flush()
+        if chunk:
+            flush()
+    except Exception as e:
+        print(f"Error importing recipes: {e}")
+        stats["error"] = str(e)
+    return stats
+
+def import_recipe_file(path: str, file_format: Optional[str] = None, chunk_size: int = IMPORT_CHUNK_SIZE,
+                       progress=None) -> Dict[str, int]:
+    """Import a CSV or JSONL recipe catalog from disk; the format defaults to the file extension."""
+    file_format = file_format or recipe_file_format(path)
+    try:
+        if file_format is None:
+            raise ValueError(f"Unknown recipe file format: {path}")
+        file = open(path, "r", encoding="utf-8", newline="")
+    except (OSError, ValueError) as e:
+        print(f"Error importing recipes: {e}")
+        return {"read": 0, "added": 0, "duplicates": 0, "invalid": 0, "error": str(e)}
+    with file:
+        return import_recipes(iter_recipe_rows(file, file_format), chunk_size, progress)
+
+@instrumented
 def remove_recipe(recipe_name: str):
-    """Remove a recipe from the recipes table."""
+    """Remove a recipe (and, by cascade, its ingredient rows) from the recipes table."""
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT recipe_name FROM recipes WHERE recipe_name = ?", (recipe_name,))
-            result = cursor.fetchone()
+            cursor.execute("DELETE FROM recipes WHERE recipe_name = ?", (recipe_name,))
 
-            if result:
-                cursor.execute("DELETE FROM recipes WHERE recipe_name = ?", (recipe_name,))
+            if cursor.rowcount:
+                bump_version(conn, "recipes")
                 print(f"Removed recipe: {recipe_name}")
             else:
                 print(f"Recipe '{recipe_name}' not found.")
     except Exception as e:
         print(f"Error removing recipe: {e}")
 
+def load_recipe_ingredients(cursor: sqlite3.Cursor, recipe_ids: List[int]) -> Dict[int, List[str]]:
+    """Return the ordered ingredient names of each given recipe."""
+    cursor.execute(
+        "SELECT recipe_id, item_name FROM recipe_ingredients "
+        "WHERE recipe_id IN (SELECT value FROM json_each(?)) ORDER BY recipe_id, rowid",
+        (json.dumps(recipe_ids),)
+    )
+    ingredients: Dict[int, List[str]] = {recipe_id: [] for recipe_id in recipe_ids}
+    for recipe_id, item_name in cursor.fetchall():
+        ingredients[recipe_id].append(item_name)
+    return ingredients
+
+def load_recipes(cursor: sqlite3.Cursor) -> List[Dict[str, List[str]]]:
+    cursor.execute("""
+        SELECT r.id, r.recipe_name, ri.item_name
+        FROM recipes AS r LEFT JOIN recipe_ingredients AS ri ON ri.recipe_id = r.id
+        ORDER BY r.id, ri.rowid
+    """)
+    recipes = []
+    for _, group in groupby(cursor.fetchall(), key=lambda row: row[0]):
+        group = list(group)
+        recipes.append({
+            "recipe_name": group[0][1],
+            "ingredients": [row[2] for row in group if row[2] is not None]
+        })
+    return recipes
+
+def load_recipes_page(cursor: sqlite3.Cursor, after: int, limit: int) -> tuple:
+    """Return (recipes, next_after) for up to `limit` recipes with an id above `after`."""
+    cursor.execute("SELECT id, recipe_name FROM recipes WHERE id > ? ORDER BY id LIMIT ?", (after, limit))
+    rows = cursor.fetchall()
+    ingredients = load_recipe_ingredients(cursor, [row[0] for row in rows])
+    recipes = [{"recipe_name": row[1], "ingredients": ingredients[row[0]]} for row in rows]
+    return recipes, (rows[-1][0] if len(rows) == limit else None)
+
+@instrumented
+def get_recipes_page(after: int = 0, limit: int = PAGE_SIZE) -> tuple:
+    """Return (tag, recipes, next_after) for the recipes with an id above `after`."""
+    return fetch_page("recipes", load_recipes_page, after, limit)
+
+@instrumented
+def stream_recipes() -> tuple:
+    """Return (tag, recipes): a cached list for small catalogs, otherwise read page by page; see cached_listing."""
+    return cached_listing("recipes", load_recipes_page)
+
+@instrumented
+def get_recipes_versioned() -> tuple:
+    """Return (tag, recipes) for the catalog; the recipes are shared and must not be modified."""
+    return cached_read("recipes", load_recipes)
 
+@instrumented
 def get_recipes() -> List[Dict[str, List[str]]]:
     """Fetch all the recipes from the database."""
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT recipe_name, ingredients FROM recipes")
-            recipes = cursor.fetchall()
-        return [{"recipe_name": row[0], "ingredients": row[1].split(',')} for row in recipes]
+        _, recipes = get_recipes_versioned()
+        return [{"recipe_name": r["recipe_name"], "ingredients": list(r["ingredients"])} for r in recipes]
     except Exception as e:
         print(f"Error fetching recipes: {e}")
         return []
 
+@instrumented
 def fetch_food_items() -> List[str]:
     """Fetch all food items from food_items."""
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT item_name FROM food_items")
             items = cursor.fetchall()
@@ -152,37 +843,80 @@ def fetch_food_items() -> List[str]:
         print(f"Error fetching food items: {e}")
         return []
 
+@instrumented
+def fetch_recipe_catalog() -> Dict[str, object]:
+    """
+    Fetch everything the recipe suggestion engine indexes, read on one snapshot:
+    the recipes version, the food_items vocabulary and each recipe's ordered ingredients.
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            version = read_version(conn, "recipes")
+            cursor.execute("SELECT item_name FROM food_items ORDER BY id")
+            food_items = [row[0] for row in cursor.fetchall()]
+            cursor.execute("""
+                SELECT r.id, r.recipe_name, ri.item_name
+                FROM recipes AS r JOIN recipe_ingredients AS ri ON ri.recipe_id = r.id
+                ORDER BY r.id, ri.rowid
+            """)
+            rows = cursor.fetchall()
+        recipes = []
+        for recipe_id, group in groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            recipes.append((recipe_id, group[0][1], [row[2] for row in group]))
+        return {"version": version, "food_items": food_items, "recipes": recipes}
+    except Exception as e:
+        print(f"Error fetching recipe catalog: {e}")
+        return {"version": -1, "food_items": [], "recipes": []}
+
+@instrumented
 def get_matching_recipe() -> Dict[str, List[str]]:
     """
     Return a random recipe that can be made using ingredients in the inventory.
     """
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
 
-            # Fetch inventory items and their quantities
-            cursor.execute("SELECT item_name, quantity FROM inventory")
-            inventory = {row[0]: row[1] for row in cursor.fetchall()}
-
-            # Fetch all recipes
-            cursor.execute("SELECT recipe_name, ingredients FROM recipes")
-            recipes = cursor.fetchall()
-
-            # Find recipes that can be made with available inventory
-            matching_recipes = []
-            for recipe_name, ingredients in recipes:
-                ingredient_list = ingredients.split(',')
-                can_make = True
-                for ingredient in ingredient_list:
-                    if ingredient not in inventory or inventory[ingredient] <= 0:
-                        can_make = False
+            # Draw random ids between the lowest and highest makeable recipe and keep the first
+            # one that is itself makeable: each draw is an O(log n) lookup on the partial index
+            # and every makeable recipe is equally likely. If the makeable ids are too sparse
+            # for that to hit quickly, fall back to COUNT(*) + OFFSET, which is also uniform
+            # but linear in the number of makeable recipes.
+            # BEGIN keeps all lookups on the same snapshot
+            cursor.execute("BEGIN")
+            cursor.execute(
+                "SELECT (SELECT MIN(recipe_id) FROM recipe_status WHERE missing_count = 0), "
+                "(SELECT MAX(recipe_id) FROM recipe_status WHERE missing_count = 0)"
+            )
+            low, high = cursor.fetchone()
+            match = None
+            if low is not None:
+                for _ in range(RANDOM_RECIPE_DRAWS):
+                    cursor.execute(
+                        "SELECT recipe_id FROM recipe_status WHERE missing_count = 0 AND recipe_id = ?",
+                        (random.randint(low, high),)
+                    )
+                    match = cursor.fetchone()
+                    if match:
                         break
-                if can_make:
-                    matching_recipes.append({"recipe_name": recipe_name, "ingredients": ingredient_list})
+                else:
+                    cursor.execute("SELECT COUNT(*) FROM recipe_status WHERE missing_count = 0")
+                    cursor.execute(
+                        "SELECT recipe_id FROM recipe_status WHERE missing_count = 0 LIMIT 1 OFFSET ?",
+                        (random.randrange(cursor.fetchone()[0]),)
+                    )
+                    match = cursor.fetchone()
 
             # Return a random matching recipe, if any
-            if matching_recipes:
-                return random.choice(matching_recipes)
+            if match:
+                recipe_id = match[0]
+                cursor.execute("SELECT recipe_name FROM recipes WHERE id = ?", (recipe_id,))
+                recipe_name = cursor.fetchone()[0]
+                ingredients = load_recipe_ingredients(cursor, [recipe_id])[recipe_id]
+                return {"recipe_name": recipe_name, "ingredients": ingredients}
             else:
                 return {"error": "No recipes can be made with the available ingredients."}
 
@@ -190,6 +924,7 @@ def get_matching_recipe() -> Dict[str, List[str]]:
         print(f"Error fetching matching recipe: {e}")
         return {"error": str(e)}
     
+@instrumented
 def populate_sample_recipes():
     """Add sample recipes to the database."""
     recipes = [
@@ -201,13 +936,10 @@ def populate_sample_recipes():
     ]
 
     try:
-        with sqlite3.connect(db_path) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             for recipe_name, ingredients in recipes:
-                cursor.execute(
-                    "INSERT OR IGNORE INTO recipes (recipe_name, ingredients) VALUES (?, ?)",
-                    (recipe_name, ','.join(ingredients))
-                )
+                insert_recipe(cursor, recipe_name, ingredients)
             print("Sample recipes added successfully.")
     except Exception as e:
         print(f"Error populating sample recipes: {e}")
@@ -223,10 +955,28 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Recipe Finder CLI")
     parser.add_argument("--get-recipe", action="store_true", help="Find a recipe based on available inventory")
     parser.add_argument("--populate-recipes", action="store_true", help="Populate the database with sample recipes")
+    parser.add_argument("--check-recipe-index", action="store_true",
+                        help="Recount missing ingredients per recipe, report mismatches and rebuild the counters")
+    parser.add_argument("--import-recipes", metavar="PATH",
+                        help="Import a recipe catalog from a .csv (recipe_name,ingredients) or .jsonl file")
     args = parser.parse_args()
 
     if args.populate_recipes:
         populate_sample_recipes()
+    elif args.import_recipes:
+        def report(stats):
+            print(f"Read {stats['read']} rows: {stats['added']} added, {stats['duplicates']} duplicates, "
+                  f"{stats['invalid']} invalid")
+        stats = import_recipe_file(args.import_recipes, progress=report)
+        if "error" in stats:
+            print(f"\nImport stopped: {stats['error']}\n")
+        else:
+            print(f"\nImported {stats['added']} recipes from {args.import_recipes}\n")
+    elif args.check_recipe_index:
+        mismatches = check_recipe_status(repair=True)
+        for mismatch in mismatches:
+            print(f"Recipe {mismatch['recipe_id']}: expected {mismatch['expected']} missing, stored {mismatch['stored']}")
+        print(f"\n{len(mismatches)} inconsistent recipe counters" + (" (rebuilt)\n" if mismatches else "\n"))
     elif args.get_recipe:
         recipe = get_matching_recipe()
         if "error" not in recipe:
@@ -0,0 +1,216 @@
+#RUNS LONG API REQUESTS (SIMULATION) ON A BOUNDED BACKGROUND WORKER POOL
+# Job state is kept in the shared jobs table, so any server process can report on any job
+
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from src.cloud.database import get_connection
+
+# Jobs running at once (per process), jobs allowed to wait for a worker (across processes),
+# and finished jobs kept for polling
+JOB_WORKERS = int(os.environ.get("SEPP_JOB_WORKERS", "1"))
+JOB_QUEUE_SIZE = int(os.environ.get("SEPP_JOB_QUEUE_SIZE", "8"))
+FINISHED_JOBS_KEPT = 100
+JOB_PROGRESS_INTERVAL = 0.5  # Seconds between progress writes to the jobs table
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue already holds its maximum of waiting jobs."""
+
+class Job:
+    """
+    One submitted unit of work. The worker function reports progress through
+    set_total/advance; readers take a snapshot with to_dict. The process running the
+    job writes its state to the jobs table with save.
+    """
+
+    def __init__(self, key: str):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.done = 0
+        self.total = None
+        self.items: List[str] = []
+        self.result = None
+        self.error = None
+        self.owner = os.getpid()
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.saved_at = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_row(cls, row) -> "Job":
+        """Rebuild a job another process (or this one) saved to the jobs table."""
+        job = cls(row[1])
+        (job.id, _, job.status, job.done, job.total, items, result, job.error,
+         job.owner, job.submitted_at, job.finished_at) = row
+        job.items = json.loads(items)
+        job.result = json.loads(result) if result is not None else None
+        return job
+
+    def set_total(self, total: int):
+        with self.lock:
+            self.total = total
+        self.save()
+
+    def advance(self, item: str = None):
+        """Count one processed unit, recording its item (if any) as a partial result."""
+        with self.lock:
+            self.done += 1
+            if item is not None:
+                self.items.append(item)
+        if time.monotonic() - self.saved_at >= JOB_PROGRESS_INTERVAL:
+            self.save()
+
+    def save(self):
+        """Write the job's status, progress and result to the jobs table."""
+        with self.lock:
+            values = (self.status, self.done, self.total, json.dumps(self.items),
+                      json.dumps(self.result) if self.result is not None else None,
+                      self.error, self.finished_at, self.id)
+        try:
+            with get_connection() as conn:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, done = ?, total = ?, items = ?, result = ?, error = ?, "
+                    "finished_at = ? WHERE id = ?",
+                    values
+                )
+            self.saved_at = time.monotonic()
+        except Exception as e:
+            print(f"Error saving job {self.id}: {e}")
+
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> Dict[str, object]:
+        with self.lock:
+            job = {
+                "job_id": self.id,
+                "status": self.status,
+                "progress": {"done": self.done, "total": self.total},
+                "detected_items": list(self.items),
+            }
+            if self.result is not None:
+                job["result"] = self.result
+            if self.error is not None:
+                job["error"] = self.error
+        return job
+
+JOB_COLUMNS = "id, job_key, status, done, total, items, result, error, owner, submitted_at, finished_at"
+
+def owner_alive(pid: int) -> bool:
+    """True if the server process that owns a job is still running (jobs share one local database file)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def fail_orphaned_jobs(conn, pids):
+    """Mark queued or running jobs of processes that have exited as failed."""
+    conn.executemany(
+        "UPDATE jobs SET status = 'failed', error = 'The server process running this job exited', "
+        "finished_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+        [(time.time(), pid) for pid in pids if not owner_alive(pid)]
+    )
+
+class JobQueue:
+    """
+    Runs worker(job, *args) on up to max_workers threads. At most max_queued jobs may wait
+    for a worker; submitting a job whose key matches a queued or running job returns that
+    job instead of starting another. Both checks, and get, go through the shared jobs
+    table, so they hold across every server process using the same database.
+    """
+
+    def __init__(self, worker, max_workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_SIZE,
+                 max_finished: int = FINISHED_JOBS_KEPT):
+        self.worker = worker
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        # Jobs submitted to this process, which are fresher than their saved rows
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="sepp-job")
+
+    def submit(self, key: str, *args):
+        """Return (job, created); raises QueueFullError when the queue is full."""
+        job = Job(key)
+        with get_connection() as conn:
+            # Take the write lock first, so two processes cannot both start a job for one key
+            conn.execute("BEGIN IMMEDIATE")
+            fail_orphaned_jobs(conn, [row[0] for row in conn.execute(
+                "SELECT DISTINCT owner FROM jobs WHERE status IN ('queued', 'running')"
+            )])
+            row = conn.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs WHERE job_key = ? AND status IN ('queued', 'running')", (key,)
+            ).fetchone()
+            if row is not None:
+                with self.lock:
+                    return self.jobs.get(row[0]) or Job.from_row(row), False
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFullError(f"{queued} jobs are already waiting")
+            conn.execute(
+                "INSERT INTO jobs (id, job_key, status, owner, submitted_at) VALUES (?, ?, ?, ?, ?)",
+                (job.id, key, job.status, job.owner, job.submitted_at)
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN ('done', 'failed') "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_finished,)
+            )
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+        self.executor.submit(self._run, job, args)
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        with get_connection() as conn:
+            row = conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = Job.from_row(row)
+            if not job.finished() and not owner_alive(job.owner):
+                fail_orphaned_jobs(conn, [job.owner])
+                job = Job.from_row(conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone())
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished()]
+        for job_id in itertools.islice(finished, max(0, len(finished) - self.max_finished)):
+            del self.jobs[job_id]
+
+    def _run(self, job: Job, args):
+        with job.lock:
+            job.status = "running"
+        job.save()
+        try:
+            result = self.worker(job, *args)
+            with job.lock:
+                job.result = result
+                job.status = "done"
+        except Exception as e:
+            print(f"Error running job {job.id}: {e}")
+            with job.lock:
+                job.error = str(e)
+                job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            job.save()
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,173 @@
+#IN-PROCESS COUNTERS AND LATENCY HISTOGRAMS, EXPOSED IN PROMETHEUS TEXT FORMAT
+
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+# Set SEPP_METRICS=0 to turn recording off; timers and decorators then do nothing
+enabled = os.environ.get("SEPP_METRICS", "1") != "0"
+
+# Latency bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(names, values, extra: Tuple[str, str] = None) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A monotonically increasing count per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: List[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        if not enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, format_labels(self.labelnames, labels), value)
+                    for labels, value in sorted(self.values.items())]
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+class Histogram:
+    """Observed values counted into fixed buckets, with their sum and count, per label values."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: List[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.values: Dict[tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        if not enabled:
+            return
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, *labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels) if enabled else NULL_TIMER
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, list(state[0]), state[1]) for labels, state in self.values.items())
+        samples = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else format_value(float(bound))
+                samples.append((f"{self.name}_bucket", format_labels(self.labelnames, labels, ("le", le)), cumulative))
+            samples.append((f"{self.name}_sum", format_labels(self.labelnames, labels), total))
+            samples.append((f"{self.name}_count", format_labels(self.labelnames, labels), cumulative))
+        return samples
+
+_registry: Dict[str, object] = {}
+_registry_lock = threading.Lock()
+
+def _register(metric_class, name, documentation, labelnames, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = metric_class(name, documentation, labelnames, **kwargs)
+        return metric
+
+def counter(name: str, documentation: str, labelnames: List[str] = ()) -> Counter:
+    """Return the counter registered under `name`, creating it on first use."""
+    return _register(Counter, name, documentation, labelnames)
+
+def histogram(name: str, documentation: str, labelnames: List[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    """Return the histogram registered under `name`, creating it on first use."""
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+def timed(metric: Histogram, *labels):
+    """Decorator observing each call's duration; functions are left untouched when metrics are disabled."""
+    def decorator(function):
+        if not enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorator
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{labels} {format_value(value)}" for name, labels, value in metric.samples())
+    return "\n".join(lines) + "\n"
+
+def reset():
+    """Clear every recorded value (for tests)."""
+    with _registry_lock:
+        for metric in _registry.values():
+            with metric.lock:
+                metric.values.clear()
+
+# Shared by the prediction cache and the database read cache
+CACHE_REQUESTS = counter("sepp_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
@@ -0,0 +1,115 @@
+#RANKS RECIPES BY HOW MUCH OF THEM THE CURRENT INVENTORY COVERS
+
+import threading
+from typing import Dict, List
+import numpy as np
+
+import src.cloud.database as database
+from src.cloud.database import fetch_recipe_catalog, fetch_inventory, get_data_version
+
+# Number of set bits in every possible byte
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+def row_popcount(bits: np.ndarray) -> np.ndarray:
+    """Count set bits per row of a packed uint8 matrix."""
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+    return POPCOUNT[bits].sum(axis=1, dtype=np.int32)
+
+class RecipeEngine:
+    """
+    In-memory index of the recipe catalog for ranking partial matches.
+
+    Each recipe is a row of bits over the ingredient vocabulary (the food_items table plus any
+    other ingredient names used by recipes), packed 8 per byte. Scoring an inventory is one
+    AND-NOT and popcount over the whole matrix.
+    """
+
+    def __init__(self, food_items: List[str], recipes: List[tuple], version: int = 0, db_path: str = None):
+        # Which database file and recipes version this index was built from
+        self.db_path = db_path
+        self.version = version
+        vocabulary = dict.fromkeys(food_items)
+        for _, _, ingredients in recipes:
+            vocabulary.update(dict.fromkeys(ingredients))
+        self.vocabulary = list(vocabulary)
+        self.positions = {name: i for i, name in enumerate(self.vocabulary)}
+
+        recipes = [recipe for recipe in recipes if recipe[2]]
+        self.recipe_ids = np.array([recipe[0] for recipe in recipes], dtype=np.int64)
+        self.recipe_names = [recipe[1] for recipe in recipes]
+        self.ingredients = [recipe[2] for recipe in recipes]
+
+        # CSR layout of ingredient positions, used for quantity-aware tie-breaking
+        self.sizes = np.array([len(ingredients) for ingredients in self.ingredients], dtype=np.int32)
+        self.indptr = np.concatenate(([0], np.cumsum(self.sizes))).astype(np.int64)
+        self.indices = np.array(
+            [self.positions[name] for ingredients in self.ingredients for name in ingredients], dtype=np.int64
+        )
+
+        # Set bits directly in packed form (same big-endian bit order as np.packbits)
+        rows = np.repeat(np.arange(len(recipes)), self.sizes)
+        self.recipe_bits = np.zeros((len(recipes), (len(self.vocabulary) + 7) // 8), dtype=np.uint8)
+        np.bitwise_or.at(self.recipe_bits, (rows, self.indices >> 3), (0x80 >> (self.indices & 7)).astype(np.uint8))
+
+    def _inventory_vectors(self, inventory: Dict[str, int]):
+        quantities = np.zeros(len(self.vocabulary), dtype=np.float64)
+        for item_name, quantity in inventory.items():
+            position = self.positions.get(item_name)
+            if position is not None and quantity and quantity > 0:
+                quantities[position] = quantity
+        return quantities > 0, quantities
+
+    def suggest(self, inventory: Dict[str, int], k: int = 5, max_missing: int = 2) -> List[Dict[str, object]]:
+        """
+        Return up to k recipes missing at most max_missing ingredients, ranked by fewest missing,
+        then highest coverage, then most servings (the smallest stocked quantity among the
+        ingredients the recipe uses), then catalog order.
+        """
+        if not len(self.recipe_ids) or k <= 0:
+            return []
+        in_stock, quantities = self._inventory_vectors(inventory)
+        stock_bits = np.packbits(in_stock)
+
+        missing = row_popcount(self.recipe_bits & ~stock_bits)
+        candidates = np.flatnonzero(missing <= max_missing)
+        if not len(candidates):
+            return []
+        coverage = (self.sizes - missing) / self.sizes
+
+        # Servings: min over held ingredients' quantities (0 when nothing is held)
+        held_quantities = np.where(in_stock[self.indices], quantities[self.indices], np.inf)
+        servings = np.minimum.reduceat(held_quantities, self.indptr[:-1])
+        servings[np.isinf(servings)] = 0
+
+        order = np.lexsort((candidates, -servings[candidates], -coverage[candidates], missing[candidates]))
+        suggestions = []
+        for row in candidates[order[:k]]:
+            suggestions.append({
+                "recipe_name": self.recipe_names[row],
+                "ingredients": self.ingredients[row],
+                "missing": [name for name in self.ingredients[row] if not in_stock[self.positions[name]]],
+                "coverage": round(float(coverage[row]), 4),
+                "servings": int(servings[row]),
+            })
+        return suggestions
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_recipe_engine() -> RecipeEngine:
+    """Return the shared engine, rebuilding it when the recipes version has changed."""
+    global _engine
+    key = (database.db_path, get_data_version("recipes"))
+    if _engine is None or (_engine.db_path, _engine.version) != key:
+        with _engine_lock:
+            if _engine is None or (_engine.db_path, _engine.version) != key:
+                catalog = fetch_recipe_catalog()
+                _engine = RecipeEngine(catalog["food_items"], catalog["recipes"], catalog["version"], key[0])
+    return _engine
+
+def suggest_recipes(k: int = 5, max_missing: int = 2) -> List[Dict[str, object]]:
+    """Rank recipes against the current inventory."""
+    inventory = {item["item_name"]: item["quantity"] for item in fetch_inventory()}
+    return get_recipe_engine().suggest(inventory, k, max_missing)
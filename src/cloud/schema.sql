@@ -11,6 +11,9 @@ CREATE TABLE IF NOT EXISTS inventory (
     quantity INTEGER DEFAULT 1            -- Quantity of the item
 );
 
+-- One row per item so quantities can be upserted atomically
+CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_item_name ON inventory(item_name);
+
 -- Create table to store recipes - ABDOULAHI 
 CREATE TABLE IF NOT EXISTS recipes (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -18,16 +21,55 @@ CREATE TABLE IF NOT EXISTS recipes (
     ingredients TEXT NOT NULL
 );
 
+-- Recipe names are unique so re-running this script doesn't duplicate recipes
+CREATE UNIQUE INDEX IF NOT EXISTS idx_recipes_recipe_name ON recipes(recipe_name);
+
+-- Normalized recipe ingredients, one row per (recipe, ingredient) in recipe order
+CREATE TABLE IF NOT EXISTS recipe_ingredients (
+    recipe_id INTEGER NOT NULL REFERENCES recipes(id) ON DELETE CASCADE,
+    item_name TEXT NOT NULL,
+    PRIMARY KEY (recipe_id, item_name)
+);
+
+-- Lookup of recipes by ingredient
+CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_item_name ON recipe_ingredients(item_name);
+
+-- Change counters for cached readers, bumped by the mutating functions in database.py
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- 'epoch' is random per database file, so version numbers from a recreated file never repeat an old ETag
+INSERT OR IGNORE INTO data_versions (name, version) VALUES
+    ('recipes', 0), ('inventory', 0), ('epoch', abs(random() % 1000000000));
+
+-- Inventory deltas for the change stream: the triggers below log each changed row and
+-- bump_version stamps them with the inventory version of their transaction
+CREATE TABLE IF NOT EXISTS inventory_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    version INTEGER,
+    item_name TEXT NOT NULL,
+    quantity INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_inventory_changes_version ON inventory_changes(version);
+
+-- Every change after this inventory version is still in inventory_changes
+INSERT OR IGNORE INTO data_versions (name, version)
+    SELECT 'inventory_log_start', version FROM data_versions WHERE name = 'inventory';
+
 -- Sample food items - ABDOULAHI
 INSERT OR IGNORE INTO food_items (item_name) VALUES ('apple'), ('milk'), ('bread');
 
 -- Sample recipes - ABDOULAHI
-INSERT INTO recipes (recipe_name, ingredients) VALUES 
+-- (recipe_ingredients rows are backfilled from the ingredients column by initialize_database)
+INSERT OR IGNORE INTO recipes (recipe_name, ingredients) VALUES 
     ('Apple Pie', 'apple,flour,sugar'),
     ('Milkshake', 'milk,banana,ice cream');
 
 -- Sample inventory - ABDOULAHI
-INSERT INTO inventory (item_name, quantity) VALUES 
+INSERT OR IGNORE INTO inventory (item_name, quantity) VALUES 
     ('apple', 5),
     ('milk', 2);
 
@@ -47,4 +89,95 @@ INSERT OR IGNORE INTO food_items (item_name) VALUES
     ('chicken'),
     ('fish'),
     ('rice'),
-    ('pasta');
\ No newline at end of file
+    ('pasta');
+
+-- Number of each recipe's ingredients that are not in stock (0 = the recipe can be made).
+-- The triggers below keep it current inside the same transaction as every inventory or
+-- recipe change, so finding makeable recipes never has to re-scan ingredients.
+CREATE TABLE IF NOT EXISTS recipe_status (
+    recipe_id INTEGER PRIMARY KEY REFERENCES recipes(id) ON DELETE CASCADE,
+    missing_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- The set of makeable recipes
+CREATE INDEX IF NOT EXISTS idx_recipe_status_makeable ON recipe_status(recipe_id) WHERE missing_count = 0;
+
+-- An item comes into stock
+CREATE TRIGGER IF NOT EXISTS trg_inventory_stocked AFTER INSERT ON inventory
+WHEN IFNULL(NEW.quantity, 0) > 0
+BEGIN
+    UPDATE recipe_status SET missing_count = missing_count - 1
+    WHERE recipe_id IN (SELECT recipe_id FROM recipe_ingredients WHERE item_name = NEW.item_name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_restocked AFTER UPDATE OF quantity ON inventory
+WHEN IFNULL(OLD.quantity, 0) <= 0 AND IFNULL(NEW.quantity, 0) > 0
+BEGIN
+    UPDATE recipe_status SET missing_count = missing_count - 1
+    WHERE recipe_id IN (SELECT recipe_id FROM recipe_ingredients WHERE item_name = NEW.item_name);
+END;
+
+-- An item runs out
+CREATE TRIGGER IF NOT EXISTS trg_inventory_depleted AFTER UPDATE OF quantity ON inventory
+WHEN IFNULL(OLD.quantity, 0) > 0 AND IFNULL(NEW.quantity, 0) <= 0
+BEGIN
+    UPDATE recipe_status SET missing_count = missing_count + 1
+    WHERE recipe_id IN (SELECT recipe_id FROM recipe_ingredients WHERE item_name = OLD.item_name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_removed AFTER DELETE ON inventory
+WHEN IFNULL(OLD.quantity, 0) > 0
+BEGIN
+    UPDATE recipe_status SET missing_count = missing_count + 1
+    WHERE recipe_id IN (SELECT recipe_id FROM recipe_ingredients WHERE item_name = OLD.item_name);
+END;
+
+-- A recipe gains or loses an ingredient
+CREATE TRIGGER IF NOT EXISTS trg_recipe_ingredient_added AFTER INSERT ON recipe_ingredients
+BEGIN
+    INSERT OR IGNORE INTO recipe_status (recipe_id, missing_count) VALUES (NEW.recipe_id, 0);
+    UPDATE recipe_status SET missing_count = missing_count + 1
+    WHERE recipe_id = NEW.recipe_id
+      AND NOT EXISTS (SELECT 1 FROM inventory WHERE item_name = NEW.item_name AND quantity > 0);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_recipe_ingredient_removed AFTER DELETE ON recipe_ingredients
+BEGIN
+    UPDATE recipe_status SET missing_count = missing_count - 1
+    WHERE recipe_id = OLD.recipe_id
+      AND NOT EXISTS (SELECT 1 FROM inventory WHERE item_name = OLD.item_name AND quantity > 0);
+END;
+
+-- Log inventory deltas; removed items are logged with quantity 0
+CREATE TRIGGER IF NOT EXISTS trg_inventory_change_inserted AFTER INSERT ON inventory
+BEGIN
+    INSERT INTO inventory_changes (item_name, quantity) VALUES (NEW.item_name, IFNULL(NEW.quantity, 0));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_change_updated AFTER UPDATE OF quantity ON inventory
+WHEN NEW.quantity IS NOT OLD.quantity
+BEGIN
+    INSERT INTO inventory_changes (item_name, quantity) VALUES (NEW.item_name, MAX(IFNULL(NEW.quantity, 0), 0));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_change_deleted AFTER DELETE ON inventory
+BEGIN
+    INSERT INTO inventory_changes (item_name, quantity) VALUES (OLD.item_name, 0);
+END;
+
+-- Simulation jobs, shared by every server process; owner is the process id running the job
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    job_key TEXT NOT NULL,                -- Submissions with the same key share one unfinished job
+    status TEXT NOT NULL,                 -- queued, running, done or failed
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    items TEXT NOT NULL DEFAULT '[]',     -- JSON list of items detected so far
+    result TEXT,                          -- JSON result of a finished job
+    error TEXT,
+    owner INTEGER NOT NULL,
+    submitted_at REAL NOT NULL,
+    finished_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_unfinished ON jobs(job_key) WHERE status IN ('queued', 'running');
@@ -0,0 +1,281 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import src.cloud.app as app_module
+from src.camera.prediction_cache import PredictionCache
+from src.camera.manifest import IngestManifest
+import src.cloud.database as database
+from tests.test_database import DatabaseTestCase
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+class TestApp(unittest.TestCase):
+    def setUp(self):
+        app_module.model = None
+        app_module.datagen = None
+
+    def tearDown(self):
+        app_module.model = None
+        app_module.datagen = None
+
+    def test_import_does_not_load_tensorflow(self):
+        result = subprocess.run(
+            [sys.executable, "-c", "import sys, src.cloud.app; print('tensorflow' in sys.modules)"],
+            cwd=project_root, capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "False")
+
+    def test_import_does_not_open_camera_state(self):
+        result = subprocess.run(
+            [sys.executable, "-c", "import src.cloud.app as app; print(app.prediction_cache, app.ingest_manifest)"],
+            cwd=project_root, capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "None None")
+
+    @patch("src.cloud.app.make_datagen")
+    @patch("src.cloud.app.load_model")
+    def test_get_model_builds_once(self, mock_load_model, mock_make_datagen):
+        mock_load_model.return_value = MagicMock()
+        mock_make_datagen.return_value = None
+        first = app_module.get_model()
+        second = app_module.get_model()
+        self.assertIs(first[0], second[0])
+        self.assertIsNone(first[1])
+        mock_load_model.assert_called_once()
+        mock_make_datagen.assert_called_once()
+
+    @patch("src.cloud.app.make_datagen")
+    @patch("src.cloud.app.load_model")
+    def test_warm_up_runs_dummy_predict(self, mock_load_model, mock_make_datagen):
+        mock_model = MagicMock()
+        mock_load_model.return_value = mock_model
+        app_module.warm_up_model(background=True).join(timeout=5)
+        self.assertEqual(mock_model.predict.call_args[0][0].shape, (1, 224, 224, 3))
+
+class TestInventoryEndpoints(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = app_module.app.test_client()
+
+    def test_batch_endpoint_applies_all_changes(self):
+        response = self.client.post("/api/inventory/batch", json={
+            "add": [{"item_name": "bread", "quantity": 2}, {"item_name": "bread"}, {"item_name": "egg", "quantity": 6}],
+            "remove": [{"item_name": "milk", "quantity": 5}, {"item_name": "egg", "quantity": 1}],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"inventory": {"bread": 3, "egg": 5, "milk": 0}})
+
+    def test_batch_endpoint_rejects_bad_quantities(self):
+        response = self.client.post("/api/inventory/batch", json={"add": [{"item_name": "bread", "quantity": -1}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("bread", [item["item_name"] for item in database.fetch_inventory()])
+
+    def test_batch_endpoint_rejects_bare_strings(self):
+        response = self.client.post("/api/inventory/batch", json={"add": "apple"})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("a", [item["item_name"] for item in database.fetch_inventory()])
+
+    def test_inventory_etag_revalidation(self):
+        response = self.client.get("/api/inventory")
+        etag = response.headers["ETag"]
+        cached = self.client.get("/api/inventory", headers={"If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.headers["ETag"], etag)
+
+        database.add_to_inventory("bread", 1)
+        changed = self.client.get("/api/inventory", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+        self.assertIn("bread", [item["item_name"] for item in changed.get_json()])
+
+    def test_recipes_listing_etag(self):
+        etag = self.client.get("/api/recipes").headers["ETag"]
+        self.assertEqual(self.client.get("/api/recipes", headers={"If-None-Match": etag}).status_code, 304)
+        database.add_recipe("Toast", ["bread", "butter"])
+        response = self.client.get("/api/recipes", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn({"recipe_name": "Toast", "ingredients": ["bread", "butter"]}, response.get_json())
+
+    def test_inventory_pages(self):
+        database.apply_inventory_batch({f"item{i}": 1 for i in range(5)})
+        first = self.client.get("/api/inventory?limit=4")
+        self.assertEqual(len(first.get_json()["items"]), 4)
+        second = self.client.get(f"/api/inventory?limit=4&after={first.get_json()['next']}").get_json()
+        self.assertIsNone(second["next"])
+        listed = first.get_json()["items"] + second["items"]
+        self.assertEqual(listed, self.client.get("/api/inventory").get_json())
+        self.assertEqual(self.client.get("/api/inventory?limit=4", headers={"If-None-Match": first.headers["ETag"]})
+                         .status_code, 304)
+        self.assertEqual(self.client.get("/api/inventory?limit=0").status_code, 400)
+        self.assertEqual(self.client.get("/api/recipes?after=x").status_code, 400)
+
+    def test_large_listing_is_streamed(self):
+        database.apply_inventory_batch({f"item{i}": 1 for i in range(12)})
+        with patch.object(database, "CACHED_LISTING_ROWS", 5):
+            response = self.client.get("/api/inventory")
+        self.assertNotIn("Content-Length", response.headers)
+        self.assertEqual(response.get_json(), database.fetch_inventory())
+        self.assertIn("Content-Length", self.client.get("/api/inventory").headers)  # small enough to cache
+
+    def test_recipe_import_from_raw_csv_body(self):
+        body = "recipe_name,ingredients\nToast,\"bread,butter\"\nToast,bread\n,egg\n"
+        response = self.client.post("/api/recipes/import", data=body, content_type="text/csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"read": 3, "added": 1, "duplicates": 1, "invalid": 1})
+        self.assertIn({"recipe_name": "Toast", "ingredients": ["bread", "butter"]},
+                      self.client.get("/api/recipes").get_json())
+
+    def test_recipe_import_from_uploaded_jsonl(self):
+        content = json.dumps({"recipe_name": "Omelette", "ingredients": ["egg", "milk"]}).encode()
+        response = self.client.post("/api/recipes/import", content_type="multipart/form-data",
+                                    data={"file": (io.BytesIO(content), "catalog.jsonl")})
+        self.assertEqual(response.get_json()["added"], 1)
+        rejected = self.client.post("/api/recipes/import", data="Toast", content_type="text/plain")
+        self.assertEqual(rejected.status_code, 400)
+
+    def read_events(self, response, count):
+        """Parse the next `count` events (comments and retry hints skipped) from a streamed response."""
+        events = []
+        chunks = response.response
+        while len(events) < count:
+            message = next(chunks)
+            message = message.decode() if isinstance(message, bytes) else message
+            fields = dict(line.split(": ", 1) for line in message.strip().split("\n") if not line.startswith(("retry", ":")))
+            if fields:
+                events.append((fields.get("id"), fields["event"], json.loads(fields["data"])))
+        return events
+
+    @patch("src.cloud.app.STREAM_POLL_INTERVAL", 0.01)
+    def test_inventory_stream_sends_snapshot_then_deltas(self):
+        response = self.client.get("/api/inventory/stream", buffered=False)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        (snapshot_id, event, data), = self.read_events(response, 1)
+        self.assertEqual(event, "snapshot")
+        self.assertEqual(data["items"], database.fetch_inventory())
+
+        self.client.post("/api/inventory", json={"item_name": "bread", "quantity": 2})
+        self.client.delete("/api/inventory/milk")
+        (first_id, event, first), (second_id, _, second) = self.read_events(response, 2)
+        response.close()
+        self.assertEqual(event, "inventory")
+        self.assertEqual(first["items"], [{"item_name": "bread", "quantity": 2}])
+        self.assertEqual(second["items"], [{"item_name": "milk", "quantity": 1}])
+        self.assertEqual(second_id, database.fetch_inventory_versioned()[0])
+
+        # A reconnecting client resumes after its last event instead of reloading
+        resumed = self.client.get("/api/inventory/stream", headers={"Last-Event-ID": first_id}, buffered=False)
+        (event_id, event, data), = self.read_events(resumed, 1)
+        resumed.close()
+        self.assertEqual((event_id, event, data), (second_id, "inventory", second))
+
+    @patch("src.cloud.app.STREAM_MAX_AGE", 0)
+    def test_inventory_stream_ends_after_max_age(self):
+        response = self.client.get("/api/inventory/stream")
+        body = response.get_data(as_text=True)
+        self.assertEqual(body.count("event: snapshot"), 1)
+
+    def test_suggest_endpoint(self):
+        database.add_recipe("Toast", ["bread", "butter"])
+        database.add_to_inventory("bread", 2)
+        response = self.client.get("/api/recipes/suggest?k=3&max_missing=1")
+        self.assertEqual(response.status_code, 200)
+        toast = next(r for r in response.get_json()["recipes"] if r["recipe_name"] == "Toast")
+        self.assertEqual(toast["missing"], ["butter"])
+        self.assertEqual(self.client.get("/api/recipes/suggest?k=zero").status_code, 400)
+
+class TestSimulationJobs(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.image_folder = os.path.join(self.tmp.name, "images")
+        os.mkdir(self.image_folder)
+        for name in ["a.jpg", "b.jpg", "c.jpg"]:
+            open(os.path.join(self.image_folder, name), "wb").close()
+        state_path = os.path.join(self.tmp.name, "camera_state.db")
+        for name, state in [("prediction_cache", PredictionCache(state_path)), ("ingest_manifest", IngestManifest(state_path))]:
+            patcher = patch.object(app_module, name, state)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app_module.app.test_client()
+
+    def wait_for(self, job_id):
+        for _ in range(100):
+            state = self.client.get(f"/api/simulate/{job_id}").get_json()
+            if state["status"] in ("done", "failed"):
+                return state
+            time.sleep(0.05)
+        self.fail("simulation job did not finish")
+
+    @patch("src.cloud.app.get_model", return_value=(MagicMock(), None))
+    @patch("src.cloud.app.iter_detections")
+    def test_simulate_runs_as_job(self, mock_iter_detections, mock_get_model):
+        mock_iter_detections.return_value = iter([("a.jpg", ("egg", 0.9)), ("b.jpg", None), ("c.jpg", ("egg", 0.8))])
+        response = self.client.post("/api/simulate", json={"image_folder": self.image_folder})
+        self.assertEqual(response.status_code, 202)
+        state = self.wait_for(response.get_json()["job_id"])
+        self.assertEqual(state["status"], "done")
+        self.assertEqual(state["progress"], {"done": 3, "total": 3})
+        self.assertEqual(state["detected_items"], ["egg", "egg"])
+        self.assertEqual({i["item_name"]: i["quantity"] for i in database.fetch_inventory()}["egg"], 2)
+
+    @patch("src.cloud.app.get_model", return_value=(MagicMock(), None))
+    @patch("src.cloud.app.iter_detections")
+    @patch("src.cloud.app.apply_inventory_batch", side_effect=sqlite3.OperationalError("database is locked"))
+    def test_failed_inventory_write_fails_job(self, mock_apply_batch, mock_iter_detections, mock_get_model):
+        mock_iter_detections.return_value = iter([("a.jpg", ("egg", 0.9))])
+        response = self.client.post("/api/simulate", json={"image_folder": self.image_folder})
+        state = self.wait_for(response.get_json()["job_id"])
+        self.assertEqual(state["status"], "failed")
+        self.assertIn("database is locked", state["error"])
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get("/api/simulate/missing").status_code, 404)
+
+class TestLegacyDatabase(unittest.TestCase):
+    """The app must migrate a database created by the original schema.sql before serving it."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.original_db_path = database.db_path
+        database.db_path = os.path.join(self.tmp.name, "legacy.db")
+        with sqlite3.connect(database.db_path) as conn:
+            conn.executescript("""
+                CREATE TABLE food_items (id INTEGER PRIMARY KEY AUTOINCREMENT, item_name TEXT NOT NULL UNIQUE);
+                CREATE TABLE inventory (id INTEGER PRIMARY KEY AUTOINCREMENT, item_name TEXT NOT NULL,
+                                        quantity INTEGER DEFAULT 1);
+                CREATE TABLE recipes (id INTEGER PRIMARY KEY AUTOINCREMENT, recipe_name TEXT NOT NULL,
+                                      ingredients TEXT NOT NULL);
+                INSERT INTO recipes (recipe_name, ingredients) VALUES ('Toast', 'bread,butter');
+                INSERT INTO inventory (item_name, quantity) VALUES ('bread', 1), ('butter', 1), ('bread', 2);
+            """)
+        conn.close()
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        database.close_connections()
+        database.db_path = self.original_db_path
+        self.tmp.cleanup()
+
+    def test_first_request_migrates_database(self):
+        listed = self.client.get("/api/inventory")
+        self.assertEqual(listed.status_code, 200)
+        self.assertIn({"item_name": "bread", "quantity": 3}, listed.get_json())
+        response = self.client.post("/api/inventory", json={"item_name": "bread", "quantity": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn({"item_name": "bread", "quantity": 4}, self.client.get("/api/inventory").get_json())
+        self.assertEqual(self.client.get("/api/recipe").status_code, 200)
+
+    def test_failed_upsert_is_reported(self):
+        with patch.object(app_module, "ensure_database", return_value=True):
+            response = self.client.post("/api/inventory", json={"item_name": "bread", "quantity": 1})
+        self.assertEqual(response.status_code, 500)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import keras
+
+from src.camera.backends import export_tflite, load_backend, check_agreement, TFLiteModel
+
+def build_small_model():
+    """A tiny stand-in for MobileNetV2 with the same input and output shapes."""
+    inputs = keras.Input((224, 224, 3))
+    pooled = keras.layers.GlobalAveragePooling2D()(inputs)
+    outputs = keras.layers.Dense(1000, kernel_initializer=keras.initializers.RandomNormal(stddev=5.0, seed=1))(pooled)
+    return keras.Model(inputs, outputs)
+
+class TestBackends(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.keras_model = build_small_model()
+        cls.model_path = export_tflite(
+            "float16", os.path.join(cls.tmp.name, "small_float16.tflite"), keras_model=cls.keras_model
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_tflite_model_matches_keras_predict(self):
+        tflite_model = TFLiteModel(self.model_path)
+        batch = np.random.default_rng(0).uniform(-1, 1, (3, 224, 224, 3)).astype(np.float32)
+        expected = self.keras_model.predict(batch, verbose=0)
+        np.testing.assert_allclose(tflite_model.predict(batch), expected, atol=0.05)
+        # Batch size changes resize the interpreter input
+        self.assertEqual(tflite_model.predict(batch[:1]).shape, (1, 1000))
+
+    def test_check_agreement_on_sample_images(self):
+        report = check_agreement("float16", keras_model=self.keras_model, tflite_model=TFLiteModel(self.model_path))
+        self.assertGreater(report["images"], 0)
+        self.assertEqual(report["top1_agreement"], 1.0)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            load_backend("onnx")
+
+if __name__ == "__main__":
+    unittest.main()
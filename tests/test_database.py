@@ -0,0 +1,394 @@
+import unittest
+import json
+import os
+import sqlite3
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+
+import src.cloud.database as database
+
+class DatabaseTestCase(unittest.TestCase):
+    """Points the database module at a fresh temporary database for each test."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.original_db_path = database.db_path
+        database.db_path = os.path.join(self.tmp.name, "inventory.db")
+        database.initialize_database()
+
+    def tearDown(self):
+        database.close_connections()
+        database.db_path = self.original_db_path
+        self.tmp.cleanup()
+
+    def inventory(self):
+        return {item["item_name"]: item["quantity"] for item in database.fetch_inventory()}
+
+class TestConnectionPool(DatabaseTestCase):
+    def test_connections_are_reused(self):
+        with database.get_connection() as first:
+            pass
+        with database.get_connection() as second:
+            pass
+        self.assertIs(first, second)
+
+    def test_concurrent_checkouts_get_distinct_connections(self):
+        with database.get_connection() as outer:
+            with database.get_connection() as inner:
+                self.assertIsNot(outer, inner)
+
+    def test_connections_are_tuned(self):
+        with database.get_connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertEqual(conn.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+
+    def test_failed_transaction_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with database.get_connection() as conn:
+                conn.execute("INSERT INTO inventory (item_name, quantity) VALUES ('caviar', 1)")
+                raise RuntimeError("boom")
+        self.assertNotIn("caviar", self.inventory())
+
+    def test_repointed_db_path_opens_new_connection(self):
+        with database.get_connection() as first:
+            pass
+        database.db_path = os.path.join(self.tmp.name, "other.db")
+        with database.get_connection() as second:
+            pass
+        self.assertIsNot(first, second)
+        self.assertEqual(second.db_path, database.db_path)
+
+class TestInventory(DatabaseTestCase):
+    def test_add_and_remove(self):
+        database.add_to_inventory("bread", 2)
+        database.add_to_inventory("bread", 3)
+        self.assertEqual(self.inventory()["bread"], 5)
+        database.remove_from_inventory("bread", 4)
+        self.assertEqual(self.inventory()["bread"], 1)
+        database.remove_from_inventory("bread", 1)
+        self.assertNotIn("bread", self.inventory())
+
+    def test_remove_more_than_available_deletes_item(self):
+        database.add_to_inventory("bread", 2)
+        database.remove_from_inventory("bread", 5)
+        self.assertNotIn("bread", self.inventory())
+
+    def test_concurrent_adds_from_threads(self):
+        threads = [threading.Thread(target=database.add_to_inventory, args=("egg", 1)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.inventory()["egg"], 8)
+
+    def test_reinitializing_keeps_quantities(self):
+        before = self.inventory()
+        database.initialize_database()
+        self.assertEqual(self.inventory(), before)
+
+    def test_add_many_coalesces_duplicates(self):
+        quantities = database.add_many_to_inventory(["apple", "banana", "apple", ("banana", 2)])
+        self.assertEqual(quantities, {"apple": 7, "banana": 3})  # schema seeds 5 apples
+        self.assertEqual(self.inventory()["banana"], 3)
+
+    def test_remove_many_reports_removed_items_as_zero(self):
+        database.add_many_to_inventory({"bread": 3, "egg": 2})
+        quantities = database.remove_many_from_inventory([("bread", 1), "egg", "egg", "caviar"])
+        self.assertEqual(quantities, {"bread": 2, "caviar": 0, "egg": 0})
+        self.assertNotIn("egg", self.inventory())
+
+    def test_batch_is_all_or_nothing(self):
+        with self.assertRaises(ValueError):
+            database.apply_inventory_batch(additions=["bread", ("egg", 0)])
+        self.assertNotIn("bread", self.inventory())
+
+class TestReadCache(DatabaseTestCase):
+    def test_unchanged_inventory_is_served_from_cache(self):
+        first_tag, first = database.fetch_inventory_versioned()
+        second_tag, second = database.fetch_inventory_versioned()
+        self.assertEqual(first_tag, second_tag)
+        self.assertIs(first, second)
+        database.add_to_inventory("bread", 1)
+        tag, items = database.fetch_inventory_versioned()
+        self.assertNotEqual(tag, first_tag)
+        self.assertIn("bread", [item["item_name"] for item in items])
+
+    def test_removing_missing_item_keeps_version(self):
+        tag, _ = database.fetch_inventory_versioned()
+        database.remove_from_inventory("caviar", 1)
+        self.assertEqual(database.fetch_inventory_versioned()[0], tag)
+
+    def test_change_from_another_process_invalidates_cache(self):
+        tag, _ = database.fetch_inventory_versioned()
+        recipes_tag, _ = database.get_recipes_versioned()
+        script = (
+            "import sys, src.cloud.database as database; database.db_path = sys.argv[1]; "
+            "database.add_to_inventory('egg', 2); database.add_recipe('Omelette', ['egg'])"
+        )
+        project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+        subprocess.run([sys.executable, "-c", script, database.db_path], cwd=project_root, check=True,
+                       capture_output=True)
+        self.assertNotEqual(database.fetch_inventory_versioned()[0], tag)
+        self.assertEqual(self.inventory()["egg"], 2)
+        self.assertNotEqual(database.get_recipes_versioned()[0], recipes_tag)
+        self.assertIn("Omelette", [recipe["recipe_name"] for recipe in database.get_recipes()])
+
+    def test_callers_get_copies(self):
+        database.fetch_inventory()[0]["quantity"] = 1000
+        self.assertNotIn(1000, self.inventory().values())
+
+class TestInventoryChanges(DatabaseTestCase):
+    def test_mutations_are_logged_as_deltas(self):
+        tag, _ = database.fetch_inventory_versioned()
+        database.add_to_inventory("bread", 2)
+        database.remove_from_inventory("milk", 10)
+        database.remove_from_inventory("caviar", 1)
+        database.apply_inventory_batch(additions={"egg": 6}, removals={"apple": 1, "bread": 2})
+        result = database.fetch_inventory_changes(tag)
+        self.assertEqual([change["items"] for change in result["changes"]], [
+            [{"item_name": "bread", "quantity": 2}],
+            [{"item_name": "milk", "quantity": 0}],
+            [{"item_name": "egg", "quantity": 6}, {"item_name": "apple", "quantity": 4},
+             {"item_name": "bread", "quantity": 0}],
+        ])
+        self.assertEqual(result["tag"], database.fetch_inventory_versioned()[0])
+        self.assertEqual(database.fetch_inventory_changes(result["tag"]), {"tag": result["tag"], "changes": []})
+
+    def test_resume_from_middle_of_log(self):
+        database.add_to_inventory("bread", 1)
+        tag, _ = database.fetch_inventory_versioned()
+        database.add_to_inventory("egg", 1)
+        changes = database.fetch_inventory_changes(tag)["changes"]
+        self.assertEqual([change["items"][0]["item_name"] for change in changes], ["egg"])
+
+    def test_unknown_or_expired_position_gets_snapshot(self):
+        tag, items = database.fetch_inventory_versioned()
+        epoch, version = tag.split("-")
+        self.assertEqual(database.fetch_inventory_changes(None), {"tag": tag, "snapshot": items})
+        self.assertIn("snapshot", database.fetch_inventory_changes(f"{int(epoch) + 1}-{version}"))
+        self.assertIn("snapshot", database.fetch_inventory_changes("garbage"))
+
+        original = database.INVENTORY_CHANGES_KEPT
+        database.INVENTORY_CHANGES_KEPT = 2
+        try:
+            for i in range(4):
+                database.add_to_inventory(f"item{i}", 1)
+        finally:
+            database.INVENTORY_CHANGES_KEPT = original
+        result = database.fetch_inventory_changes(tag)
+        self.assertEqual(result["tag"], database.fetch_inventory_versioned()[0])
+        self.assertIn({"item_name": "item3", "quantity": 1}, result["snapshot"])
+
+    def test_small_listings_are_cached_and_large_ones_streamed(self):
+        tag, items = database.cached_listing("inventory", database.load_inventory_page)
+        self.assertIsInstance(items, list)
+        self.assertIs(database.cached_listing("inventory", database.load_inventory_page)[1], items)
+        self.assertIs(database.fetch_inventory_versioned()[1], items)
+        rollbacks = database.DB_TRANSACTIONS.values.get(("rollback",), 0)
+        self.assertIs(database.cached_listing("inventory", database.load_inventory_page)[1], items)
+        self.assertEqual(database.DB_TRANSACTIONS.values.get(("rollback",), 0), rollbacks)  # a hit is not a rollback
+
+        database.apply_inventory_batch({f"item{i}": 1 for i in range(10)})
+        tag, items = database.cached_listing("inventory", database.load_inventory_page, max_rows=5)
+        self.assertNotIsInstance(items, list)
+        self.assertEqual(list(items), database.fetch_inventory())
+
+class TestRecipes(DatabaseTestCase):
+    def test_recipes_keep_ingredient_order(self):
+        database.add_recipe("Toast", ["bread", "butter", "bread"])
+        database.add_recipe("Toast", ["bread"])
+        recipes = {recipe["recipe_name"]: recipe["ingredients"] for recipe in database.get_recipes()}
+        self.assertEqual(recipes["Toast"], ["bread", "butter"])
+        self.assertEqual(recipes["Apple Pie"], ["apple", "flour", "sugar"])  # backfilled from schema.sql
+
+    def test_matching_recipe_requires_every_ingredient_in_stock(self):
+        database.add_recipe("Toast", ["bread", "butter"])
+        database.add_to_inventory("bread", 1)
+        self.assertIn("error", database.get_matching_recipe())
+        database.add_to_inventory("butter", 1)
+        self.assertEqual(database.get_matching_recipe(), {"recipe_name": "Toast", "ingredients": ["bread", "butter"]})
+        database.remove_from_inventory("butter", 1)
+        self.assertIn("error", database.get_matching_recipe())
+
+    def test_matching_recipe_is_uniform_over_sparse_ids(self):
+        database.import_recipes((f"Loaf {i}", ["sourdough"]) for i in range(1000))
+        with database.get_connection() as conn:
+            ids = [row[0] for row in conn.execute("SELECT id FROM recipes WHERE recipe_name LIKE 'Loaf %' ORDER BY id")]
+            conn.executemany("DELETE FROM recipes WHERE id = ?", [(i,) for i in ids[3:-1]])
+        database.add_to_inventory("sourdough", 1)
+        random.seed(0)
+        picks = {}
+        for _ in range(2000):
+            name = database.get_matching_recipe()["recipe_name"]
+            picks[name] = picks.get(name, 0) + 1
+        self.assertEqual(sorted(picks), ["Loaf 0", "Loaf 1", "Loaf 2", "Loaf 999"])
+        for count in picks.values():
+            self.assertLess(abs(count - 500), 100)
+
+    def test_remove_recipe_cascades_to_ingredients(self):
+        database.add_recipe("Toast", ["bread", "butter"])
+        database.remove_recipe("Toast")
+        with database.get_connection() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM recipe_ingredients WHERE item_name = 'butter'").fetchone()[0]
+        self.assertEqual(rows, 0)
+
+    def test_recipe_status_tracks_random_changes(self):
+        items = ["apple", "bread", "butter", "cheese", "egg", "milk"]
+        rng = random.Random(0)
+        for i in range(20):
+            database.add_recipe(f"Recipe {i}", rng.sample(items, rng.randint(1, 4)))
+        for _ in range(200):
+            operation = rng.choice(["add", "remove", "batch", "recipe"])
+            if operation == "add":
+                database.add_to_inventory(rng.choice(items), rng.randint(1, 3))
+            elif operation == "remove":
+                database.remove_from_inventory(rng.choice(items), rng.randint(1, 3))
+            elif operation == "batch":
+                database.apply_inventory_batch(rng.sample(items, 2), rng.sample(items, 2))
+            else:
+                database.remove_recipe(f"Recipe {rng.randrange(20)}")
+                database.add_recipe(f"Recipe {rng.randrange(20, 40)}", rng.sample(items, 3))
+        self.assertEqual(database.check_recipe_status(repair=False), [])
+
+    def test_check_recipe_status_repairs_counters(self):
+        database.add_recipe("Toast", ["bread", "butter"])
+        database.add_many_to_inventory(["bread", "butter"])
+        with database.get_connection() as conn:
+            conn.execute("UPDATE recipe_status SET missing_count = 2")
+        self.assertIn("error", database.get_matching_recipe())
+        mismatches = database.check_recipe_status(repair=True)
+        self.assertTrue(any(m["expected"] == 0 and m["stored"] == 2 for m in mismatches))
+        self.assertEqual(database.check_recipe_status(repair=False), [])
+        self.assertEqual(database.get_matching_recipe()["recipe_name"], "Toast")
+
+class TestRecipeImport(DatabaseTestCase):
+    def write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            file.write(content)
+        return path
+
+    def test_csv_import_in_chunks(self):
+        path = self.write("catalog.csv", (
+            "recipe_name,ingredients\n"
+            "Toast,\"bread, butter, bread\"\n"
+            "Omelette,\"egg,milk\"\n"
+            "Toast,\"bread,jam\"\n"
+            ",egg\n"
+            "Porridge,\n"
+            "Pancakes,\"flour,egg,milk\"\n"
+        ))
+        reports = []
+        stats = database.import_recipe_file(path, chunk_size=2, progress=reports.append)
+        self.assertEqual(stats, {"read": 6, "added": 3, "duplicates": 1, "invalid": 2})
+        self.assertEqual([report["added"] for report in reports], [2, 3])
+        recipes = {recipe["recipe_name"]: recipe["ingredients"] for recipe in database.get_recipes()}
+        self.assertEqual(recipes["Toast"], ["bread", "butter"])
+        self.assertEqual(recipes["Pancakes"], ["flour", "egg", "milk"])
+        self.assertEqual(database.check_recipe_status(repair=False), [])
+
+    def test_jsonl_import_skips_existing_and_bad_lines(self):
+        existing = database.get_recipes()[0]["recipe_name"]
+        path = self.write("catalog.jsonl", "\n".join([
+            json.dumps({"recipe_name": existing, "ingredients": ["apple"]}),
+            json.dumps({"recipe_name": "Fruit salad", "ingredients": ["apple", "orange"]}),
+            "{not json",
+            json.dumps(["Toast", "bread"]),
+            "",
+        ]))
+        stats = database.import_recipe_file(path)
+        self.assertEqual(stats, {"read": 4, "added": 1, "duplicates": 1, "invalid": 2})
+        self.assertIn({"recipe_name": "Fruit salad", "ingredients": ["apple", "orange"]}, database.get_recipes())
+
+    def test_concurrent_imports_of_the_same_catalog(self):
+        rows = [(f"Recipe {i}", ["salt", f"item{i}"]) for i in range(200)]
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(database.import_recipes(rows, chunk_size=10)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([result.get("error") for result in results], [None] * 4)
+        self.assertEqual(sum(result["added"] for result in results), 200)
+
+    def test_unknown_format_is_reported(self):
+        stats = database.import_recipe_file(self.write("catalog.txt", "Toast"))
+        self.assertEqual(stats["added"], 0)
+        self.assertIn("error", stats)
+
+class TestPagination(DatabaseTestCase):
+    def test_recipe_pages_cover_the_catalog(self):
+        database.import_recipes((f"Recipe {i}", [f"item{i}", "salt"]) for i in range(25))
+        pages, after = [], 0
+        while after is not None:
+            _, recipes, after = database.get_recipes_page(after, limit=10)
+            pages.append(recipes)
+        self.assertEqual([len(page) for page in pages], [10, 10, 7])
+        self.assertEqual([recipe for page in pages for recipe in page], database.get_recipes())
+
+    def test_streamed_listing_matches_cached_read(self):
+        database.apply_inventory_batch({f"item{i}": i + 1 for i in range(30)})
+        tag, items = database.stream_listing("inventory", database.load_inventory_page, page_size=7)
+        cached_tag, cached = database.fetch_inventory_versioned()
+        self.assertEqual(tag, cached_tag)
+        self.assertEqual(list(items), cached)
+
+class TestMigration(unittest.TestCase):
+    def test_duplicate_inventory_rows_are_merged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            original_db_path = database.db_path
+            database.db_path = os.path.join(tmp, "legacy.db")
+            try:
+                with sqlite3.connect(database.db_path) as conn:
+                    conn.executescript("""
+                        CREATE TABLE inventory (id INTEGER PRIMARY KEY AUTOINCREMENT, item_name TEXT NOT NULL,
+                                                quantity INTEGER DEFAULT 1);
+                        INSERT INTO inventory (item_name, quantity) VALUES
+                            ('apple', 5), ('milk', 2), ('apple', 5), ('bread', 1), ('apple', 3);
+                    """)
+                conn.close()
+                database.initialize_database()
+                with self.assertRaises(sqlite3.IntegrityError):
+                    with database.get_connection() as conn:
+                        conn.execute("INSERT INTO inventory (item_name, quantity) VALUES ('bread', 1)")
+                items = database.fetch_inventory()
+            finally:
+                database.close_connections()
+                database.db_path = original_db_path
+        self.assertEqual(sorted((i["item_name"], i["quantity"]) for i in items),
+                         [("apple", 13), ("bread", 1), ("milk", 2)])
+
+    def test_csv_recipes_are_normalized(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            original_db_path = database.db_path
+            database.db_path = os.path.join(tmp, "legacy.db")
+            try:
+                with sqlite3.connect(database.db_path) as conn:
+                    conn.executescript("""
+                        CREATE TABLE recipes (id INTEGER PRIMARY KEY AUTOINCREMENT, recipe_name TEXT NOT NULL,
+                                              ingredients TEXT NOT NULL);
+                        INSERT INTO recipes (recipe_name, ingredients) VALUES
+                            ('Apple Pie', 'apple,flour,sugar'), ('Toast', 'bread, butter'), ('Apple Pie', 'apple,flour,sugar');
+                    """)
+                conn.close()
+                database.initialize_database()
+                database.add_many_to_inventory(["bread", "butter"])
+                recipes = database.get_recipes()
+                match = database.get_matching_recipe()
+            finally:
+                database.close_connections()
+                database.db_path = original_db_path
+        self.assertEqual(recipes[:2], [
+            {"recipe_name": "Apple Pie", "ingredients": ["apple", "flour", "sugar"]},
+            {"recipe_name": "Toast", "ingredients": ["bread", "butter"]},
+        ])
+        self.assertEqual([recipe["recipe_name"] for recipe in recipes].count("Apple Pie"), 1)
+        self.assertEqual(match["recipe_name"], "Toast")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import subprocess
+import sys
+import threading
+import time
+
+import src.cloud.database as database
+from src.cloud.jobs import JobQueue, QueueFullError
+from tests.test_database import DatabaseTestCase
+
+class TestJobQueue(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def blocking_worker(self, job, items):
+        job.set_total(len(items))
+        self.started.set()
+        self.release.wait(timeout=5)
+        for item in items:
+            job.advance(item)
+        return {"count": len(items)}
+
+    def test_job_reports_progress_and_result(self):
+        queue = JobQueue(self.blocking_worker, max_workers=1, max_queued=1)
+        job, created = queue.submit("folder", ["apple", None, "milk"])
+        self.assertTrue(created)
+        self.started.wait(timeout=5)
+        self.assertEqual(queue.get(job.id).to_dict()["status"], "running")
+        self.release.set()
+        queue.shutdown()
+        state = job.to_dict()
+        self.assertEqual(state["status"], "done")
+        self.assertEqual(state["progress"], {"done": 3, "total": 3})
+        self.assertEqual(state["detected_items"], ["apple", "milk"])
+        self.assertEqual(state["result"], {"count": 3})
+
+    def test_duplicate_submissions_are_coalesced(self):
+        queue = JobQueue(self.blocking_worker, max_workers=1, max_queued=1)
+        first, _ = queue.submit("folder", ["apple"])
+        second, created = queue.submit("folder", ["apple"])
+        self.assertIs(first, second)
+        self.assertFalse(created)
+        self.release.set()
+        queue.shutdown()
+        # A finished job no longer absorbs new submissions
+        queue = JobQueue(self.blocking_worker, max_workers=1, max_queued=1)
+        self.assertTrue(queue.submit("folder", ["apple"])[1])
+        queue.shutdown()
+
+    def test_full_queue_rejects_jobs(self):
+        queue = JobQueue(self.blocking_worker, max_workers=1, max_queued=1)
+        queue.submit("running", ["apple"])
+        self.started.wait(timeout=5)
+        queue.submit("waiting", ["milk"])
+        with self.assertRaises(QueueFullError):
+            queue.submit("rejected", ["bread"])
+        self.release.set()
+        queue.shutdown()
+
+    def test_failed_job_records_error(self):
+        def failing_worker(job):
+            raise RuntimeError("model unavailable")
+        queue = JobQueue(failing_worker)
+        job, _ = queue.submit("folder")
+        queue.shutdown()
+        self.assertEqual(job.to_dict()["status"], "failed")
+        self.assertEqual(job.to_dict()["error"], "model unavailable")
+
+    def test_other_processes_see_shared_jobs(self):
+        # A second queue stands in for another server process using the same database
+        queue, other = (JobQueue(self.blocking_worker, max_workers=1, max_queued=1) for _ in range(2))
+        job, _ = queue.submit("folder", ["apple", "milk"])
+        self.started.wait(timeout=5)
+        coalesced, created = other.submit("folder", ["apple", "milk"])
+        self.assertFalse(created)
+        self.assertEqual(coalesced.id, job.id)
+        self.assertEqual(other.get(job.id).to_dict()["progress"], {"done": 0, "total": 2})
+        queue.submit("waiting", ["bread"])
+        with self.assertRaises(QueueFullError):
+            other.submit("rejected", ["bread"])
+        self.release.set()
+        queue.shutdown()
+        state = other.get(job.id).to_dict()
+        self.assertEqual(state["status"], "done")
+        self.assertEqual(state["detected_items"], ["apple", "milk"])
+        self.assertEqual(state["result"], {"count": 2})
+        other.shutdown()
+
+    def test_jobs_of_exited_processes_fail(self):
+        exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                                capture_output=True, text=True).stdout.strip()
+        with database.get_connection() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, job_key, status, owner, submitted_at) VALUES ('orphan', 'folder', 'running', ?, ?)",
+                (int(exited), time.time())
+            )
+        queue = JobQueue(self.blocking_worker)
+        state = queue.get("orphan").to_dict()
+        self.assertEqual(state["status"], "failed")
+        self.assertIn("exited", state["error"])
+        self.release.set()
+        self.assertTrue(queue.submit("folder", ["apple"])[1])
+        queue.shutdown()
+
+if __name__ == "__main__":
+    unittest.main()
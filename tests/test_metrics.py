@@ -0,0 +1,74 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from src.cloud import metrics
+import src.cloud.app as app_module
+import src.cloud.database as database
+from tests.test_database import DatabaseTestCase
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram("test_seconds", "Test latency", ["stage"], buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            histogram.observe(value, "decode")
+        samples = {(name, labels): value for name, labels, value in histogram.samples()}
+        self.assertEqual(samples[("test_seconds_bucket", '{stage="decode",le="0.1"}')], 1)
+        self.assertEqual(samples[("test_seconds_bucket", '{stage="decode",le="1.0"}')], 3)
+        self.assertEqual(samples[("test_seconds_bucket", '{stage="decode",le="+Inf"}')], 4)
+        self.assertEqual(samples[("test_seconds_count", '{stage="decode"}')], 4)
+        self.assertAlmostEqual(samples[("test_seconds_sum", '{stage="decode"}')], 4.05)
+
+    def test_label_values_are_escaped(self):
+        counter = metrics.Counter("test_total", "Test counter", ["name"])
+        counter.inc('say "hi"\n', amount=2)
+        self.assertEqual(counter.samples(), [("test_total", '{name="say \\"hi\\"\\n"}', 2)])
+
+    def test_disabled_metrics_record_nothing(self):
+        histogram = metrics.Histogram("test_seconds", "Test latency")
+        function = lambda: 1
+        with patch.object(metrics, "enabled", False):
+            with histogram.time():
+                pass
+            self.assertIs(metrics.timed(histogram)(function), function)
+        self.assertEqual(histogram.samples(), [])
+
+class TestMetricsEndpoint(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = app_module.app.test_client()
+
+    def test_metrics_endpoint_reports_requests_and_database_calls(self):
+        self.client.get("/api/inventory")
+        database.fetch_inventory()
+        database.fetch_inventory()
+        body = self.client.get("/api/metrics").get_data(as_text=True)
+        self.assertIn("# TYPE sepp_http_request_seconds histogram", body)
+        self.assertIn('sepp_http_request_seconds_count{method="GET",endpoint="/api/inventory",status="200"}', body)
+        self.assertIn('sepp_db_call_seconds_count{function="stream_inventory"}', body)
+        self.assertIn('sepp_cache_requests_total{cache="read",result="hit"}', body)
+        self.assertIn('sepp_db_transactions_total{outcome="commit"}', body)
+
+    def test_streamed_response_is_timed_until_sent(self):
+        database.apply_inventory_batch({f"item{i}": 1 for i in range(12)})
+        send_chunks = app_module.json_array_chunks
+
+        def slow_chunks(rows):
+            for chunk in send_chunks(rows):
+                time.sleep(0.05)
+                yield chunk
+
+        labels = ("GET", "/api/inventory", 200)
+        before = app_module.REQUEST_SECONDS.values.get(labels, [None, 0.0])[1]
+        with patch.object(database, "CACHED_LISTING_ROWS", 5), patch.object(app_module, "json_array_chunks", slow_chunks):
+            response = self.client.get("/api/inventory")
+            self.assertEqual(response.get_json(), database.fetch_inventory())
+            response.close()
+        self.assertGreater(app_module.REQUEST_SECONDS.values[labels][1] - before, 0.1)
+
+    def test_metrics_endpoint_when_disabled(self):
+        with patch.object(metrics, "enabled", False):
+            self.assertEqual(self.client.get("/api/metrics").status_code, 404)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+from unittest.mock import patch
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+from src.camera.model_server import ModelServer, RemoteModel
+from src.camera.simulation import detect_items_from_images, CONFIDENCE_THRESHOLD, VALID_FOOD_KEYWORDS, MANUAL_MAPPINGS
+
+class StandInModel:
+    """Predicts class (first pixel value) with probability 0.9 and records each batch size."""
+
+    cache_identity = "stand-in"
+
+    def __init__(self, classes=1000):
+        self.classes = classes
+        self.batch_sizes = []
+        self.lock = threading.Lock()
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        with self.lock:
+            self.batch_sizes.append(len(batch))
+        predictions = np.zeros((len(batch), self.classes), dtype=np.float32)
+        predictions[np.arange(len(batch)), batch[:, 0, 0, 0].astype(int)] = 0.9
+        return predictions
+
+class TestModelServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmp.name, "model.sock")
+        self.model = StandInModel()
+        self.server = ModelServer(self.socket_path, self.model, max_batch=8, window=0.2)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(timeout=5)
+        self.tmp.cleanup()
+
+    def images(self, *classes):
+        batch = np.zeros((len(classes), 224, 224, 3), dtype=np.float32)
+        batch[:, 0, 0, 0] = classes
+        return batch
+
+    def test_remote_predict_matches_local_model(self):
+        remote = RemoteModel(self.socket_path)
+        batch = self.images(3, 7, 11)
+        np.testing.assert_array_equal(remote.predict(batch), StandInModel().predict(batch))
+        self.assertEqual(remote.cache_identity, "stand-in")
+        remote.close()
+
+    def test_concurrent_requests_are_merged(self):
+        results = {}
+        start = threading.Barrier(4)
+
+        def worker(i):
+            remote = RemoteModel(self.socket_path)
+            start.wait()
+            results[i] = remote.predict(self.images(i, i + 10)).argmax(axis=1).tolist()
+            remote.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        self.assertEqual(results, {i: [i, i + 10] for i in range(4)})
+        self.assertEqual(sum(self.model.batch_sizes), 8)
+        self.assertLess(len(self.model.batch_sizes), 4)
+
+    def test_errors_are_reported_to_the_client(self):
+        remote = RemoteModel(self.socket_path)
+        with patch.object(self.model, "predict", side_effect=RuntimeError("out of memory")):
+            with self.assertRaises(RuntimeError):
+                remote.predict(self.images(1))
+        self.assertEqual(remote.predict(self.images(2)).argmax(), 2)  # connection still usable
+        remote.close()
+
+    def test_timed_out_reply_is_not_read_by_next_request(self):
+        remote = RemoteModel(self.socket_path, timeout=0.3)
+        original_predict = self.model.predict
+
+        def slow_predict(batch, batch_size=None, verbose=0):
+            time.sleep(0.6)
+            return original_predict(batch)
+        with patch.object(self.model, "predict", side_effect=slow_predict):
+            with self.assertRaises(OSError):
+                remote.predict(self.images(1))
+        time.sleep(0.5)  # let the late reply arrive
+        self.assertEqual(remote.predict(self.images(2)).argmax(), 2)
+        remote.close()
+
+    def test_second_server_on_same_socket_is_refused(self):
+        with self.assertRaises(RuntimeError):
+            ModelServer(self.socket_path, self.model)
+
+    @patch("src.camera.simulation.preprocess_image")
+    @patch("src.camera.simulation.imagenet_labels")
+    def test_detection_through_remote_model(self, mock_imagenet_labels, mock_preprocess_image):
+        labels = ["apple", "screwdriver", "orange"]
+        self.model.classes = len(labels)
+        mock_imagenet_labels.return_value = labels
+
+        def preprocess(path, datagen, out=None):
+            out[...] = int(path[-5])
+            return out[np.newaxis]
+        mock_preprocess_image.side_effect = preprocess
+        image_folder = os.path.join(self.tmp.name, "images")
+        os.mkdir(image_folder)
+        for i in range(3):
+            open(os.path.join(image_folder, f"image{i}.jpg"), "wb").close()
+
+        remote = RemoteModel(self.socket_path)
+        detected = detect_items_from_images(image_folder, remote, None, CONFIDENCE_THRESHOLD, VALID_FOOD_KEYWORDS,
+                                            MANUAL_MAPPINGS, batch_size=3)
+        self.assertEqual(sorted(detected), ["apple", "orange"])
+        remote.close()
+
+if __name__ == "__main__":
+    unittest.main()
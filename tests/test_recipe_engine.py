@@ -0,0 +1,75 @@
+import unittest
+import os
+import random
+import tempfile
+
+import src.cloud.database as database
+import src.cloud.recipe_engine as recipe_engine
+from src.cloud.recipe_engine import RecipeEngine
+
+class TestRecipeEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = RecipeEngine(["bread", "butter", "cheese"], [
+            (1, "Toast", ["bread", "butter"]),
+            (2, "Cheese Toast", ["bread", "butter", "cheese"]),
+            (3, "Fondue", ["cheese", "wine", "bread"]),
+            (4, "Omelette", ["egg", "milk", "cheese"]),
+        ])
+
+    def test_ranks_by_missing_then_coverage(self):
+        suggestions = self.engine.suggest({"bread": 2, "butter": 1, "cheese": 1}, k=5, max_missing=1)
+        self.assertEqual([s["recipe_name"] for s in suggestions], ["Toast", "Cheese Toast", "Fondue"])
+        self.assertEqual(suggestions[2]["missing"], ["wine"])
+        self.assertAlmostEqual(suggestions[2]["coverage"], 2 / 3, places=3)
+
+    def test_servings_break_ties(self):
+        engine = RecipeEngine([], [(1, "Toast", ["bread", "butter"]), (2, "Cheese Plate", ["cheese", "crackers"])])
+        suggestions = engine.suggest({"bread": 1, "butter": 4, "cheese": 3, "crackers": 2}, k=2)
+        self.assertEqual([(s["recipe_name"], s["servings"]) for s in suggestions], [("Cheese Plate", 2), ("Toast", 1)])
+
+    def test_matches_brute_force_on_random_catalog(self):
+        rng = random.Random(1)
+        vocabulary = [f"item{i}" for i in range(40)]
+        recipes = [(i, f"Recipe {i}", rng.sample(vocabulary, rng.randint(1, 8))) for i in range(300)]
+        inventory = {name: rng.randint(0, 3) for name in rng.sample(vocabulary, 25)}
+        engine = RecipeEngine(vocabulary[:10], recipes)
+
+        def missing(ingredients):
+            return sum(1 for name in ingredients if inventory.get(name, 0) <= 0)
+        expected = sorted(
+            (r for r in recipes if missing(r[2]) <= 2),
+            key=lambda r: (missing(r[2]), -(len(r[2]) - missing(r[2])) / len(r[2]),
+                           -min([inventory[n] for n in r[2] if inventory.get(n, 0) > 0], default=0), r[0])
+        )
+        suggestions = engine.suggest(inventory, k=20, max_missing=2)
+        self.assertEqual([s["recipe_name"] for s in suggestions], [r[1] for r in expected[:20]])
+
+    def test_empty_catalog(self):
+        self.assertEqual(RecipeEngine(["bread"], []).suggest({"bread": 1}), [])
+
+class TestRecipeEngineRebuild(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.original_db_path = database.db_path
+        database.db_path = os.path.join(self.tmp.name, "inventory.db")
+        database.initialize_database()
+
+    def tearDown(self):
+        database.close_connections()
+        database.db_path = self.original_db_path
+        recipe_engine._engine = None
+        self.tmp.cleanup()
+
+    def test_engine_is_rebuilt_when_recipes_change(self):
+        first = recipe_engine.get_recipe_engine()
+        self.assertIs(recipe_engine.get_recipe_engine(), first)
+        database.add_to_inventory("bread", 1)
+        self.assertIs(recipe_engine.get_recipe_engine(), first)
+
+        database.add_recipe("Toast", ["bread", "butter"])
+        suggestions = recipe_engine.suggest_recipes(k=10, max_missing=1)
+        self.assertIsNot(recipe_engine.get_recipe_engine(), first)
+        self.assertIn("Toast", [s["recipe_name"] for s in suggestions])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import os
+import sqlite3
+import tempfile
+import threading
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator # type: ignore
@@ -9,11 +12,46 @@ from src.camera.simulation import (
     normalize_string,
     preprocess_image,
     predict_image,
+    resolve_predictions,
     detect_items_from_images,
+    iter_detections,
+    ingest_folder,
+    watch_folder,
+    augment_batch,
+    make_datagen,
+    TTAModel,
+    BATCH_SIZE,
     VALID_FOOD_KEYWORDS,
     MANUAL_MAPPINGS,
     CONFIDENCE_THRESHOLD
 )
+from src.camera.prediction_cache import PredictionCache
+from src.camera.manifest import IngestManifest
+
+def fill(out, value):
+    """Stand-in for preprocess_image: write a constant image into the batch buffer row."""
+    out[...] = value
+    return out[np.newaxis]
+
+SAMPLE_IMAGES = os.path.join(os.path.dirname(__file__), "..", "src", "camera", "images")
+MOBILENET_WEIGHTS = os.path.join(
+    os.path.expanduser("~"), ".keras", "models", "mobilenet_v2_weights_tf_dim_ordering_tf_kernels_1.0_224.h5"
+)
+
+def keras_preprocessed(path):
+    """The reference input: Keras' load_img decode and resize, then mobilenet_v2.preprocess_input."""
+    from tensorflow.keras.applications.mobilenet_v2 import preprocess_input  # type: ignore
+    from tensorflow.keras.preprocessing.image import load_img, img_to_array  # type: ignore
+    return preprocess_input(img_to_array(load_img(path, target_size=(224, 224))))
+
+def write_image(path, size, image_format):
+    """Write a smooth synthetic photo-like image."""
+    from PIL import Image
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    pixels = np.stack([
+        127 + 100 * np.sin(x / size[0] * 6), 127 + 100 * np.cos(y / size[1] * 5), (x + y) / (size[0] + size[1]) * 255
+    ], axis=-1).astype(np.uint8)
+    Image.fromarray(pixels).save(path, image_format, **({"quality": 90} if image_format == "JPEG" else {}))
 
 class TestSimulation(unittest.TestCase):
     def setUp(self):
@@ -29,46 +67,99 @@ class TestSimulation(unittest.TestCase):
         self.assertEqual(normalize_string("French_Loaf"), "french loaf")
         self.assertEqual(normalize_string("TurkeyBreast"), "turkeybreast")
 
-    @patch("tensorflow.keras.preprocessing.image.load_img")
-    @patch("tensorflow.keras.preprocessing.image.img_to_array")
-    def test_preprocess_image(self, mock_img_to_array, mock_load_img):
-        mock_load_img.return_value = MagicMock()  # Mock PIL Image object
-        mock_img_to_array.return_value = np.zeros((224, 224, 3))  # Mock image array
-        image_array = preprocess_image("test_image.jpg", self.datagen)
-        self.assertEqual(image_array.shape, (1, 224, 224, 3))
-
-
-    def test_predict_image_valid(self):
-        with patch("tensorflow.keras.applications.mobilenet_v2.decode_predictions") as mock_decode_predictions:
-            mock_decode_predictions.return_value = [[
-                ("n123", "apple", 0.7),
-                ("n456", "carrot", 0.4),
-                ("n789", "dough", 0.1)
-            ]]
-            result = predict_image(
-                self.model,
-                tf.zeros((1, 224, 224, 3)),
-                self.confidence_threshold,
-                self.valid_food_keywords,
-                self.manual_mappings
-            )
-            self.assertEqual(result[0], "apple")
-
-    def test_predict_image_manual_mapping(self):
-        with patch("tensorflow.keras.applications.mobilenet_v2.decode_predictions") as mock_decode_predictions:
-            mock_decode_predictions.return_value = [[
-                ("n123", "french loaf", 0.6), # should map to chicken breast fingers crossed
-                ("n456", "carrot", 0.3),
-                ("n789", "dough", 0.1)
-            ]]
-            result = predict_image(
-                self.model,
-                tf.zeros((1, 224, 224, 3)),
-                self.confidence_threshold,
-                self.valid_food_keywords,
-                self.manual_mappings
-            )
-            self.assertEqual(result[0], "chicken breast")
+    def test_preprocess_image(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "test_image.jpg")
+            write_image(path, (640, 480), "JPEG")
+            out = np.empty((224, 224, 3), dtype=np.float32)
+            image_array = preprocess_image(path, self.datagen, out=out)
+            self.assertEqual(image_array.shape, (1, 224, 224, 3))
+            self.assertTrue(np.shares_memory(image_array, out))
+            self.assertTrue(-1.0 <= image_array.min() and image_array.max() <= 1.0)
+
+    def test_decoding_matches_keras_preprocessing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, size, image_format, tolerance in [
+                ("large.jpg", (4000, 3000), "JPEG", 0.01),  # decoded at 1/8 scale in draft mode
+                ("small.png", (300, 200), "PNG", 1e-6),  # no draft mode: identical
+            ]:
+                path = os.path.join(tmp, name)
+                write_image(path, size, image_format)
+                actual = preprocess_image(path, None)[0]
+                self.assertLess(np.abs(actual - keras_preprocessed(path)).mean(), tolerance, name)
+
+    def test_decoding_stays_close_to_keras_on_sample_photos(self):
+        # Draft-mode decoding of real photos is not pixel-identical to Keras: the repo's images
+        # differ by a mean of 0.006-0.072 (Lobster.JPG) and up to ~1.5 on single pixels
+        for name in sorted(os.listdir(SAMPLE_IMAGES)):
+            path = os.path.join(SAMPLE_IMAGES, name)
+            actual = preprocess_image(path, None)[0]
+            self.assertLess(np.abs(actual - keras_preprocessed(path)).mean(), 0.1, name)
+
+    @unittest.skipUnless(os.path.exists(MOBILENET_WEIGHTS), "ImageNet weights for MobileNetV2 are not cached")
+    def test_detections_match_keras_preprocessing_on_sample_photos(self):
+        from tensorflow.keras.applications import MobileNetV2  # type: ignore
+        model = MobileNetV2(weights="imagenet")
+        for name in sorted(os.listdir(SAMPLE_IMAGES)):
+            path = os.path.join(SAMPLE_IMAGES, name)
+            expected = model.predict(keras_preprocessed(path)[np.newaxis], verbose=0)
+            actual = model.predict(preprocess_image(path, None), verbose=0)
+            self.assertEqual(int(np.argmax(actual)), int(np.argmax(expected)), name)
+
+    @patch("src.camera.simulation.imagenet_labels")
+    def test_predict_image_valid(self, mock_imagenet_labels):
+        mock_imagenet_labels.return_value = ["apple", "carrot", "dough", "screwdriver"]
+        self.model.predict.return_value = np.array([[0.7, 0.4, 0.1, 0.0]])
+        result = predict_image(
+            self.model,
+            tf.zeros((1, 224, 224, 3)),
+            self.confidence_threshold,
+            self.valid_food_keywords,
+            self.manual_mappings
+        )
+        self.assertEqual(result[0], "apple")
+
+    @patch("src.camera.simulation.imagenet_labels")
+    def test_predict_image_manual_mapping(self, mock_imagenet_labels):
+        mock_imagenet_labels.return_value = ["French_loaf", "carrot", "dough", "screwdriver"]
+        # french loaf should map to chicken breast fingers crossed
+        self.model.predict.return_value = np.array([[0.6, 0.3, 0.1, 0.0]])
+        result = predict_image(
+            self.model,
+            tf.zeros((1, 224, 224, 3)),
+            self.confidence_threshold,
+            self.valid_food_keywords,
+            self.manual_mappings
+        )
+        self.assertEqual(result[0], "chicken breast")
+
+    @patch("src.camera.simulation.imagenet_labels")
+    def test_resolve_predictions_matches_top5_scan(self, mock_imagenet_labels):
+        labels = [f"class_{i}" for i in range(1000)]
+        for class_id, label in [(3, "apple"), (7, "Granny_Smith"), (12, "lotion"), (50, "French_loaf"), (51, "orange")]:
+            labels[class_id] = label
+        mock_imagenet_labels.return_value = labels
+        rng = np.random.default_rng(0)
+        predictions = rng.dirichlet(np.full(1000, 0.02), size=200)
+        predictions[:, [3, 12, 50, 51]] += rng.uniform(0, 0.6, (200, 4))
+
+        def reference(row):
+            # Per-image semantics of the original decode_predictions-based predict_image
+            top_predictions = []
+            for i, class_id in enumerate(np.argsort(row)[::-1][:5]):
+                label, confidence = normalize_string(labels[class_id]), row[class_id]
+                if confidence > self.confidence_threshold.get(i, 0.2):
+                    if label in self.manual_mappings:
+                        top_predictions.append((self.manual_mappings[label], confidence))
+                    elif label in self.valid_food_keywords:
+                        top_predictions.append((label, confidence))
+            return max(top_predictions, key=lambda x: x[1]) if top_predictions else None
+
+        results = resolve_predictions(
+            predictions, self.confidence_threshold, self.valid_food_keywords, self.manual_mappings
+        )
+        self.assertEqual(results, [reference(row) for row in predictions])
+        self.assertTrue(any(results) and not all(results))
 
     @patch("os.listdir")
     @patch("src.camera.simulation.preprocess_image")
@@ -88,5 +179,231 @@ class TestSimulation(unittest.TestCase):
         )
         self.assertEqual(detected_items, ["apple", "banana"])
 
+    @patch("os.listdir")
+    @patch("src.camera.simulation.preprocess_image")
+    @patch("src.camera.simulation.imagenet_labels")
+    def test_detect_items_batched_matches_per_image(self, mock_imagenet_labels, mock_preprocess_image, mock_listdir):
+        labels = ["apple", "french_loaf", "screwdriver", "orange", "lotion"]
+        mock_listdir.return_value = [f"image{i}.jpg" for i in range(len(labels))]
+        mock_preprocess_image.side_effect = lambda path, datagen, out=None: fill(out, int(path[-5]))
+
+        def predict(batch, **kwargs):
+            predictions = np.zeros((len(batch), len(labels)))
+            predictions[np.arange(len(batch)), batch[:, 0, 0, 0].astype(int)] = 0.9
+            return predictions
+        self.model.predict.side_effect = predict
+        mock_imagenet_labels.return_value = labels
+
+        args = (self.image_folder, self.model, self.datagen, self.confidence_threshold,
+                self.valid_food_keywords, self.manual_mappings)
+        per_image = detect_items_from_images(*args)
+        batched = detect_items_from_images(*args, batch_size=2)
+        self.assertEqual(batched, per_image)
+        self.assertEqual(batched, ["apple", "chicken breast", "orange", "milk"])
+        self.assertEqual(self.model.predict.call_count, len(labels) + 3)
+        self.assertGreater(BATCH_SIZE, 1)
+
+    @patch("os.listdir")
+    @patch("src.camera.simulation.preprocess_image")
+    @patch("src.camera.simulation.predict_batch")
+    def test_iter_detections_skips_unreadable_images(self, mock_predict_batch, mock_preprocess_image, mock_listdir):
+        mock_listdir.return_value = ["image1.jpg", "broken.jpg", "notes.txt", "image2.jpg"]
+
+        def preprocess(path, datagen, out=None):
+            if path.endswith(".txt"):
+                self.fail("non-image files should not be decoded")
+            if path.endswith("broken.jpg"):
+                raise ValueError("cannot identify image file")
+            return fill(out, 0)
+        mock_preprocess_image.side_effect = preprocess
+        mock_predict_batch.return_value = [("apple", 0.6), None]
+
+        results = list(iter_detections(
+            self.image_folder,
+            self.model,
+            self.datagen,
+            self.confidence_threshold,
+            self.valid_food_keywords,
+            self.manual_mappings,
+            batch_size=4
+        ))
+        self.assertEqual(results, [("image1.jpg", ("apple", 0.6)), ("image2.jpg", None)])
+        self.assertEqual(mock_predict_batch.call_args[0][1].shape, (2, 224, 224, 3))
+
+    @patch("src.camera.simulation.preprocess_image")
+    @patch("src.camera.simulation.predict_batch")
+    def test_prediction_cache_skips_unchanged_images(self, mock_predict_batch, mock_preprocess_image):
+        with tempfile.TemporaryDirectory() as tmp:
+            image_folder = os.path.join(tmp, "images")
+            os.mkdir(image_folder)
+            for name, content in [("a.jpg", b"apple"), ("b.jpg", b"blank")]:
+                with open(os.path.join(image_folder, name), "wb") as file:
+                    file.write(content)
+            mock_preprocess_image.side_effect = lambda path, datagen, out=None: fill(out, path.endswith("a.jpg"))
+            mock_predict_batch.side_effect = lambda model, batch, *args: [
+                ("apple", 0.6) if image[0, 0, 0] else None for image in batch
+            ]
+            self.model.cache_identity = "stub-model"
+            cache = PredictionCache(os.path.join(tmp, "cache.db"))
+            args = (image_folder, self.model, None, self.confidence_threshold,
+                    self.valid_food_keywords, self.manual_mappings)
+
+            first = sorted(iter_detections(*args, batch_size=2, cache=cache), key=lambda x: x[0])
+            second = sorted(iter_detections(*args, batch_size=2, cache=cache), key=lambda x: x[0])
+
+            self.assertEqual(first, [("a.jpg", ("apple", 0.6)), ("b.jpg", None)])
+            self.assertEqual(second, first)
+            self.assertEqual(mock_predict_batch.call_count, 1)
+            self.assertEqual(mock_preprocess_image.call_count, 2)
+            self.assertEqual(cache.stats(), {"hits": 2, "misses": 2, "entries": 2})
+
+            # A different mapping configuration must not reuse the cached predictions
+            other = dict(self.manual_mappings, apple="orange")
+            list(iter_detections(image_folder, self.model, None, self.confidence_threshold,
+                                 self.valid_food_keywords, other, batch_size=2, cache=cache))
+            self.assertEqual(mock_predict_batch.call_count, 2)
+
+            # Randomly augmented predictions are neither served from nor written to the cache
+            list(iter_detections(image_folder, self.model, self.datagen, self.confidence_threshold,
+                                 self.valid_food_keywords, self.manual_mappings, batch_size=2, cache=cache))
+            self.assertEqual(mock_predict_batch.call_count, 3)
+            self.assertEqual(cache.stats()["entries"], 4)
+
+    def test_prediction_cache_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = PredictionCache(os.path.join(tmp, "cache.db"), max_entries=2)
+            cache.put("ns:a", ("apple", 0.9))
+            cache.put("ns:b", None)
+            cache.get("ns:a")
+            cache.put("ns:c", ("milk", 0.7))
+            self.assertEqual(cache.get("ns:a"), (True, ("apple", 0.9)))
+            self.assertEqual(cache.get("ns:b"), (False, None))
+            self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_prediction_cache_batches_last_used_writes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.db")
+            cache = PredictionCache(path)
+            cache.put_many([(f"ns:{i}", None) for i in range(3)])
+            reader = sqlite3.connect(path)
+            before = dict(reader.execute("SELECT key, last_used FROM prediction_cache"))
+            for i in range(3):
+                cache.get(f"ns:{i}")
+            self.assertEqual(dict(reader.execute("SELECT key, last_used FROM prediction_cache")), before)
+            cache.flush()
+            after = dict(reader.execute("SELECT key, last_used FROM prediction_cache"))
+            self.assertTrue(all(after[key] > before[key] for key in before))
+            self.assertEqual(reader.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            reader.close()
+
+class TestTestTimeAugmentation(unittest.TestCase):
+    def test_default_preprocessing_is_deterministic(self):
+        self.assertIsNone(make_datagen())
+
+    def test_augment_batch_layout(self):
+        batch = np.random.default_rng(0).uniform(-1, 1, (2, 4, 5, 3)).astype(np.float32)
+        augmented = augment_batch(batch, 4)
+        self.assertEqual(augmented.shape, (8, 4, 5, 3))
+        np.testing.assert_array_equal(augmented[4], batch[1])  # image 1, identity
+        np.testing.assert_array_equal(augmented[5], batch[1][:, ::-1])  # image 1, flipped
+        np.testing.assert_allclose(augmented[2], np.clip((batch[0] + 1) * 0.8 - 1, -1, 1), rtol=1e-6)
+        self.assertLessEqual(augmented.max(), 1.0)
+        with self.assertRaises(ValueError):
+            augment_batch(batch, 7)
+
+    def test_tta_model_averages_variants_in_one_call(self):
+        model = MagicMock()
+        model.predict.side_effect = lambda batch, **kwargs: batch.reshape(len(batch), -1)[:, :3] + 1
+        batch = np.random.default_rng(1).uniform(-1, 1, (3, 2, 2, 3)).astype(np.float32)
+        predictions = TTAModel(model, 3).predict(batch)
+        model.predict.assert_called_once()
+        expected = augment_batch(batch, 3).reshape(3, 3, -1)[:, :, :3].mean(axis=1) + 1
+        np.testing.assert_allclose(predictions, expected, rtol=1e-6)
+        self.assertEqual(predictions.shape, (3, 3))
+
+class TestIngestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.image_folder = os.path.join(self.tmp.name, "images")
+        os.mkdir(self.image_folder)
+        self.manifest = IngestManifest(os.path.join(self.tmp.name, "state.db"))
+        # The stub detector reads the item name from the file contents
+        detections = patch("src.camera.simulation.iter_detections", side_effect=self.fake_detections)
+        self.mock_iter_detections = detections.start()
+        self.addCleanup(detections.stop)
+        apply_batch = patch("src.camera.simulation.apply_inventory_batch")
+        self.mock_apply_batch = apply_batch.start()
+        self.addCleanup(apply_batch.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def fake_detections(self, image_folder, *args, image_files=None, **kwargs):
+        for image_file in image_files:
+            with open(os.path.join(image_folder, image_file)) as file:
+                item = file.read()
+            yield image_file, ((item, 0.9) if item else None)
+
+    def write(self, name, content):
+        with open(os.path.join(self.image_folder, name), "w") as file:
+            file.write(content)
+
+    def ingest(self, **kwargs):
+        return ingest_folder(self.image_folder, MagicMock(), None, CONFIDENCE_THRESHOLD, VALID_FOOD_KEYWORDS,
+                             MANUAL_MAPPINGS, self.manifest, **kwargs)
+
+    def test_only_new_or_changed_images_are_processed(self):
+        self.write("a.jpg", "apple")
+        self.write("b.jpg", "")
+        self.write("notes.txt", "milk")
+        self.assertEqual(self.ingest(), ["apple"])
+        self.mock_apply_batch.assert_called_once_with(additions=["apple"])
+        self.assertEqual(self.ingest(), [])
+        self.assertEqual(self.mock_iter_detections.call_count, 1)
+
+        self.write("c.jpg", "bread")
+        os.utime(os.path.join(self.image_folder, "a.jpg"), ns=(1, 1))  # touched, same detection
+        self.assertEqual(self.ingest(), ["bread"])
+        self.assertEqual(sorted(self.mock_iter_detections.call_args.kwargs["image_files"]), ["a.jpg", "c.jpg"])
+
+    def test_failed_inventory_write_is_retried(self):
+        self.write("a.jpg", "apple")
+        self.mock_apply_batch.side_effect = sqlite3.OperationalError("database is locked")
+        with self.assertRaises(sqlite3.OperationalError):
+            self.ingest()
+        self.mock_apply_batch.side_effect = None
+        self.assertEqual(self.ingest(), ["apple"])
+
+    def test_deleted_files_are_forgotten(self):
+        self.write("a.jpg", "apple")
+        self.ingest()
+        os.remove(os.path.join(self.image_folder, "a.jpg"))
+        self.ingest()
+        self.write("a.jpg", "apple")
+        self.assertEqual(self.ingest(), ["apple"])
+
+    def test_renamed_files_are_not_counted_again(self):
+        self.write("a.jpg", "apple")
+        self.assertEqual(self.ingest(), ["apple"])
+        os.rename(os.path.join(self.image_folder, "a.jpg"), os.path.join(self.image_folder, "b.jpg"))
+        self.assertEqual(self.ingest(), [])
+        self.assertEqual(self.mock_iter_detections.call_count, 1)
+        self.assertEqual(self.manifest.changes(self.image_folder), {})
+
+    def test_watch_picks_up_new_files(self):
+        stop = threading.Event()
+        seen = []
+        self.mock_apply_batch.side_effect = lambda additions: (seen.extend(additions), stop.set() if "milk" in seen else None)
+        self.write("a.jpg", "apple")
+        watcher = threading.Thread(target=watch_folder, args=(
+            self.image_folder, MagicMock(), None, CONFIDENCE_THRESHOLD, VALID_FOOD_KEYWORDS, MANUAL_MAPPINGS,
+            self.manifest), kwargs={"interval": 0.05, "settle": 0.0, "stop_event": stop})
+        watcher.start()
+        self.write("b.jpg", "milk")
+        watcher.join(timeout=5)
+        stop.set()
+        self.assertFalse(watcher.is_alive())
+        self.assertEqual(seen, ["apple", "milk"])
+
 if __name__ == "__main__":
     unittest.main()